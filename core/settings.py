@@ -41,6 +41,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'tools.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -77,6 +78,11 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        #toolsworker threads and the web process write to the same file
+        'OPTIONS': {'timeout': 20},
+        #tests too use a file: an in-memory database is opened in shared-cache mode, where a thread
+        #that finds a table locked fails at once instead of waiting for the timeout above
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
@@ -118,5 +124,106 @@ USE_TZ = True
 STATIC_URL = 'static/'
 
 
-#view file hash size
-MAX_UPLOAD_FILE_SIZE = 5 * 1024 * 1024
+#view file hash size (uploads are hashed while streaming, so this costs no memory): per file, and for the
+#whole request (checked against Content-Length before the body is read; compare mode sends two files)
+MAX_UPLOAD_FILE_SIZE = 8 * 1024 * 1024 * 1024
+MAX_HASH_REQUEST_SIZE = 2 * MAX_UPLOAD_FILE_SIZE
+HASH_THREADS = 4
+
+#image tool uploads: whole-request cap, checked against Content-Length before the body is read
+MAX_IMAGE_UPLOAD_SIZE = 50 * 1024 * 1024
+
+#processed image results: files under ROOT, shared by every worker process (put ROOT on storage all
+#servers can reach when running more than one), kept RESULT_CACHE_TIMEOUT seconds and pruned oldest
+#first past MAX_BYTES, checked at most every PRUNE_INTERVAL seconds
+RESULT_STORE = {
+    "ROOT": BASE_DIR / "results",
+    "MAX_BYTES": 1024 * 1024 * 1024,
+    "PRUNE_INTERVAL": 60,
+}
+RESULT_CACHE_TIMEOUT = 60 * 60
+#cache for small per-image hints such as target-size compression curves
+RESULT_CACHE_ALIAS = "default"
+INLINE_RESULT_MAX_SIZE = 32 * 1024
+
+#PNG optimizer: seconds per image spent trying zlib settings after the first one
+PNG_OPTIMIZE_TIME_BUDGET = 2.0
+
+#/pipeline/ and pipeline jobs: longest operation list accepted (each step of an "adjust" chain counts)
+PIPELINE = {
+    "MAX_OPERATIONS": 32,
+}
+
+#watermark font: path to a TrueType/OpenType file, or None for Pillow's bundled font
+WATERMARK_FONT = None
+
+#preview-first responses: longest side and WEBP quality of the quick preview
+IMAGE_PREVIEW = {
+    "MAX_SIZE": 800,
+    "QUALITY": 50,
+}
+
+#tiled processing of images too large to decode at once (PNG and PGM/PPM in, PNG out): pixels per
+#full-width strip, the largest image accepted, and the upload cap for image jobs
+IMAGE_TILING = {
+    "STRIP_PIXELS": 1024 * 1024,
+    "MAX_PIXELS": 20 * 1000 * 1000 * 1000,
+    "MAX_UPLOAD_SIZE": 8 * 1024 * 1024 * 1024,
+}
+
+#header-only image inspection: bytes read per file before trying to parse its header (doubled until
+#it parses), the most kept per file (formats whose frame count needs the whole file are kept whole up
+#to this), and files per request
+IMAGE_INSPECT = {
+    "HEAD_BYTES": 64 * 1024,
+    "MAX_BYTES": 32 * 1024 * 1024,
+    "MAX_FILES": 100,
+}
+
+#background jobs run by "manage.py toolsworker": inputs and outputs live in ROOT/<job id>/, finished
+#jobs are deleted TTL seconds after they finish, and running jobs older than STALE_AFTER are marked failed
+JOBS = {
+    "ROOT": BASE_DIR / "jobs",
+    "CONCURRENCY": 2,
+    "POLL_INTERVAL": 1.0,
+    "TTL": 24 * 60 * 60,
+    "STALE_AFTER": 60 * 60,
+    "CLEANUP_INTERVAL": 5 * 60,
+}
+
+#transform result cache: "memory", "filesystem" (LOCATION is a directory) or "django" (LOCATION is a cache alias)
+TRANSFORM_CACHE = {
+    "BACKEND": "memory",
+    "MAX_BYTES": 64 * 1024 * 1024,
+}
+
+#image processing executor: "process", "thread" or "inline"; MAX_WORKERS defaults to the CPU count
+IMAGE_EXECUTOR = {
+    "BACKEND": "process",
+    "MAX_WORKERS": None,
+    "MAX_QUEUE": 16,
+    "TIMEOUT": 30,
+}
+
+#image memory admission: estimated decoded bytes allowed for one job and for all in-flight jobs
+#together; jobs over REQUEST_BYTES are rejected, others wait up to QUEUE_TIMEOUT seconds for budget
+IMAGE_MEMORY = {
+    "REQUEST_BYTES": 512 * 1024 * 1024,
+    "TOTAL_BYTES": 2 * 1024 * 1024 * 1024,
+    "QUEUE_TIMEOUT": 10,
+}
+
+#per-tool request metrics, served at /metrics; SERVER_TIMING is True (every tool response),
+#False, or "request" (only when the client sends "X-Server-Timing: 1")
+METRICS = {
+    "SERVER_TIMING": "request",
+}
+
+#QR code caches: encoded module matrices by (data, error correction) and rendered PNG/SVG bytes
+QR_CACHE = {
+    "MATRIX_ENTRIES": 4096,
+    "RENDER_ENTRIES": 1024,
+}
+
+#Largest URL list accepted by /qr/bulk/ in one request
+QR_BULK_MAX_CODES = 20000
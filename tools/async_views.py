@@ -0,0 +1,141 @@
+from asgiref.sync import sync_to_async
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+
+from .upload_handlers import HashingUploadHandler
+from .utils.cache_utils import get_transform_cache
+from .utils.executor import get_executor
+from .utils.metrics import merge, set_labels, stage
+from .utils.qr_utils import make_qr_png
+from .views import (
+    _file_hash_form,
+    _file_hash_results,
+    _finish_target_size_job,
+    _image_compress_form,
+    _image_convert_form,
+    _image_filters_form,
+    _image_resize_form,
+    _image_watermark_form,
+    _preview_response,
+    _qr_form,
+    _qr_not_modified,
+    _qr_requested,
+    _read_upload,
+    _render_image_tool,
+    _render,
+    _render_qr,
+    _render_target_size,
+    _single_image,
+    _submit_image_job,
+    _submit_target_size_job,
+    _wants_preview,
+)
+
+
+# Multipart parsing, upload hashing and reads touch spooled temp files, and rendering a
+# result hashes and stores it before the template renders, so they all run on worker
+# threads; image work goes to the shared image executor.
+def _in_thread(func):
+    return sync_to_async(func, thread_sensitive=False)
+
+
+async def _acached_transform(job):
+    cache = get_transform_cache()
+    key = await _in_thread(cache.make_key)(job["image_file"], job["operation"], job["params"])
+
+    async def compute():
+        executor = get_executor()
+        data = await _in_thread(_read_upload)(job["image_file"])
+        # Waiting for memory budget blocks, so admission happens on a worker thread too.
+        future = await _in_thread(_submit_image_job)(executor, job, data)
+        data, stats = await executor.aresult(future)
+        merge(stats)
+        return data
+
+    set_labels(format=job["target_format"])
+    return await cache.aget_or_compute(key, compute)
+
+
+async def _image_tool_response(request, form, template_name):
+    context, job = _single_image(request, *await _in_thread(form)(request))
+    return await _image_job_response(request, template_name, context, job)
+
+
+async def _image_job_response(request, template_name, context, job):
+    if _wants_preview(request, context, job):
+        # The preview waits on the executor like the sync view does; only this request's
+        # worker thread blocks, and the full-quality job continues without it.
+        return await _in_thread(_preview_response)(request, template_name, context, job)
+
+    data = error = None
+    if job is not None:
+        try:
+            data = await _acached_transform(job)
+        except Exception as exc:
+            error = exc
+    return await _in_thread(_render_image_tool)(request, template_name, context, job, data, error)
+
+
+async def qr_view(request):
+    context = await _in_thread(_qr_form)(request)
+    not_modified = _qr_not_modified(request, context)
+    if not_modified is not None:
+        return not_modified
+
+    data = None
+    if _qr_requested(context):
+        set_labels(format="png")
+        with stage("encode"):
+            data = await _in_thread(make_qr_png)(context["url_value"])
+    return await _in_thread(_render_qr)(request, context, data)
+
+
+async def image_convert_view(request):
+    return await _image_tool_response(request, _image_convert_form, "tools/image_convert.html")
+
+
+async def image_compress_view(request):
+    context, job = _single_image(request, *await _in_thread(_image_compress_form)(request))
+    if job is None or job["operation"] != "compress_target":
+        return await _image_job_response(request, "tools/image_compress.html", context, job)
+
+    set_labels(format=job["target_format"])
+    executor = get_executor()
+    try:
+        future = await _in_thread(_submit_target_size_job)(executor, job)
+        result = await _in_thread(_finish_target_size_job)(job, *await executor.aresult(future))
+    except Exception as exc:
+        return await _in_thread(_render_target_size)(request, context, job, error=exc)
+    return await _in_thread(_render_target_size)(request, context, job, result)
+
+
+async def image_watermark_view(request):
+    return await _image_tool_response(request, _image_watermark_form, "tools/image_watermark.html")
+
+
+async def image_resize_view(request):
+    return await _image_tool_response(request, _image_resize_form, "tools/image_resize.html")
+
+
+async def image_filters_view(request):
+    return await _image_tool_response(request, _image_filters_form, "tools/image_filters.html")
+
+
+@csrf_exempt
+async def file_hash_view(request):
+    request.upload_handlers = [HashingUploadHandler(request)]
+    # Parsing the body runs the hashing upload handler; do it on a worker thread before the
+    # CSRF check reads request.POST from the event loop.
+    with stage("parse"):
+        await _in_thread(lambda: request.POST)()
+    return await _file_hash_view(request)
+
+
+@csrf_protect
+async def _file_hash_view(request):
+    context, uploaded_files, algorithm = await _in_thread(_file_hash_form)(request)
+
+    if uploaded_files:
+        with stage("hash"):
+            context = await _in_thread(_file_hash_results)(context, uploaded_files, algorithm)
+
+    return await _in_thread(_render)(request, "tools/file_hash.html", context)
@@ -0,0 +1,225 @@
+import json
+import os
+import shutil
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.uploadhandler import FileUploadHandler, StopUpload
+from django.db.models import Q
+from django.http import QueryDict
+from django.utils import timezone
+from django.utils.datastructures import MultiValueDict
+
+from .models import Job
+from .utils.admission import ImageTooLarge, estimate_image_memory, get_memory_budget, inspect_image
+from .utils.executor import MappedFile, run_transform
+from .utils.hash_utils import SUPPORTED_ALLGORITHMS, TREE_ALGORITHMS, MultiHasher
+from .utils.metrics import collect, stage
+from .utils.pipeline import run_pipeline
+from .utils.result_utils import CONTENT_TYPES
+from .utils.tiled import can_stream, estimate_tiled_memory, read_header, run_tiled_pipeline
+
+
+def job_directory(job_id):
+    return os.path.join(settings.JOBS["ROOT"], str(job_id))
+
+
+class StoredUpload:
+    def __init__(self, name, size, content_type, path):
+        self.name = name
+        self.size = size
+        self.content_type = content_type
+        self.path = path
+
+    def close(self):
+        pass
+
+
+class JobUploadHandler(FileUploadHandler):
+    # Streams the first uploaded file straight into the job's directory, so a multi-GB input
+    # is written once and never held in memory. Requests over max_size are refused like the
+    # image tools refuse them.
+    chunk_size = 1024 * 1024
+
+    def __init__(self, request=None, directory=None, max_size=None):
+        super().__init__(request)
+        self.directory = directory
+        self.max_size = max_size
+        self.received = 0
+        self.too_large = False
+        self.output = None
+        self.stored = False
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        if content_length > self.max_size:
+            self.too_large = True
+            return QueryDict(), MultiValueDict()
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        if not self.stored:
+            os.makedirs(self.directory, exist_ok=True)
+            self.output = open(os.path.join(self.directory, "input"), "wb")
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > self.max_size:
+            self.too_large = True
+            raise StopUpload(connection_reset=True)
+        if self.output is not None:
+            self.output.write(raw_data)
+        return None
+
+    def file_complete(self, file_size):
+        if self.output is None:
+            return None
+        self.output.close()
+        self.output, self.stored = None, True
+        return StoredUpload(self.file_name, file_size, self.content_type, os.path.join(self.directory, "input"))
+
+    def upload_interrupted(self):
+        if self.output is not None:
+            self.output.close()
+            self.output = None
+
+
+def create_job(job_id, kind, upload, params):
+    return Job.objects.create(
+        id=job_id,
+        kind=kind,
+        params=params,
+        input_name=upload.name,
+        input_path=upload.path,
+        input_size=upload.size,
+    )
+
+
+def claim_job(worker):
+    # The conditional update is the lock: if another worker claimed the row first, nothing is
+    # updated and the next queued job is tried.
+    while True:
+        job = Job.objects.filter(status=Job.Status.QUEUED).order_by("created_at").first()
+        if job is None:
+            return None
+        claimed = Job.objects.filter(pk=job.pk, status=Job.Status.QUEUED).update(
+            status=Job.Status.RUNNING, started_at=timezone.now(), worker=worker
+        )
+        if claimed:
+            job.refresh_from_db()
+            return job
+
+
+def _image_output(job, target_format):
+    extension = "jpg" if target_format == "jpeg" else target_format
+    stem = os.path.splitext(job.input_name)[0] or "processed"
+    job.output_name = f"{stem}.{extension}"
+    job.output_path = os.path.join(job_directory(job.id), f"output.{extension}")
+    job.content_type = CONTENT_TYPES[target_format]
+    return job.output_path
+
+
+def _run_tiled_image_job(job):
+    # Streams the input through the pipeline one strip at a time; only a window of rows is
+    # ever decoded, so the budget is checked for that window.
+    params = job.params
+    with open(job.input_path, "rb") as source:
+        size = read_header(source)["size"]
+    get_memory_budget().check(estimate_tiled_memory(size, params["operations"]))
+
+    with open(job.input_path, "rb") as source, open(_image_output(job, "png"), "wb") as destination:
+        written = run_tiled_pipeline(source, destination, params["operations"])
+    job.result = {"bytes": written, "tiled": True}
+
+
+def _run_image_job(job):
+    params = job.params
+    if params.get("tiled"):
+        return _run_tiled_image_job(job)
+
+    data = MappedFile(job.input_path, job.input_size)
+    # The same per-job limit as the web process; a worker runs one job per thread, so only
+    # the per-request part of the budget applies. Images too large for it are processed in
+    # strips instead when the input and output allow it.
+    try:
+        size, mode, _ = inspect_image(data)
+        get_memory_budget().check(estimate_image_memory(size, mode, params["operations"]))
+    except ImageTooLarge:
+        if params["target_format"] != "png" or not can_stream(job.input_path):
+            raise
+        return _run_tiled_image_job(job)
+
+    output = run_transform(run_pipeline, data, params)
+    with open(_image_output(job, params["target_format"]), "wb") as destination:
+        destination.write(output)
+    job.result = {"bytes": len(output)}
+
+
+def _run_hash_job(job):
+    # One read of the input feeds every algorithm, including the Merkle tree if requested.
+    algorithm = job.params["algorithm"]
+    algorithms = (*SUPPORTED_ALLGORITHMS, *([algorithm] if algorithm in TREE_ALGORITHMS else []))
+    hasher = MultiHasher(algorithms)
+    with open(job.input_path, "rb") as source, stage("hash"):
+        for chunk in File(source).chunks():
+            hasher.update(chunk)
+
+    hashes = hasher.hexdigests()
+    job.result = {"hash_value": hashes[algorithm], "hashes": hashes}
+    for manifest in hasher.manifests().values():
+        manifest["file_name"] = job.input_name
+        job.output_path = os.path.join(job_directory(job.id), "manifest.json")
+        with open(job.output_path, "w") as destination:
+            json.dump(manifest, destination, indent=2)
+        job.output_name = f"{job.input_name}.{algorithm}.json"
+        job.content_type = CONTENT_TYPES["json"]
+
+
+JOB_RUNNERS = {
+    Job.Kind.IMAGE: _run_image_job,
+    Job.Kind.HASH: _run_hash_job,
+}
+
+
+def run_job(job):
+    try:
+        _, stats = collect(JOB_RUNNERS[job.kind], job)
+        job.timings = stats["stages"]
+    except Exception as exc:
+        job.status = Job.Status.FAILED
+        job.error = str(exc) or exc.__class__.__name__
+    else:
+        job.status = Job.Status.DONE
+    job.finished_at = timezone.now()
+    job.save()
+    return job
+
+
+def cleanup_jobs(now=None):
+    # Deletes jobs (and their files) that finished more than TTL seconds ago, and fails jobs
+    # whose worker stopped without finishing them.
+    now = now or timezone.now()
+    options = settings.JOBS
+    Job.objects.filter(status=Job.Status.RUNNING, started_at__lt=now - timedelta(seconds=options["STALE_AFTER"])).update(
+        status=Job.Status.FAILED, error="The worker stopped before the job finished.", finished_at=now
+    )
+
+    expired = Job.objects.filter(
+        Q(finished_at__lt=now - timedelta(seconds=options["TTL"]))
+        | Q(status=Job.Status.QUEUED, created_at__lt=now - timedelta(seconds=options["TTL"]))
+    )
+    removed = 0
+    for job_id in expired.values_list("id", flat=True):
+        shutil.rmtree(job_directory(job_id), ignore_errors=True)
+        removed += 1
+    expired.delete()
+
+    # Directories left behind by submissions that never became a job.
+    if os.path.isdir(options["ROOT"]):
+        known = {str(job_id) for job_id in Job.objects.values_list("id", flat=True)}
+        cutoff = (now - timedelta(seconds=options["TTL"])).timestamp()
+        for name in os.listdir(options["ROOT"]):
+            path = os.path.join(options["ROOT"], name)
+            if name not in known and os.path.getmtime(path) < cutoff:
+                shutil.rmtree(path, ignore_errors=True)
+    return removed
@@ -0,0 +1,420 @@
+import io
+import json
+import math
+import os
+import platform
+import random
+import threading
+import time
+
+import django
+import PIL
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+from django.urls import reverse
+from PIL import Image, ImageDraw
+
+from tools.utils.cache_utils import get_transform_cache
+from tools.utils.hash_utils import SUPPORTED_ALLGORITHMS, calculate_file_hash
+from tools.utils.metrics import max_rss_bytes
+from tools.utils.filter_utils import apply_adjustments
+from tools.utils.image_utils import encode_image, high_quality_save_kwargs
+from tools.utils.pipeline import adjust_image, compress_image, convert_image, filter_image, resize_image, watermark_image
+from tools.utils.qr_utils import get_qr_caches, render_qr_chunk
+
+
+SIZES = {
+    "1mp": (1152, 864),
+    "12mp": (4000, 3000),
+    "48mp": (8000, 6000),
+}
+FORMATS = ("png", "jpeg", "webp")
+MODES = ("RGB", "RGBA", "P")
+IMAGE_TOOLS = ("convert", "compress", "resize", "filters", "watermark", "chain", "chain_unfused", "chain_per_request")
+
+# A filter chain run three ways: fused in one request ("chain"), one pass per step in one
+# request ("chain_unfused"), and one request per step ("chain_per_request", the only way to
+# chain filters before they took parameters).
+CHAIN = [
+    {"name": "levels", "black": 16, "white": 240},
+    {"name": "brightness", "amount": 1.1},
+    {"name": "contrast", "amount": 1.2},
+    {"name": "gamma", "amount": 1.2},
+    {"name": "sharpen"},
+    {"name": "detail"},
+]
+# The same chain as the filters page submits it; detail has no field of its own.
+CHAIN_FIELDS = [
+    {"levels_black": 16, "levels_white": 240},
+    {"brightness": 110},
+    {"contrast": 120},
+    {"gamma": 1.2},
+    {"filter_name": "sharpen"},
+]
+
+# Convert always changes format, in a fixed rotation.
+CONVERT_TARGETS = {"png": "jpeg", "jpeg": "webp", "webp": "png"}
+
+
+def synthetic_image(size, mode):
+    # Deterministic photo-like content: three gradients as channels plus a grid of lines, so
+    # every encoder has both smooth areas and edges to deal with.
+    width, height = size
+    image = Image.merge(
+        "RGB",
+        (
+            Image.linear_gradient("L").resize(size),
+            Image.radial_gradient("L").resize(size),
+            Image.linear_gradient("L").rotate(90).resize(size),
+        ),
+    )
+    draw = ImageDraw.Draw(image)
+    for x in range(0, width, 97):
+        draw.line([(x, 0), (width - x, height)], fill=(255, 255, 255), width=3)
+    for y in range(0, height, 89):
+        draw.line([(0, y), (width, height - y)], fill=(0, 0, 0), width=2)
+
+    if mode == "RGBA":
+        image.putalpha(Image.linear_gradient("L").rotate(45).resize(size))
+    elif mode == "P":
+        image = image.quantize(colors=256)
+    return image
+
+
+def encode_input(image, image_format):
+    if image_format == "jpeg" and image.mode != "RGB":
+        image = image.convert("RGB")
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format.upper())
+    return buffer.getvalue()
+
+
+def _percentile(ordered, fraction):
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def _current_rss():
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+class PeakMemory:
+    # Samples the resident size every few milliseconds while a benchmark runs; falls back to
+    # the growth of the process's max RSS where /proc is not available.
+    def __init__(self, interval=0.002):
+        self.interval = interval
+        self.peak = None
+
+    def __enter__(self):
+        self.baseline = _current_rss()
+        self.max_rss_before = max_rss_bytes()
+        self.peak = self.baseline
+        self._stop = threading.Event()
+        if self.baseline is not None:
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+        return self
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, _current_rss())
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        if self.baseline is not None:
+            self._thread.join()
+            self.peak = max(self.peak, _current_rss())
+
+    @property
+    def delta(self):
+        if self.baseline is not None:
+            return self.peak - self.baseline
+        if self.max_rss_before is not None:
+            return max_rss_bytes() - self.max_rss_before
+        return None
+
+
+def measure(operation, iterations, warmup):
+    # operation(i) returns the output bytes; every call gets a distinct index so caches keyed
+    # on the input cannot answer it.
+    for index in range(warmup):
+        operation(-1 - index)
+
+    latencies = []
+    output = b""
+    with PeakMemory() as memory:
+        start = time.perf_counter()
+        for index in range(iterations):
+            call_start = time.perf_counter()
+            output = operation(index)
+            latencies.append(time.perf_counter() - call_start)
+        elapsed = time.perf_counter() - start
+
+    ordered = sorted(latencies)
+    return {
+        "iterations": iterations,
+        "ops_per_s": iterations / elapsed if elapsed else 0.0,
+        "p50_ms": _percentile(ordered, 0.50) * 1000,
+        "p95_ms": _percentile(ordered, 0.95) * 1000,
+        "p99_ms": _percentile(ordered, 0.99) * 1000,
+        "peak_memory_bytes": memory.delta,
+        "output_bytes": len(output),
+    }
+
+
+def _direct_transform(tool, source, image_format, size):
+    width, height = size
+    if tool == "convert":
+        return convert_image(source, CONVERT_TARGETS[image_format])
+    if tool == "compress":
+        return compress_image(source, image_format, 80)
+    if tool == "resize":
+        return resize_image(source, image_format, "resize", width // 2, height // 2)
+    if tool == "filters":
+        return filter_image(source, image_format, "sharpen")
+    if tool == "chain":
+        return adjust_image(source, image_format, CHAIN)
+    if tool == "chain_unfused":
+        image = apply_adjustments(Image.open(source), [])
+        for step in CHAIN:
+            image = apply_adjustments(image, [step])
+        return encode_image(image, image_format, **high_quality_save_kwargs(image_format))
+    if tool == "chain_per_request":
+        output = source.read()
+        for step in CHAIN:
+            output = adjust_image(io.BytesIO(output), image_format, [step])
+        return output
+    return watermark_image(source, image_format, "© ToolsApp", "bottom_right")
+
+
+def _view_payload(tool, data, image_format, size):
+    width, height = size
+    upload = SimpleUploadedFile(f"bench.{image_format}", data, content_type=f"image/{image_format}")
+    payload = {"image_file": upload, "target_format": CONVERT_TARGETS[image_format] if tool == "convert" else image_format}
+    if tool == "compress":
+        payload["quality"] = 80
+    elif tool == "resize":
+        payload.update({"mode": "resize", "width": width // 2, "height": height // 2})
+    elif tool == "filters":
+        payload["filter_name"] = "sharpen"
+    elif tool == "chain":
+        for fields in CHAIN_FIELDS:
+            payload.update(fields)
+    elif tool == "watermark":
+        payload.update({"watermark_text": "© ToolsApp", "position": "bottom_right"})
+    return payload
+
+
+VIEW_NAMES = {
+    "convert": "tools:image_convert",
+    "compress": "tools:image_compress",
+    "resize": "tools:image_resize",
+    "filters": "tools:image_filters",
+    "watermark": "tools:image_watermark",
+    "chain": "tools:image_filters",
+    "chain_per_request": "tools:image_filters",
+}
+
+
+def _post(client, path, payload, accept=None):
+    headers = {"Accept": accept} if accept else {}
+    response = client.post(path, payload, headers=headers)
+    if response.status_code != 200:
+        raise RuntimeError(f"{path} returned {response.status_code}")
+    # Processing errors are rendered into the tool page, so an HTML answer to an image
+    # request is a failure too.
+    if accept and response["Content-Type"] != accept:
+        raise RuntimeError(f"{path} returned {response['Content-Type']} instead of {accept}")
+    return b"".join(response.streaming_content) if response.streaming else response.content
+
+
+def compare(results, baseline, threshold):
+    # A result regresses when it got slower (ops/s or p95), bigger (output) or hungrier
+    # (peak memory) by more than threshold, or when it now fails.
+    regressions = []
+    for name, result in sorted(results.items()):
+        before = baseline.get("results", {}).get(name)
+        if before is None or "error" in before:
+            continue
+        if "error" in result:
+            regressions.append(f"{name}: now fails ({result['error']})")
+            continue
+        if result["ops_per_s"] < before["ops_per_s"] * (1 - threshold):
+            regressions.append(f"{name}: ops/s {before['ops_per_s']:.2f} -> {result['ops_per_s']:.2f}")
+        if result["p95_ms"] > before["p95_ms"] * (1 + threshold):
+            regressions.append(f"{name}: p95 {before['p95_ms']:.1f} ms -> {result['p95_ms']:.1f} ms")
+        if result["output_bytes"] > before["output_bytes"] * (1 + threshold):
+            regressions.append(f"{name}: output {before['output_bytes']} -> {result['output_bytes']} bytes")
+        memory_before, memory_after = before.get("peak_memory_bytes"), result.get("peak_memory_bytes")
+        # Below a few MB the sampled RSS is mostly allocator noise.
+        if memory_before and memory_after and max(memory_before, memory_after) > 4 * 1024 * 1024:
+            if memory_after > memory_before * (1 + threshold):
+                regressions.append(f"{name}: peak memory {memory_before} -> {memory_after} bytes")
+    return regressions
+
+
+def _parse_size(value):
+    if value in SIZES:
+        return value, SIZES[value]
+    try:
+        width, height = (int(part) for part in value.lower().split("x"))
+    except ValueError:
+        raise CommandError(f"Unknown size {value!r}: use {', '.join(SIZES)} or WIDTHxHEIGHT.")
+    return value, (width, height)
+
+
+def _choices(value, allowed, name):
+    chosen = [item.strip() for item in value.split(",") if item.strip()]
+    unknown = [item for item in chosen if item not in allowed]
+    if unknown:
+        raise CommandError(f"Unknown {name}: {', '.join(unknown)}")
+    return chosen
+
+
+class Command(BaseCommand):
+    help = "Benchmark every tool on deterministic synthetic inputs, directly and through the views."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", default="1mp", help="Comma-separated: 1mp, 12mp, 48mp or WIDTHxHEIGHT.")
+        parser.add_argument("--formats", default=",".join(FORMATS))
+        parser.add_argument("--modes", default=",".join(MODES))
+        parser.add_argument("--tools", default=",".join((*IMAGE_TOOLS, "qr", "hash")))
+        parser.add_argument("--iterations", type=int, default=5)
+        parser.add_argument("--warmup", type=int, default=1)
+        parser.add_argument("--hash-size", type=int, default=64, help="Size of the hashed input in MiB.")
+        parser.add_argument("--skip-views", action="store_true", help="Only call the transforms directly.")
+        parser.add_argument("--output", "-o", help="Write the results as JSON to this path.")
+        parser.add_argument("--baseline", help="Fail when results regress against this JSON file.")
+        parser.add_argument("--threshold", type=float, default=0.2, help="Allowed relative regression (0.2 = 20%%).")
+
+    def handle(self, *args, **options):
+        sizes = [_parse_size(value.strip()) for value in options["sizes"].split(",") if value.strip()]
+        formats = _choices(options["formats"], FORMATS, "formats")
+        modes = _choices(options["modes"], MODES, "modes")
+        tools = _choices(options["tools"], (*IMAGE_TOOLS, "qr", "hash"), "tools")
+        self.iterations, self.warmup = options["iterations"], options["warmup"]
+
+        results = {}
+        # Inline execution keeps the work (and its memory) in this process, where it is measured.
+        executor = {"BACKEND": "inline", "MAX_WORKERS": 1, "MAX_QUEUE": 0, "TIMEOUT": 600}
+        with override_settings(IMAGE_EXECUTOR=executor, ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"]):
+            self.client = None if options["skip_views"] else Client()
+            for size_name, size in sizes:
+                for image_format in formats:
+                    for mode in modes:
+                        # JPEG has no alpha or palette, so those inputs would repeat the RGB case.
+                        if image_format != "jpeg" or mode == "RGB":
+                            self._bench_images(results, tools, size_name, size, image_format, mode)
+            if "qr" in tools:
+                self._bench_qr(results)
+            if "hash" in tools:
+                self._bench_hash(results, options["hash_size"])
+
+        report = {
+            "meta": {
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "pillow": PIL.__version__,
+                "machine": platform.machine(),
+                "cpu_count": os.cpu_count(),
+                "iterations": self.iterations,
+                "warmup": self.warmup,
+            },
+            "results": results,
+        }
+        if options["output"]:
+            with open(options["output"], "w") as output:
+                json.dump(report, output, indent=2, sort_keys=True)
+                output.write("\n")
+
+        if options["baseline"]:
+            try:
+                with open(options["baseline"]) as baseline_file:
+                    baseline = json.load(baseline_file)
+            except (OSError, ValueError) as exc:
+                raise CommandError(f"Could not read baseline {options['baseline']}: {exc}")
+            regressions = compare(results, baseline, options["threshold"])
+            if regressions:
+                for line in regressions:
+                    self.stderr.write(line)
+                raise CommandError(f"{len(regressions)} regression(s) against {options['baseline']}.")
+            self.stdout.write(f"No regressions against {options['baseline']}.")
+
+    def _run(self, results, name, operation):
+        try:
+            result = measure(operation, self.iterations, self.warmup)
+        except Exception as exc:
+            result = {"error": f"{type(exc).__name__}: {exc}"}
+        results[name] = result
+
+        if "error" in result:
+            self.stdout.write(f"{name:<44} error: {result['error']}")
+        else:
+            self.stdout.write(
+                f"{name:<44} {result['ops_per_s']:>9.2f} ops/s  p50 {result['p50_ms']:>8.1f} ms  "
+                f"p95 {result['p95_ms']:>8.1f} ms  p99 {result['p99_ms']:>8.1f} ms  "
+                f"out {result['output_bytes']:>10} B"
+            )
+
+    def _bench_images(self, results, tools, size_name, size, image_format, mode):
+        data = encode_input(synthetic_image(size, mode), image_format)
+        case = f"{size_name}-{image_format}-{mode.lower()}"
+
+        for tool in tools:
+            if tool not in IMAGE_TOOLS:
+                continue
+            self._run(results, f"direct/{tool}/{case}", lambda index: _direct_transform(tool, io.BytesIO(data), image_format, size))
+            if self.client is not None and tool in VIEW_NAMES:
+                path = reverse(VIEW_NAMES[tool])
+
+                def through_view(index):
+                    get_transform_cache().clear()
+                    if tool == "chain_per_request":
+                        output = data
+                        for fields in CHAIN_FIELDS:
+                            payload = {**_view_payload("filters", output, image_format, size), "filter_name": "original", **fields}
+                            output = _post(self.client, path, payload, accept=f"image/{image_format}")
+                        return output
+                    payload = _view_payload(tool, data, image_format, size)
+                    return _post(self.client, path, payload, accept=f"image/{payload['target_format']}")
+
+                self._run(results, f"view/{tool}/{case}", through_view)
+
+    def _bench_qr(self, results):
+        self._run(results, "direct/qr/png", lambda index: render_qr_chunk([f"https://example.com/bench/{index}"])[0][0])
+        if self.client is not None:
+            path = reverse("tools:qr")
+
+            def through_view(index):
+                for cache in get_qr_caches().values():
+                    cache.clear()
+                return _post(self.client, path, {"url": f"https://example.com/bench/{index}"}, accept="image/png")
+
+            self._run(results, "view/qr/png", through_view)
+
+    def _bench_hash(self, results, size_mib):
+        # A seeded 1 MiB block, repeated: deterministic and cheap to build, and hashlib cannot
+        # tell the difference from unique data.
+        data = random.Random(0).randbytes(1024 * 1024) * size_mib
+        for algorithm in SUPPORTED_ALLGORITHMS:
+            name = f"direct/hash/{algorithm}-{size_mib}mib"
+            self._run(
+                results,
+                name,
+                lambda index: calculate_file_hash(SimpleUploadedFile("bench.bin", data), algorithm).encode("ascii"),
+            )
+            if "error" not in results[name]:
+                results[name]["mib_per_s"] = results[name]["ops_per_s"] * size_mib
+
+        if self.client is not None:
+            path = reverse("tools:hash")
+            self._run(
+                results,
+                f"view/hash/all-{size_mib}mib",
+                lambda index: _post(self.client, path, {"file": SimpleUploadedFile("bench.bin", data), "algorithm": "sha256"}),
+            )
@@ -0,0 +1,200 @@
+import asyncio
+import http.client
+import io
+import statistics
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.cookies import SimpleCookie
+from urllib.parse import urlsplit
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+from PIL import Image
+
+
+TOOLS = {
+    "qr": ("/qr/", "/async/qr/"),
+    "convert": ("/image-converter/", "/async/image-converter/"),
+    "compress": ("/image-compressor/", "/async/image-compressor/"),
+    "resize": ("/image-resize/", "/async/image-resize/"),
+    "filters": ("/image-filters/", "/async/image-filters/"),
+    "hash": ("/hash/", "/async/hash/"),
+}
+
+
+def _payload(tool, index, size):
+    if tool == "qr":
+        return {"url": f"https://example.com/{index}"}
+
+    # Every request gets distinct pixels so the transform cache never short-circuits the work.
+    buffer = io.BytesIO()
+    Image.new("RGB", (size, size), (index % 256, (index // 256) % 256, 128)).save(buffer, format="PNG")
+    upload = SimpleUploadedFile(f"bench-{index}.png", buffer.getvalue(), content_type="image/png")
+    if tool == "hash":
+        return {"file": upload, "algorithm": "sha256"}
+    return {
+        "image_file": upload,
+        "target_format": "webp",
+        "quality": 80,
+        "width": size // 2,
+        "height": size // 2,
+        "filter_name": "sharpen",
+    }
+
+
+def _multipart(payload):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in payload.items():
+        if hasattr(value, "read"):
+            value.seek(0)
+            header = (
+                f'Content-Disposition: form-data; name="{name}"; filename="{value.name}"\r\n'
+                f"Content-Type: {value.content_type}\r\n"
+            )
+            body = value.read()
+        else:
+            header = f'Content-Disposition: form-data; name="{name}"\r\n'
+            body = str(value).encode()
+        parts.append(f"--{boundary}\r\n{header}\r\n".encode() + body + b"\r\n")
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+def _connection(url):
+    parts = urlsplit(url)
+    connection_class = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+    return connection_class(parts.netloc, timeout=300)
+
+
+def _csrf_token(url):
+    # The tool pages set the CSRF cookie when their form is rendered.
+    connection = _connection(url)
+    try:
+        connection.request("GET", urlsplit(url).path)
+        response = connection.getresponse()
+        response.read()
+        cookie = SimpleCookie(response.headers.get("Set-Cookie", ""))
+    finally:
+        connection.close()
+    if "csrftoken" not in cookie:
+        raise RuntimeError(f"{url} did not set a CSRF cookie")
+    return cookie["csrftoken"].value
+
+
+def _summary(label, latencies, elapsed):
+    latencies = sorted(latencies)
+    p99_index = max(0, int(round(len(latencies) * 0.99)) - 1)
+    return {
+        "mode": label,
+        "requests": len(latencies),
+        "rps": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[p99_index] * 1000,
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare requests/second and p99 latency of the WSGI and ASGI variants of a tool. By default "
+        "both run in this process through Django's test clients, which measures the views but not a "
+        "server; pass --wsgi-url and --asgi-url to send real HTTP requests to running servers instead."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--tool", choices=sorted(TOOLS), default="compress")
+        parser.add_argument("--requests", type=int, default=100)
+        parser.add_argument("--concurrency", type=int, default=16)
+        parser.add_argument("--size", type=int, default=512, help="Edge length of the synthetic image in pixels.")
+        parser.add_argument("--wsgi-url", help="Base URL of a running WSGI server, e.g. http://127.0.0.1:8000.")
+        parser.add_argument("--asgi-url", help="Base URL of a running ASGI server, e.g. http://127.0.0.1:8001.")
+
+    def handle(self, *args, **options):
+        tool = options["tool"]
+        total = options["requests"]
+        concurrency = options["concurrency"]
+        sync_path, async_path = TOOLS[tool]
+        payloads = [_payload(tool, index, options["size"]) for index in range(total * 2)]
+
+        if options["wsgi_url"] or options["asgi_url"]:
+            results = []
+            if options["wsgi_url"]:
+                results.append(self._run_http("wsgi", options["wsgi_url"] + sync_path, payloads[:total], concurrency))
+            if options["asgi_url"]:
+                results.append(self._run_http("asgi", options["asgi_url"] + async_path, payloads[total:], concurrency))
+        else:
+            setup_test_environment()
+            try:
+                results = [
+                    self._run_wsgi(sync_path, payloads[:total], concurrency),
+                    asyncio.run(self._run_asgi(async_path, payloads[total:], concurrency)),
+                ]
+            finally:
+                teardown_test_environment()
+
+        self.stdout.write(f"{'mode':<6} {'requests':>8} {'req/s':>10} {'p50 ms':>10} {'p99 ms':>10}")
+        for result in results:
+            self.stdout.write(
+                f"{result['mode']:<6} {result['requests']:>8} {result['rps']:>10.1f} "
+                f"{result['p50_ms']:>10.1f} {result['p99_ms']:>10.1f}"
+            )
+
+    def _run_wsgi(self, path, payloads, concurrency):
+        def send(payload):
+            client = Client()
+            start = time.perf_counter()
+            response = client.post(path, payload)
+            if response.status_code != 200:
+                raise RuntimeError(f"{path} returned {response.status_code}")
+            return time.perf_counter() - start
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            latencies = list(pool.map(send, payloads))
+        return _summary("wsgi", latencies, time.perf_counter() - start)
+
+    async def _run_asgi(self, path, payloads, concurrency):
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def send(payload):
+            async with semaphore:
+                client = AsyncClient()
+                start = time.perf_counter()
+                response = await client.post(path, payload)
+                if response.status_code != 200:
+                    raise RuntimeError(f"{path} returned {response.status_code}")
+                return time.perf_counter() - start
+
+        start = time.perf_counter()
+        latencies = await asyncio.gather(*(send(payload) for payload in payloads))
+        return _summary("asgi", latencies, time.perf_counter() - start)
+
+    def _run_http(self, label, url, payloads, concurrency):
+        # One connection per request from a thread pool; the client side stays the same for
+        # both servers, so the difference is the server and the view stack behind it.
+        token = _csrf_token(url)
+        path = urlsplit(url).path
+
+        def send(payload):
+            body, content_type = _multipart(payload)
+            headers = {"Content-Type": content_type, "Cookie": f"csrftoken={token}", "X-CSRFToken": token}
+            connection = _connection(url)
+            try:
+                start = time.perf_counter()
+                connection.request("POST", path, body=body, headers=headers)
+                response = connection.getresponse()
+                response.read()
+                elapsed = time.perf_counter() - start
+            finally:
+                connection.close()
+            if response.status != 200:
+                raise RuntimeError(f"{url} returned {response.status}")
+            return elapsed
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            latencies = list(pool.map(send, payloads))
+        return _summary(label, latencies, time.perf_counter() - start)
@@ -0,0 +1,53 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from tools.utils.executor import get_executor
+from tools.utils.qr_utils import ERROR_CORRECTION_LEVELS, QR_FORMATS, parse_qr_list, qr_zip_entries
+from tools.utils.zip_utils import stream_zip
+
+
+class Command(BaseCommand):
+    help = "Generate a ZIP of QR codes from a CSV or newline-separated list of URLs."
+
+    def add_arguments(self, parser):
+        parser.add_argument("input", help="Path to the URL list, or - for stdin.")
+        parser.add_argument("--output", "-o", required=True, help="Path of the ZIP file to write.")
+        parser.add_argument("--format", choices=sorted(QR_FORMATS), default="png")
+        parser.add_argument("--error-correction", choices=sorted(ERROR_CORRECTION_LEVELS), default="M")
+        parser.add_argument("--mask", type=int, choices=range(8), default=None, help="Fixed mask pattern; skips the mask search.")
+        parser.add_argument("--box-size", type=int, default=10)
+        parser.add_argument("--border", type=int, default=4)
+
+    def handle(self, *args, **options):
+        if options["input"] == "-":
+            text = sys.stdin.read()
+        else:
+            try:
+                with open(options["input"], encoding="utf-8-sig") as source:
+                    text = source.read()
+            except OSError as exc:
+                raise CommandError(f"Could not read {options['input']}: {exc}")
+
+        values = parse_qr_list(text)
+        if not values:
+            raise CommandError("The input does not contain any URLs.")
+
+        entries = qr_zip_entries(
+            values,
+            get_executor(),
+            target_format=options["format"],
+            error_correction=options["error_correction"],
+            mask_pattern=options["mask"],
+            box_size=options["box_size"],
+            border=options["border"],
+        )
+
+        start = time.perf_counter()
+        with open(options["output"], "wb") as output:
+            for chunk in stream_zip(entries):
+                output.write(chunk)
+        elapsed = time.perf_counter() - start
+
+        self.stdout.write(f"{len(values)} codes written to {options['output']} in {elapsed:.2f}s ({len(values) / elapsed:.0f} codes/s)")
@@ -0,0 +1,66 @@
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from tools.jobs import claim_job, cleanup_jobs, run_job
+
+
+class Command(BaseCommand):
+    help = "Run queued image and hash jobs from the database."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--concurrency", type=int, default=None, help="Jobs run at once (default: JOBS['CONCURRENCY']).")
+        parser.add_argument("--poll-interval", type=float, default=None, help="Seconds between queue checks when idle.")
+        parser.add_argument("--once", action="store_true", help="Exit once the queue is empty instead of waiting for new jobs.")
+
+    def handle(self, *args, **options):
+        concurrency = options["concurrency"] or settings.JOBS["CONCURRENCY"]
+        if concurrency < 1:
+            raise CommandError("--concurrency must be at least 1.")
+        poll_interval = options["poll_interval"] or settings.JOBS["POLL_INTERVAL"]
+        name = f"{socket.gethostname()}:{os.getpid()}"
+        self.stopping = threading.Event()
+
+        removed = cleanup_jobs()
+        if removed:
+            self.stdout.write(f"Removed {removed} expired jobs")
+        self.stdout.write(f"Worker {name} running {concurrency} jobs at a time")
+
+        # Jobs run on threads: Pillow and hashlib release the GIL for the heavy parts. Cleanup
+        # runs on this thread between waits.
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="toolsworker") as pool:
+            futures = [pool.submit(self._work, f"{name}/{index}", poll_interval, options["once"]) for index in range(concurrency)]
+            last_cleanup = time.monotonic()
+            try:
+                while wait(futures, timeout=poll_interval).not_done:
+                    if time.monotonic() - last_cleanup >= settings.JOBS["CLEANUP_INTERVAL"]:
+                        cleanup_jobs()
+                        last_cleanup = time.monotonic()
+            except KeyboardInterrupt:
+                self.stdout.write("Stopping after the running jobs finish")
+                self.stopping.set()
+                wait(futures)
+        for future in futures:
+            future.result()
+
+    def _work(self, worker, poll_interval, once):
+        try:
+            while not self.stopping.is_set():
+                job = claim_job(worker)
+                if job is None:
+                    if once:
+                        return
+                    self.stopping.wait(poll_interval)
+                    continue
+
+                run_job(job)
+                message = f"{job.id} {job.kind} {job.status} in {job.run_seconds:.2f}s"
+                self.stdout.write(message if not job.error else f"{message}: {job.error}")
+        finally:
+            connection.close()
@@ -0,0 +1,112 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from .utils import metrics
+
+
+# URL names of the tool views and the label their requests are recorded under.
+TOOL_LABELS = {
+    "qr": "qr",
+    "async_qr": "qr",
+    "qr_bulk": "qr",
+    "image_convert": "convert",
+    "async_image_convert": "convert",
+    "image_compress": "compress",
+    "async_image_compress": "compress",
+    "image_resize": "resize",
+    "image_srcset": "resize",
+    "async_image_resize": "resize",
+    "image_watermark": "watermark",
+    "async_image_watermark": "watermark",
+    "image_filters": "filters",
+    "async_image_filters": "filters",
+    "image_batch": "batch",
+    "pipeline": "pipeline",
+    "image_inspect": "inspect",
+    "hash": "hash",
+    "async_hash": "hash",
+    "job_submit": "jobs",
+}
+
+
+class MetricsMiddleware:
+    # Gives every request a collector that views and pipeline stages report into, then
+    # exports it to the /metrics histograms. For streaming responses only the time until
+    # the response object is returned is measured.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+
+        request_metrics = metrics.RequestMetrics()
+        token = metrics.begin(request_metrics)
+        start, rss_before = time.perf_counter(), metrics.max_rss_bytes()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.end(token)
+        return self._finish(request, response, request_metrics, start, rss_before)
+
+    async def __acall__(self, request):
+        request_metrics = metrics.RequestMetrics()
+        token = metrics.begin(request_metrics)
+        start, rss_before = time.perf_counter(), metrics.max_rss_bytes()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.end(token)
+        return self._finish(request, response, request_metrics, start, rss_before)
+
+    def _finish(self, request, response, request_metrics, start, rss_before):
+        duration = time.perf_counter() - start
+        match = request.resolver_match
+        tool = TOOL_LABELS.get(match.url_name) if match is not None else None
+        if tool is None:
+            return response
+
+        labels = {"tool": tool, "format": request_metrics.labels.get("format", "none")}
+        metrics.REQUESTS.inc(status=response.status_code, **labels)
+        metrics.REQUEST_DURATION.observe(duration, **labels)
+        for name, seconds in request_metrics.stages.items():
+            metrics.STAGE_DURATION.observe(seconds, stage=name, **labels)
+
+        metrics.REQUEST_BYTES.observe(self._content_length(request), **labels)
+        if response.has_header("Content-Length"):
+            metrics.RESPONSE_BYTES.observe(int(response["Content-Length"]), **labels)
+        elif not response.streaming:
+            metrics.RESPONSE_BYTES.observe(len(response.content), **labels)
+
+        if "pixels" in request_metrics.values:
+            metrics.IMAGE_PIXELS.observe(request_metrics.values["pixels"], **labels)
+        if rss_before is not None:
+            rss_delta = max(metrics.max_rss_bytes() - rss_before, request_metrics.values.get("rss_delta", 0))
+            metrics.PEAK_RSS_DELTA.observe(rss_delta, **labels)
+
+        if self._wants_server_timing(request):
+            timings = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in request_metrics.stages.items()]
+            timings.append(f"total;dur={duration * 1000:.2f}")
+            response["Server-Timing"] = ", ".join(timings)
+        return response
+
+    def _content_length(self, request):
+        # Parsed like HttpRequest does: a missing or malformed header counts as an empty body.
+        try:
+            return int(request.META.get("CONTENT_LENGTH") or 0)
+        except (ValueError, TypeError):
+            return 0
+
+    def _wants_server_timing(self, request):
+        server_timing = settings.METRICS["SERVER_TIMING"]
+        if server_timing == "request":
+            return request.headers.get("X-Server-Timing") == "1"
+        return bool(server_timing)
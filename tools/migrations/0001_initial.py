@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:36
+
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('kind', models.CharField(choices=[('image', 'Image'), ('hash', 'Hash')], max_length=16)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='queued', max_length=16)),
+                ('params', models.JSONField(default=dict)),
+                ('input_name', models.CharField(max_length=255)),
+                ('input_path', models.CharField(max_length=1024)),
+                ('input_size', models.BigIntegerField(default=0)),
+                ('output_name', models.CharField(blank=True, max_length=255)),
+                ('output_path', models.CharField(blank=True, max_length=1024)),
+                ('content_type', models.CharField(blank=True, max_length=100)),
+                ('result', models.JSONField(blank=True, default=dict)),
+                ('timings', models.JSONField(blank=True, default=dict)),
+                ('error', models.TextField(blank=True)),
+                ('worker', models.CharField(blank=True, max_length=100)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['created_at'],
+                'indexes': [models.Index(fields=['status', 'created_at'], name='tools_job_status_60fe6f_idx')],
+            },
+        ),
+    ]
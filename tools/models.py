@@ -1,3 +1,54 @@
+import uuid
+
 from django.db import models
 
-# Create your models here.
+
+class Job(models.Model):
+    # A queued image or hash job. The table doubles as the queue: workers claim the oldest
+    # queued row with a conditional update, so no broker is needed.
+    class Kind(models.TextChoices):
+        IMAGE = "image"
+        HASH = "hash"
+
+    class Status(models.TextChoices):
+        QUEUED = "queued"
+        RUNNING = "running"
+        DONE = "done"
+        FAILED = "failed"
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    kind = models.CharField(max_length=16, choices=Kind.choices)
+    status = models.CharField(max_length=16, choices=Status.choices, default=Status.QUEUED)
+    params = models.JSONField(default=dict)
+    input_name = models.CharField(max_length=255)
+    input_path = models.CharField(max_length=1024)
+    input_size = models.BigIntegerField(default=0)
+    output_name = models.CharField(max_length=255, blank=True)
+    output_path = models.CharField(max_length=1024, blank=True)
+    content_type = models.CharField(max_length=100, blank=True)
+    result = models.JSONField(default=dict, blank=True)
+    timings = models.JSONField(default=dict, blank=True)
+    error = models.TextField(blank=True)
+    worker = models.CharField(max_length=100, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["created_at"]
+        indexes = [models.Index(fields=["status", "created_at"])]
+
+    def __str__(self):
+        return f"{self.kind} job {self.id} ({self.status})"
+
+    @property
+    def queued_seconds(self):
+        if self.started_at is None:
+            return None
+        return (self.started_at - self.created_at).total_seconds()
+
+    @property
+    def run_seconds(self):
+        if self.started_at is None or self.finished_at is None:
+            return None
+        return (self.finished_at - self.started_at).total_seconds()
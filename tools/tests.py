@@ -1,10 +1,85 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import io
+import json
+import math
+import os
+import struct
+import tempfile
+import threading
+import time
+import unittest
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
-from django.test import SimpleTestCase
+import qrcode
+from django.conf import settings
+from django.core.cache import cache, caches
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.uploadhandler import StopUpload
+from django.core.handlers.wsgi import WSGIRequest
+from django.core.management import CommandError, call_command
+from django.test import Client, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from PIL import Image, ImageChops, ImageCms, ImageDraw, ImageFile, ImageFilter, ImageOps, ImageStat
 
-from tools.utils.hash_utils import calculate_file_hash
+from tools import views
+from tools.jobs import claim_job, cleanup_jobs, run_job
+from tools.management.commands.bench import compare, synthetic_image
+from tools.models import Job
+from tools.upload_handlers import HashedUpload, ImageUploadHandler
+from tools.utils import png_utils
+from tools.utils.admission import ImageTooLarge, MemoryBudget, estimate_image_memory, get_memory_budget, inspect_image
+from tools.utils.cache_utils import DjangoCacheBackend, FileSystemCacheBackend, MemoryCacheBackend, get_transform_cache
+from tools.utils.executor import ExecutorBusy, ExecutorTimeout, ImageExecutor, MappedFile, run_transform
+from tools.utils.filter_utils import apply_adjustments, plan_adjustments, validate_adjustments
+from tools.utils.hash_utils import (
+    SUPPORTED_ALLGORITHMS,
+    MerkleSha256,
+    ParallelHasher,
+    calculate_file_hash,
+    calculate_file_hashes,
+    compare_files,
+)
+from tools.utils.image_utils import (
+    FILTERS,
+    apply_watermark,
+    center_crop_box,
+    compress_save_kwargs,
+    downscale_image,
+    draft_for_size,
+    encode_image,
+    fit_image,
+    watermark_tile,
+)
+from tools.utils.metrics import REGISTRY, REQUEST_BYTES, Histogram
+from tools.utils.pipeline import (
+    TARGET_MAX_PROBES,
+    compress_to_size,
+    convert_image,
+    plan_operations,
+    resize_image,
+    run_pipeline,
+    validate_operations,
+)
+from tools.utils.png_utils import optimize_png, reduce_mode
+from tools.utils.qr_utils import (
+    ERROR_CORRECTION_LEVELS,
+    compute_qr_matrix,
+    get_qr_caches,
+    make_qr,
+    make_qr_png,
+    parse_qr_list,
+    qr_matrix,
+    render_qr_chunk,
+)
+from tools.utils.result_utils import load_result, store_result
+from tools.utils.srcset_utils import srcset_archive
+from tools.utils.tiled import PNG_SIGNATURE, RowWindow, _chunk, read_header, read_strips, run_tiled_pipeline
+from tools.views import _job_operations, _read_upload
 
 class FileHashUtilTest(SimpleTestCase):
 
@@ -63,3 +138,1837 @@ class FileHashUtilTest(SimpleTestCase):
             result,
             "2aae6c35c94fcfb415dbe95f408b9ce91ee846ed"
         )
+
+
+def setUpModule():
+    # Stored results go to a throwaway directory rather than the project's results/ folder.
+    global _result_store, _result_settings
+    _result_store = tempfile.TemporaryDirectory()
+    _result_settings = override_settings(RESULT_STORE={**settings.RESULT_STORE, "ROOT": _result_store.name})
+    _result_settings.enable()
+
+
+def tearDownModule():
+    _result_settings.disable()
+    _result_store.cleanup()
+
+
+def image_bytes(image, image_format="PNG", **save_kwargs):
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format, **save_kwargs)
+    return buffer.getvalue()
+
+
+def make_image_upload(name="test.png", size=(64, 48), color=(200, 40, 40), image_format="PNG", mode="RGB"):
+    data = image_bytes(Image.new(mode, size, color), image_format)
+    return SimpleUploadedFile(name, data, content_type=f"image/{image_format.lower()}")
+
+
+class ImageResultViewTest(SimpleTestCase):
+
+    def test_convert_renders_result_url_instead_of_base64(self):
+        response = self.client.post(
+            "/image-converter/",
+            {"target_format": "webp", "image_file": make_image_upload()},
+        )
+
+        self.assertEqual(response.status_code, 200)
+        result_url = response.context["converted_image"]
+        self.assertTrue(result_url.startswith("/result/"))
+        self.assertNotContains(response, "base64,")
+
+        result = self.client.get(result_url)
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(result["Content-Type"], "image/webp")
+        self.assertEqual(int(result["Content-Length"]), len(b"".join(result.streaming_content)))
+        self.assertTrue(result["ETag"].startswith('"'))
+
+    def test_result_etag_returns_not_modified(self):
+        response = self.client.post("/qr/", {"url": "https://example.com"})
+        result_url = response.context["qr_image"]
+        etag = self.client.get(result_url)["ETag"]
+
+        cached = self.client.get(result_url, headers={"If-None-Match": etag})
+
+        self.assertEqual(cached.status_code, 304)
+
+    def test_accept_image_returns_bytes_directly(self):
+        response = self.client.post(
+            "/image-compressor/",
+            {"target_format": "jpeg", "quality": 70, "image_file": make_image_upload()},
+            headers={"Accept": "image/jpeg"},
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "image/jpeg")
+        self.assertTrue(b"".join(response.streaming_content).startswith(b"\xff\xd8"))
+
+    def test_inline_base64_is_opt_in(self):
+        response = self.client.post(
+            "/image-converter/",
+            {"target_format": "png", "inline": "1", "image_file": make_image_upload()},
+        )
+
+        self.assertTrue(response.context["converted_image"].startswith("data:image/png;base64,"))
+
+    def test_unknown_result_returns_404(self):
+        response = self.client.get("/result/does-not-exist/")
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_results_are_files_any_worker_can_serve(self):
+        key = store_result(b"payload", "json", "result.json")
+
+        self.assertTrue(os.path.exists(os.path.join(settings.RESULT_STORE["ROOT"], key)))
+        response = self.client.get(f"/result/{key}/")
+        self.assertEqual(b"".join(response.streaming_content), b"payload")
+        self.assertEqual(response["Content-Length"], "7")
+
+    def test_store_is_pruned_to_its_byte_limit_oldest_first(self):
+        root = self.enterContext(tempfile.TemporaryDirectory())
+        with override_settings(RESULT_STORE={"ROOT": root, "MAX_BYTES": 2500, "PRUNE_INTERVAL": 0}):
+            keys = []
+            for index in range(3):
+                keys.append(store_result(bytes([index]) * 1000, "json", "result.json"))
+                path = os.path.join(settings.RESULT_STORE["ROOT"], keys[-1])
+                os.utime(path, (time.time() - 10 + index, time.time() - 10 + index))
+            store_result(b"x" * 1000, "json", "result.json")
+
+            self.assertIsNone(load_result(keys[0]))
+            self.assertIsNone(load_result(keys[1]))
+            self.assertEqual(load_result(keys[2])["data"], bytes([2]) * 1000)
+
+    def test_store_is_pruned_at_most_once_per_interval(self):
+        root = self.enterContext(tempfile.TemporaryDirectory())
+        with override_settings(RESULT_STORE={"ROOT": root, "MAX_BYTES": 2500, "PRUNE_INTERVAL": 60}):
+            with mock.patch("tools.utils.result_utils.prune_results") as prune_results:
+                for index in range(3):
+                    store_result(bytes([index]), "json", "result.json")
+
+        self.assertEqual(prune_results.call_count, 1)
+
+    def test_expired_results_are_not_served(self):
+        key = store_result(b"payload", "json", "result.json")
+        with override_settings(RESULT_CACHE_TIMEOUT=-1):
+            self.assertEqual(self.client.get(f"/result/{key}/").status_code, 404)
+
+
+class TransformCacheTest(SimpleTestCase):
+
+    def setUp(self):
+        self.cache = get_transform_cache()
+        self.cache.clear()
+
+    def test_repeated_upload_hits_cache(self):
+        for _ in range(2):
+            response = self.client.post(
+                "/image-compressor/",
+                {"target_format": "webp", "quality": 60, "image_file": make_image_upload()},
+            )
+            self.assertEqual(response.status_code, 200)
+
+        stats = self.client.get("/cache/stats/").json()
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["hit_rate"], 0.5)
+
+    def test_different_parameters_miss(self):
+        for quality in (60, 70):
+            self.client.post(
+                "/image-compressor/",
+                {"target_format": "webp", "quality": quality, "image_file": make_image_upload()},
+            )
+
+        self.assertEqual(self.cache.stats()["misses"], 2)
+
+    def test_memory_backend_evicts_least_recently_used_by_size(self):
+        backend = MemoryCacheBackend(max_bytes=10)
+        backend.set("a", b"1234")
+        backend.set("b", b"1234")
+        backend.get("a")
+        backend.set("c", b"1234")
+
+        self.assertEqual(backend.get("b"), None)
+        self.assertEqual(backend.get("a"), b"1234")
+        self.assertEqual(backend.stats(), {"entries": 2, "bytes": 8})
+
+    def test_watermark_font_is_part_of_the_key(self):
+        key = self.cache.make_key(make_image_upload(), "watermark", {"watermark_text": "x"})
+        with override_settings(WATERMARK_FONT="/fonts/other.ttf"):
+            other = self.cache.make_key(make_image_upload(), "watermark", {"watermark_text": "x"})
+
+        self.assertNotEqual(key, other)
+
+    def test_django_backend_clear_keeps_other_cache_entries(self):
+        backend = DjangoCacheBackend(max_bytes=1024)
+        cache.set("unrelated", "kept")
+        backend.set("a", b"1234")
+        backend.clear()
+
+        self.assertEqual(backend.get("a"), None)
+        self.assertEqual(cache.get("unrelated"), "kept")
+        backend.set("a", b"5678")
+        self.assertEqual(backend.get("a"), b"5678")
+
+    def test_filesystem_backend_evicts_oldest(self):
+        with tempfile.TemporaryDirectory() as location:
+            backend = FileSystemCacheBackend(max_bytes=10, location=location)
+            backend.set("a", b"1234")
+            old = time.time() - 60
+            os.utime(backend._path("a"), (old, old))
+            backend.set("b", b"1234")
+            backend.set("c", b"1234")
+
+            self.assertEqual(backend.get("a"), None)
+            self.assertEqual(backend.get("c"), b"1234")
+
+
+class ImageExecutorTest(SimpleTestCase):
+
+    def test_full_queue_rejects_immediately(self):
+        release = threading.Event()
+        executor = ImageExecutor(backend="thread", max_workers=1, max_queue=0, timeout=5)
+        try:
+            executor.submit(release.wait)
+            with self.assertRaises(ExecutorBusy):
+                executor.submit(release.wait)
+        finally:
+            release.set()
+            executor.shutdown()
+
+    def test_job_timeout(self):
+        executor = ImageExecutor(backend="thread", max_workers=1, max_queue=0, timeout=0.01)
+        try:
+            with self.assertRaises(ExecutorTimeout):
+                executor.run(time.sleep, 0.2)
+        finally:
+            executor.shutdown()
+
+    def test_async_run(self):
+        executor = ImageExecutor(backend="thread", max_workers=2, max_queue=2, timeout=5)
+        try:
+            self.assertEqual(asyncio.run(executor.arun(sum, [1, 2, 3])), 6)
+        finally:
+            executor.shutdown()
+
+    def test_process_pool_runs_transform(self):
+        executor = ImageExecutor(backend="process", max_workers=1, max_queue=1, timeout=30)
+        try:
+            data = executor.run(run_transform, convert_image, make_image_upload().read(), {"target_format": "jpeg"})
+        finally:
+            executor.shutdown()
+
+        self.assertTrue(data.startswith(b"\xff\xd8"))
+
+    def test_pool_is_replaced_after_a_worker_dies(self):
+        executor = ImageExecutor(backend="process", max_workers=1, max_queue=1, timeout=30)
+        try:
+            with self.assertRaises(ExecutorBusy):
+                executor.run(os._exit, 1)
+            data = executor.run(run_transform, convert_image, make_image_upload().read(), {"target_format": "jpeg"})
+        finally:
+            executor.shutdown()
+
+        self.assertTrue(data.startswith(b"\xff\xd8"))
+
+    def test_busy_executor_returns_503(self):
+        get_transform_cache().clear()
+        busy = mock.Mock()
+        busy.submit.side_effect = ExecutorBusy()
+        with mock.patch("tools.views.get_executor", return_value=busy):
+            response = self.client.post(
+                "/image-converter/",
+                {"target_format": "png", "image_file": make_image_upload()},
+            )
+
+        self.assertEqual(response.status_code, 503)
+
+
+def make_png_header(width, height):
+    # A PNG with a valid IHDR and no pixel data: enough for Image.open, impossible to decode.
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    ihdr = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", ihdr) + chunk(b"IDAT", zlib.compress(b"\0")) + chunk(b"IEND", b"")
+
+
+class MemoryAdmissionTest(SimpleTestCase):
+
+    def test_estimate_uses_header_dimensions_and_operations(self):
+        size, mode, image_format = inspect_image(make_png_header(9000, 8000))
+        self.assertEqual((size, mode, image_format), ((9000, 8000), "RGB", "PNG"))
+
+        self.assertEqual(estimate_image_memory((100, 50), "L"), 5000)
+        self.assertEqual(estimate_image_memory((100, 50), "RGB", [{"op": "filter"}]), 40000)
+        self.assertEqual(estimate_image_memory((100, 50), "RGB", [{"op": "png_optimize"}]), 100000)
+        self.assertEqual(estimate_image_memory((100, 50), "RGB", [{"op": "resize", "width": 10, "height": 10}]), 20400)
+
+    def test_filter_chain_counts_one_operation_per_pass(self):
+        # brightness and contrast fuse into one lookup table; the blur and both kernels each
+        # take their own pass.
+        steps = validate_adjustments(
+            [{"name": "brightness"}, {"name": "contrast"}, {"name": "gaussian_blur"}, {"name": "sharpen"}, {"name": "emboss"}]
+        )
+        job = {"operation": "filter", "params": {"target_format": "png", "steps": steps}}
+        self.assertEqual(_job_operations(job), [{"op": "adjust"}] * 4)
+
+        operations = [{"op": "filter", "name": "sharpen"}, {"op": "filter", "name": "emboss"}, {"op": "resize", "width": 10, "height": 10}]
+        job = {"operation": "pipeline", "params": {"target_format": "png", "operations": operations}}
+        self.assertEqual(_job_operations(job), [{"op": "adjust"}, {"op": "adjust"}, operations[2]])
+
+    def test_oversized_image_is_rejected_before_decoding(self):
+        # 20000x20000 RGB decodes to 1.6 GB, far over the default 512 MB per-request budget.
+        upload = SimpleUploadedFile("huge.png", make_png_header(20000, 20000), content_type="image/png")
+        response = self.client.post("/image-converter/", {"target_format": "png", "image_file": upload})
+
+        self.assertEqual(response.status_code, 413)
+
+        with override_settings(IMAGE_MEMORY={"REQUEST_BYTES": 64 * 1024 * 1024, "TOTAL_BYTES": 10**9, "QUEUE_TIMEOUT": 1}):
+            pipeline = self.client.post(
+                "/pipeline/",
+                {"image_file": SimpleUploadedFile("big.png", make_png_header(5000, 5000)), "operations": "[]"},
+            )
+            self.assertEqual(pipeline.status_code, 413)
+            self.assertEqual(get_memory_budget().stats()["rejected"], 1)
+
+    def test_jobs_queue_until_budget_is_released(self):
+        budget = MemoryBudget(total_bytes=100, request_bytes=80, queue_timeout=5)
+        self.assertTrue(budget.acquire(60))
+        self.assertFalse(budget.acquire(60, blocking=False))
+        with self.assertRaises(ImageTooLarge):
+            budget.acquire(90)
+
+        admitted = threading.Event()
+        waiter = threading.Thread(target=lambda: budget.acquire(60) and admitted.set())
+        waiter.start()
+        self.assertFalse(admitted.wait(0.05))
+        budget.release(60)
+        waiter.join(5)
+
+        self.assertTrue(admitted.is_set())
+        stats = budget.stats()
+        self.assertEqual((stats["in_use_bytes"], stats["peak_in_use_bytes"]), (60, 60))
+        self.assertEqual((stats["admitted"], stats["queued"], stats["rejected"]), (2, 1, 1))
+
+    def test_queue_timeout_returns_503(self):
+        get_transform_cache().clear()
+        with override_settings(IMAGE_MEMORY={"REQUEST_BYTES": 10**6, "TOTAL_BYTES": 10**6, "QUEUE_TIMEOUT": 0.01}):
+            budget = get_memory_budget()
+            budget.acquire(10**6 - 100)
+            response = self.client.post("/image-converter/", {"target_format": "png", "image_file": make_image_upload()})
+            budget.release(10**6 - 100)
+            stats = self.client.get("/memory/stats/").json()
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(stats["timed_out"], 1)
+        self.assertEqual(stats["in_use_bytes"], 0)
+
+    def test_admitted_job_releases_its_reservation(self):
+        get_transform_cache().clear()
+        before = get_memory_budget().stats()["admitted"]
+        response = self.client.post(
+            "/image-converter/",
+            {"target_format": "png", "image_file": make_image_upload()},
+            headers={"Accept": "image/png"},
+        )
+
+        stats = self.client.get("/memory/stats/").json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(stats["admitted"], before + 1)
+        self.assertEqual(stats["in_use_bytes"], 0)
+        self.assertGreaterEqual(stats["peak_in_use_bytes"], 64 * 48 * 4)
+
+
+class AsyncToolViewTest(SimpleTestCase):
+
+    async def test_async_convert_returns_image(self):
+        response = await self.async_client.post(
+            "/async/image-converter/",
+            {"target_format": "jpeg", "image_file": make_image_upload()},
+            headers={"Accept": "image/jpeg"},
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "image/jpeg")
+
+    async def test_async_qr_renders_result_url(self):
+        response = await self.async_client.post("/async/qr/", {"url": "https://example.com"})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context["qr_image"].startswith("/result/"))
+
+    async def test_async_hash(self):
+        upload = SimpleUploadedFile("test.txt", b"hello world", content_type="text/plain")
+
+        response = await self.async_client.post("/async/hash/", {"file": upload, "algorithm": "sha1"})
+
+        self.assertEqual(response.context["hash_value"], "2aae6c35c94fcfb415dbe95f408b9ce91ee846ed")
+
+    async def test_async_validation_error(self):
+        response = await self.async_client.post("/async/image-resize/", {"target_format": "png"})
+
+        self.assertEqual(response.context["error_message"], "Please upload an image file.")
+
+
+def make_photo_bytes(size=(2400, 1600), image_format="JPEG"):
+    width, height = size
+    image = Image.merge(
+        "RGB",
+        (
+            Image.linear_gradient("L").resize(size),
+            Image.radial_gradient("L").resize(size),
+            Image.linear_gradient("L").rotate(90).resize(size),
+        ),
+    )
+    draw = ImageDraw.Draw(image)
+    for x in range(0, width, 97):
+        draw.line((x, 0, width - x, height), fill=(x % 255, 100, 200), width=3)
+
+    return image_bytes(image, image_format, quality=90)
+
+
+def psnr(first, second):
+    stat = ImageStat.Stat(ImageChops.difference(first.convert("RGB"), second.convert("RGB")))
+    mse = sum(stat.sum2) / (first.width * first.height * 3)
+    return float("inf") if mse == 0 else 10 * math.log10(255 ** 2 / mse)
+
+
+class FastDownscaleTest(SimpleTestCase):
+
+    def test_jpeg_draft_decodes_at_reduced_scale(self):
+        image = Image.open(io.BytesIO(make_photo_bytes()))
+        draft_for_size(image, (300, 200))
+
+        self.assertEqual(image.size, (300, 200))
+
+    def test_resize_is_visually_equivalent_to_full_decode(self):
+        for image_format in ("JPEG", "PNG"):
+            data = make_photo_bytes(image_format=image_format)
+            reference = Image.open(io.BytesIO(data)).resize((400, 250), Image.Resampling.LANCZOS)
+            fast = downscale_image(Image.open(io.BytesIO(data)), (400, 250))
+
+            self.assertGreater(psnr(reference, fast), 35)
+
+    def test_crop_is_visually_equivalent_to_imageops_fit(self):
+        data = make_photo_bytes()
+        reference = ImageOps.fit(Image.open(io.BytesIO(data)), (300, 300), method=Image.Resampling.LANCZOS)
+        fast = fit_image(Image.open(io.BytesIO(data)), (300, 300))
+
+        self.assertEqual(fast.size, (300, 300))
+        self.assertGreater(psnr(reference, fast), 35)
+
+    def test_upscale_keeps_full_decode(self):
+        image = Image.open(io.BytesIO(make_photo_bytes(size=(200, 100))))
+
+        self.assertEqual(downscale_image(image, (400, 200)).size, (400, 200))
+
+
+class ImageBatchViewTest(SimpleTestCase):
+
+    def _archive(self, response):
+        return zipfile.ZipFile(io.BytesIO(b"".join(response.streaming_content)))
+
+    def test_batch_compress_streams_zip_with_manifest(self):
+        response = self.client.post(
+            "/batch/compress/",
+            {
+                "target_format": "webp",
+                "quality": 70,
+                "image_file": [
+                    make_image_upload("one.png", color=(10, 20, 30)),
+                    make_image_upload("two.png", color=(30, 20, 10)),
+                    SimpleUploadedFile("broken.png", b"not an image", content_type="image/png"),
+                ],
+            },
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/zip")
+        archive = self._archive(response)
+        self.assertEqual(sorted(archive.namelist()), ["manifest.json", "one.webp", "two.webp"])
+
+        manifest = json.loads(archive.read("manifest.json"))["files"]
+        errors = [entry for entry in manifest if entry["status"] == "error"]
+        self.assertEqual([entry["source"] for entry in errors], ["broken.png"])
+
+    def test_batch_resize_deduplicates_entry_names(self):
+        response = self.client.post(
+            "/batch/resize/",
+            {
+                "target_format": "png",
+                "width": 16,
+                "height": 16,
+                "image_file": [make_image_upload("same.png"), make_image_upload("same.png", color=(1, 2, 3))],
+            },
+        )
+
+        self.assertEqual(sorted(self._archive(response).namelist()), ["manifest.json", "same-2.png", "same.png"])
+
+    def test_unreadable_file_becomes_an_error_entry(self):
+        get_transform_cache().clear()
+        uploads = [make_image_upload("good.png"), make_image_upload("truncated.png", color=(1, 1, 1))]
+        read_upload = views._read_upload
+
+        def failing_read(image_file):
+            if image_file.name == "truncated.png":
+                raise OSError("image file is truncated")
+            return read_upload(image_file)
+
+        with mock.patch("tools.views._read_upload", failing_read):
+            response = self.client.post("/batch/convert/", {"target_format": "png", "image_file": uploads})
+            archive = self._archive(response)
+
+        manifest = json.loads(archive.read("manifest.json"))["files"]
+        self.assertEqual({entry["source"]: entry["status"] for entry in manifest}, {"good.png": "ok", "truncated.png": "error"})
+
+    def test_single_file_pages_refuse_several_files(self):
+        response = self.client.post(
+            "/image-converter/",
+            {"target_format": "png", "image_file": [make_image_upload("one.png"), make_image_upload("two.png")]},
+        )
+
+        self.assertIn("Several files were selected", response.context["error_message"])
+        self.assertIsNone(response.context["converted_image"])
+
+    def test_filters_batch_button_sends_the_selected_filter(self):
+        response = self.client.get("/image-filters/")
+
+        self.assertContains(response, 'type="radio" class="form-check-input" id="filter-grayscale" name="filter_name" value="grayscale"')
+        self.assertContains(response, '<button type="submit" formaction="/batch/filters/"')
+
+    def test_batch_validation_error(self):
+        response = self.client.post("/batch/convert/", {"target_format": "gif"})
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_unknown_batch_tool(self):
+        response = self.client.post("/batch/watermark/", {})
+
+        self.assertEqual(response.status_code, 404)
+
+
+class PipelineTest(SimpleTestCase):
+
+    def test_pipeline_endpoint_applies_operations_in_one_pass(self):
+        operations = [
+            {"op": "resize", "width": 32, "height": 24},
+            {"op": "filter", "name": "grayscale"},
+            {"op": "compress", "quality": 50},
+        ]
+        response = self.client.post(
+            "/pipeline/",
+            {"target_format": "jpeg", "operations": json.dumps(operations), "image_file": make_image_upload()},
+            headers={"Accept": "image/jpeg"},
+        )
+
+        self.assertEqual(response.status_code, 200)
+        image = Image.open(io.BytesIO(b"".join(response.streaming_content)))
+        self.assertEqual((image.format, image.size, image.mode), ("JPEG", (32, 24), "L"))
+
+    def test_pipeline_endpoint_returns_result_url(self):
+        response = self.client.post(
+            "/pipeline/",
+            {"target_format": "png", "operations": json.dumps([{"op": "crop", "width": 10, "height": 10}]), "image_file": make_image_upload()},
+        )
+
+        self.assertTrue(response.json()["result"].startswith("/result/"))
+
+    def test_invalid_operation_is_rejected(self):
+        response = self.client.post(
+            "/pipeline/",
+            {"target_format": "png", "operations": json.dumps([{"op": "rotate"}]), "image_file": make_image_upload()},
+        )
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_out_of_range_sizes_are_rejected(self):
+        for width in ("1e400", "70000", "-1e400"):
+            response = self.client.post(
+                "/pipeline/",
+                {"target_format": "png", "operations": f'[{{"op": "resize", "width": {width}, "height": 10}}]', "image_file": make_image_upload()},
+            )
+            self.assertEqual(response.status_code, 400, width)
+        response = self.client.post(
+            "/pipeline/",
+            {"target_format": "png", "operations": json.dumps([{"op": "compress", "quality": float("inf")}]), "image_file": make_image_upload()},
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_operation_count_is_limited(self):
+        blurs = [{"op": "adjust", "steps": [{"name": "gaussian_blur"}] * 3}, {"op": "filter", "name": "blur"}]
+        with override_settings(PIPELINE={"MAX_OPERATIONS": 3}):
+            response = self.client.post(
+                "/pipeline/",
+                {"target_format": "png", "operations": json.dumps(blurs), "image_file": make_image_upload()},
+            )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["error"], "Pipelines are limited to 3 operations.")
+
+    def test_consecutive_mode_conversions_are_merged(self):
+        planned = plan_operations(
+            [
+                {"op": "convert", "mode": "RGBA"},
+                {"op": "convert", "mode": "L"},
+                {"op": "resize", "width": 1, "height": 1},
+                {"op": "convert", "mode": "RGB"},
+            ]
+        )
+
+        self.assertEqual([operation.get("mode") for operation in planned], ["L", None, "RGB"])
+
+    def test_tool_wrappers_match_pipeline(self):
+        data = make_image_upload().read()
+
+        self.assertEqual(
+            resize_image(io.BytesIO(data), "png", "resize", 20, 10),
+            run_pipeline(io.BytesIO(data), "png", [{"op": "resize", "width": 20, "height": 10}]),
+        )
+
+
+class TargetSizeCompressTest(SimpleTestCase):
+
+    def setUp(self):
+        caches[settings.RESULT_CACHE_ALIAS].clear()
+
+    def test_output_fits_target_within_probe_budget(self):
+        data = make_photo_bytes((800, 600))
+        for target_format in ("jpeg", "webp"):
+            result = compress_to_size(io.BytesIO(data), target_format, 30_000)
+
+            self.assertTrue(result["fits"])
+            self.assertLessEqual(len(result["data"]), 30_000)
+            self.assertEqual(result["scale"], 1.0)
+            self.assertLessEqual(result["attempts"], TARGET_MAX_PROBES + 2)
+
+    def test_search_working_set_counts_against_memory_budget(self):
+        # 600x400 decodes to about 1 MB; the scaled copy and probe buffer bring it near 3 MB.
+        upload = SimpleUploadedFile("photo.jpg", make_photo_bytes((600, 400)), content_type="image/jpeg")
+        memory = {"REQUEST_BYTES": 2 * 1024 * 1024, "TOTAL_BYTES": 64 * 1024 * 1024, "QUEUE_TIMEOUT": 1}
+        with override_settings(IMAGE_MEMORY=memory):
+            response = self.client.post(
+                "/image-compressor/",
+                {"target_format": "jpeg", "compress_mode": "target", "target_kb": 20, "image_file": upload},
+            )
+
+        self.assertEqual(response.status_code, 413)
+
+    def test_curve_is_reused(self):
+        data = make_photo_bytes((800, 600))
+        first = compress_to_size(io.BytesIO(data), "jpeg", 30_000)
+        second = compress_to_size(io.BytesIO(data), "jpeg", 30_000, curve=first["curve"])
+
+        self.assertEqual(second["attempts"], 1)
+        self.assertEqual(second["data"], first["data"])
+
+    def test_scales_down_when_lowest_quality_is_too_big(self):
+        result = compress_to_size(io.BytesIO(make_photo_bytes((800, 600))), "jpeg", 4_000)
+
+        self.assertTrue(result["fits"])
+        self.assertLess(result["scale"], 1.0)
+        self.assertLess(result["width"], 800)
+
+    def test_view_reports_search_and_reuses_curve(self):
+        def post():
+            return self.client.post(
+                "/image-compressor/",
+                {
+                    "target_format": "webp",
+                    "compress_mode": "target",
+                    "target_kb": 20,
+                    "image_file": SimpleUploadedFile("photo.jpg", make_photo_bytes((800, 600)), content_type="image/jpeg"),
+                },
+                headers={"Accept": "image/webp"},
+            )
+
+        response = post()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["X-Compress-Fits"], "1")
+        data = b"".join(response.streaming_content)
+        self.assertLessEqual(len(data), 20 * 1024)
+        self.assertEqual(Image.open(io.BytesIO(data)).format, "WEBP")
+
+        self.assertEqual(post()["X-Compress-Attempts"], "1")
+
+    def test_target_size_is_required(self):
+        response = self.client.post(
+            "/image-compressor/",
+            {"target_format": "jpeg", "compress_mode": "target", "target_kb": "", "image_file": make_image_upload()},
+        )
+
+        self.assertEqual(response.context["error_message"], "Target size must be a positive number of KB.")
+
+
+class PNGOptimizerTest(SimpleTestCase):
+
+    def _graphic(self, alpha=255):
+        image = Image.new("RGBA", (320, 240), (240, 240, 240, alpha))
+        draw = ImageDraw.Draw(image)
+        for index in range(12):
+            draw.rectangle((index * 20, index * 10, index * 20 + 60, index * 10 + 40), fill=(index * 20, 80, 200 - index * 10, alpha))
+        return image
+
+    def test_mode_reductions_are_lossless(self):
+        image = self._graphic()
+        self.assertEqual(reduce_mode(image).mode, "P")
+        self.assertEqual(reduce_mode(self._graphic(alpha=128)).mode, "RGBA")
+        self.assertEqual(reduce_mode(Image.merge("RGB", [Image.effect_noise((64, 64), 50)] * 2 + [Image.linear_gradient("L").resize((64, 64))]).convert("RGBA")).mode, "RGB")
+
+        optimized = Image.open(io.BytesIO(optimize_png(image)))
+        self.assertIsNone(ImageChops.difference(optimized.convert("RGBA"), image).getbbox())
+
+    def test_smaller_than_default_png_save(self):
+        image = self._graphic()
+        self.assertLess(len(optimize_png(image)), len(encode_image(image, "png", **compress_save_kwargs("png", 80))) * 0.7)
+
+    def test_quantize_to_palette(self):
+        photo = Image.open(io.BytesIO(make_photo_bytes((320, 240))))
+        optimized = Image.open(io.BytesIO(optimize_png(photo, colors=16, dither=False)))
+
+        self.assertEqual(optimized.mode, "P")
+        self.assertLessEqual(len(optimized.getcolors(256)), 16)
+
+    def test_time_budget_bounds_the_search(self):
+        encode_candidate = png_utils._encode_candidate
+
+        def slow_encode(image, save_kwargs, deadline=None):
+            if save_kwargs is not png_utils.PNG_CANDIDATES[0]:
+                time.sleep(0.3)
+            return encode_candidate(image, save_kwargs, deadline)
+
+        image = self._graphic()
+        start = time.perf_counter()
+        with mock.patch("tools.utils.png_utils._encode_candidate", slow_encode):
+            data = png_utils.optimize_png(image, time_budget=0.05)
+
+        self.assertLess(time.perf_counter() - start, 0.25)
+        self.assertEqual(data, encode_candidate(png_utils.reduce_mode(image), png_utils.PNG_CANDIDATES[0]))
+
+    def test_candidates_started_after_the_deadline_skip_the_encode(self):
+        with mock.patch("tools.utils.png_utils.encode_image") as encode_image:
+            self.assertIsNone(png_utils._encode_candidate(self._graphic(), {}, time.monotonic()))
+
+        encode_image.assert_not_called()
+
+    def test_view_optimizes_png(self):
+        response = self.client.post(
+            "/image-compressor/",
+            {"target_format": "png", "compress_mode": "optimize", "palette_colors": 0, "image_file": make_image_upload()},
+            headers={"Accept": "image/png"},
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Image.open(io.BytesIO(b"".join(response.streaming_content))).mode, "P")
+
+    def test_view_requires_png_output(self):
+        response = self.client.post(
+            "/image-compressor/",
+            {"target_format": "jpeg", "compress_mode": "optimize", "image_file": make_image_upload()},
+        )
+
+        self.assertEqual(response.context["error_message"], "The PNG optimizer only produces PNG files.")
+        self.assertContains(response, '<option value="optimize" selected>')
+        self.assertNotContains(response, '<option value="quality" selected>')
+
+
+class PreviewFirstTest(SimpleTestCase):
+
+    def setUp(self):
+        get_transform_cache().clear()
+
+    def _wait_for_result(self, status_url):
+        for _ in range(200):
+            status = self.client.get(status_url).json()
+            if status["status"] != "pending":
+                return status
+            time.sleep(0.05)
+        self.fail("The full-quality result never finished.")
+
+    def _image(self, url):
+        return Image.open(io.BytesIO(b"".join(self.client.get(url).streaming_content)))
+
+    def test_preview_then_full_quality_result(self):
+        upload = SimpleUploadedFile("photo.jpg", make_photo_bytes((600, 400)), content_type="image/jpeg")
+        with override_settings(IMAGE_PREVIEW={"MAX_SIZE": 120, "QUALITY": 40}):
+            response = self.client.post("/image-filters/", {"target_format": "png", "filter_name": "blur", "preview": "1", "image_file": upload})
+
+        self.assertContains(response, "pendingResultStatus")
+        preview = self._image(response.context["filtered_image"])
+        self.assertEqual((preview.format, preview.size), ("WEBP", (120, 80)))
+
+        status = self._wait_for_result(response.context["pending_result"])
+        self.assertEqual(status["status"], "done")
+        self.assertEqual(status["download_name"], "filtered_blur.png")
+        full = self._image(status["result"])
+        self.assertEqual((full.format, full.size), ("PNG", (600, 400)))
+
+        # The finished result is cached, so repeating the request skips the preview.
+        upload.seek(0)
+        repeat = self.client.post("/image-filters/", {"target_format": "png", "filter_name": "blur", "preview": "1", "image_file": upload})
+        self.assertNotIn("pending_result", repeat.context)
+
+    def test_resize_preview_keeps_output_proportions(self):
+        with override_settings(IMAGE_PREVIEW={"MAX_SIZE": 50, "QUALITY": 40}):
+            response = self.client.post(
+                "/async/image-resize/",
+                {"target_format": "jpeg", "mode": "crop", "width": 200, "height": 100, "preview": "1", "image_file": make_image_upload(size=(300, 300))},
+            )
+
+        self.assertEqual(self._image(response.context["processed_image"]).size, (50, 25))
+        self.assertEqual(self._image(self._wait_for_result(response.context["pending_result"])["result"]).size, (200, 100))
+
+    def test_unknown_token_is_not_found(self):
+        self.assertEqual(self.client.get("/result/status/missing/").status_code, 404)
+
+    def test_full_job_that_cannot_be_admitted_falls_back_to_synchronous_result(self):
+        # Room for the preview's decode but not for the full job next to it; waiting for the
+        # budget would take the whole QUEUE_TIMEOUT.
+        memory = {"REQUEST_BYTES": 2 * 1024 * 1024, "TOTAL_BYTES": 2 * 1024 * 1024, "QUEUE_TIMEOUT": 10}
+        upload = SimpleUploadedFile("photo.jpg", make_photo_bytes((600, 400)), content_type="image/jpeg")
+        started = time.monotonic()
+        with override_settings(IMAGE_MEMORY=memory):
+            response = self.client.post("/image-filters/", {"target_format": "png", "filter_name": "blur", "preview": "1", "image_file": upload})
+
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertNotIn("pending_result", response.context)
+        self.assertEqual(self._image(response.context["filtered_image"]).size, (600, 400))
+
+
+class JobQueueTest(TransactionTestCase):
+
+    def setUp(self):
+        self.root = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(override_settings(JOBS={**settings.JOBS, "ROOT": self.root}))
+
+    def _submit(self, kind, content, **fields):
+        return self.client.post(f"/jobs/{kind}/", {"file": SimpleUploadedFile("input.png", content), **fields})
+
+    def _run_worker(self):
+        call_command("toolsworker", "--once", "--concurrency", "2", stdout=io.StringIO())
+
+    def test_hash_job_runs_in_the_worker(self):
+        content = os.urandom(300_000)
+        response = self._submit("hash", content, algorithm="merkle-sha256")
+
+        self.assertEqual(response.status_code, 202)
+        submitted = response.json()
+        self.assertEqual(submitted["status"], "queued")
+        self.assertNotIn("result_url", submitted)
+
+        self._run_worker()
+        status = self.client.get(submitted["status_url"]).json()
+        self.assertEqual(status["status"], "done")
+        self.assertEqual(status["result"]["hashes"]["sha256"], hashlib.sha256(content).hexdigest())
+        self.assertEqual(status["result"]["hash_value"], status["result"]["hashes"]["merkle-sha256"])
+        self.assertIn("hash", status["timings"])
+
+        manifest = b"".join(self.client.get(status["result_url"]).streaming_content)
+        self.assertIn(b'"chunks"', manifest)
+
+    def test_image_job_result_is_stored_on_disk(self):
+        response = self._submit(
+            "image",
+            make_image_upload(size=(64, 48)).read(),
+            target_format="webp",
+            operations=json.dumps([{"op": "resize", "width": 32, "height": 24}]),
+        )
+        result_url = f"/jobs/{response.json()['id']}/result/"
+        self.assertEqual(self.client.get(result_url).status_code, 409)
+
+        self._run_worker()
+        job = Job.objects.get()
+        self.assertEqual(job.status, Job.Status.DONE, job.error)
+        self.assertTrue(job.output_path.startswith(self.root))
+
+        result = self.client.get(result_url)
+        self.assertEqual(result["Content-Disposition"], 'attachment; filename="input.webp"')
+        image = Image.open(io.BytesIO(b"".join(result.streaming_content)))
+        self.assertEqual((image.format, image.size), ("WEBP", (32, 24)))
+
+    def test_oversized_png_job_is_processed_in_strips(self):
+        source = make_image_upload(size=(640, 480)).read()
+        operations = json.dumps([{"op": "filter", "name": "invert"}])
+        memory = {"REQUEST_BYTES": 600_000, "TOTAL_BYTES": 10**9, "QUEUE_TIMEOUT": 1}
+        tiling = {"STRIP_PIXELS": 640 * 16, "MAX_PIXELS": 10**7, "MAX_UPLOAD_SIZE": 10**7}
+        self._submit("image", source, target_format="png", operations=operations)
+        self._submit("image", source, target_format="jpeg", operations=operations)
+        with override_settings(IMAGE_MEMORY=memory, IMAGE_TILING=tiling):
+            self._run_worker()
+
+        tiled, full_frame = Job.objects.order_by("created_at")
+        self.assertEqual((tiled.status, tiled.result.get("tiled")), (Job.Status.DONE, True), tiled.error)
+        self.assertEqual(full_frame.status, Job.Status.FAILED)
+        expected = Image.new("RGB", (640, 480), (55, 215, 215))
+        self.assertIsNone(ImageChops.difference(Image.open(tiled.output_path), expected).getbbox())
+
+    def test_failed_job_reports_error(self):
+        self._submit("image", b"not an image", target_format="png")
+        self._run_worker()
+
+        job = Job.objects.get()
+        self.assertEqual(job.status, Job.Status.FAILED)
+        self.assertIn("Unreadable image", job.error)
+
+    def test_rejected_submission_leaves_no_files(self):
+        self.assertEqual(self._submit("image", b"data", operations="[{\"op\": \"rotate\"}]").status_code, 400)
+        with override_settings(IMAGE_TILING={**settings.IMAGE_TILING, "MAX_UPLOAD_SIZE": 1024}):
+            self.assertEqual(self._submit("image", os.urandom(4096)).status_code, 413)
+
+        self.assertEqual(Job.objects.count(), 0)
+        self.assertEqual(os.listdir(self.root), [])
+
+    def test_each_job_is_claimed_once(self):
+        self._submit("hash", b"one")
+        self._submit("hash", b"two")
+
+        first, second = claim_job("a"), claim_job("b")
+        self.assertNotEqual(first.pk, second.pk)
+        self.assertIsNone(claim_job("c"))
+        self.assertEqual(set(Job.objects.values_list("status", flat=True)), {Job.Status.RUNNING})
+
+    def test_cleanup_expires_old_jobs_and_stale_workers(self):
+        finished = self._submit("hash", b"old").json()["id"]
+        run_job(claim_job("worker"))
+        self._submit("hash", b"stuck")
+        claim_job("worker")
+
+        now = timezone.now() + timedelta(hours=2)
+        self.assertEqual(cleanup_jobs(now), 0)
+        self.assertEqual(Job.objects.filter(status=Job.Status.FAILED).count(), 1)
+
+        self.assertEqual(cleanup_jobs(now + timedelta(days=2)), 2)
+        self.assertFalse(Job.objects.exists())
+        self.assertFalse(os.path.exists(os.path.join(self.root, finished)))
+
+
+class WatermarkTest(SimpleTestCase):
+
+    def _photo(self, size=(400, 300), mode="RGB"):
+        return Image.open(io.BytesIO(make_photo_bytes(size))).convert(mode)
+
+    def test_only_the_text_box_is_touched(self):
+        image = self._photo()
+        original = image.copy()
+        result = apply_watermark(image, "© ToolsApp", "top_left")
+
+        self.assertEqual(result.mode, "RGB")
+        tile = watermark_tile("© ToolsApp", 11)
+        self.assertEqual(ImageChops.difference(result, original).getbbox(), (12, 12, 12 + tile.width, 12 + tile.height))
+
+    def test_region_composite_matches_full_frame_composite(self):
+        image = self._photo(mode="RGBA")
+        tile = watermark_tile("© ToolsApp", 11)
+        layer = Image.new("RGBA", image.size, (255, 255, 255, 0))
+        layer.paste(tile, (image.width - tile.width - 12, image.height - tile.height - 12))
+        expected = Image.alpha_composite(image, layer)
+
+        self.assertIsNone(ImageChops.difference(apply_watermark(image, "© ToolsApp", "bottom_right"), expected).getbbox())
+
+    def test_text_scales_with_the_image_and_tiles_are_cached(self):
+        watermark_tile.cache_clear()
+        small = self._photo((400, 300))
+        large = self._photo((1600, 1200))
+        small_box = ImageChops.difference(apply_watermark(small.copy(), "Scaled", "center"), small).getbbox()
+        large_box = ImageChops.difference(apply_watermark(large.copy(), "Scaled", "center"), large).getbbox()
+        apply_watermark(small.copy(), "Scaled", "center")
+
+        self.assertGreater(large_box[3] - large_box[1], 3 * (small_box[3] - small_box[1]))
+        self.assertEqual((watermark_tile.cache_info().hits, watermark_tile.cache_info().misses), (1, 2))
+
+    def test_tiled_pattern_covers_the_image(self):
+        image = self._photo()
+        difference = ImageChops.difference(apply_watermark(image.copy(), "Tiled", "tiled"), image)
+        for box in ((0, 0, 200, 150), (200, 0, 400, 150), (0, 150, 200, 300), (200, 150, 400, 300)):
+            self.assertIsNotNone(difference.crop(box).getbbox())
+
+    @unittest.skipUnless(os.path.exists("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"), "DejaVu Sans is not installed")
+    def test_view_with_truetype_font(self):
+        with override_settings(WATERMARK_FONT="/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"):
+            response = self.client.post(
+                "/watermark/",
+                {"target_format": "png", "watermark_text": "© ToolsApp", "position": "tiled", "text_size": 5, "image_file": make_image_upload(size=(320, 240))},
+                headers={"Accept": "image/png"},
+            )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Image.open(io.BytesIO(b"".join(response.streaming_content))).size, (320, 240))
+
+
+class FilterChainTest(SimpleTestCase):
+
+    def _photo(self, size=(400, 300), mode="RGB"):
+        return Image.open(io.BytesIO(make_photo_bytes(size))).convert(mode)
+
+    def test_point_steps_fuse_into_one_exact_lookup_table(self):
+        steps = validate_adjustments(
+            [
+                {"name": "levels", "black": 16, "white": 240},
+                {"name": "brightness", "amount": 1.3},
+                {"name": "contrast", "amount": 0.8},
+                {"name": "gamma", "amount": 1.4},
+                {"name": "posterize", "bits": 5},
+                {"name": "invert"},
+            ]
+        )
+        self.assertEqual([kind for kind, _ in plan_adjustments(steps)], ["point"])
+
+        for mode in ("RGB", "RGBA", "L"):
+            image = self._photo(mode=mode)
+            sequential = image
+            for step in steps:
+                sequential = apply_adjustments(sequential, [step])
+            fused = apply_adjustments(image, steps)
+
+            self.assertEqual(fused.mode, mode)
+            self.assertIsNone(ImageChops.difference(fused, sequential).getbbox())
+            if mode == "RGBA":
+                self.assertEqual(fused.getchannel("A").tobytes(), image.getchannel("A").tobytes())
+
+    def test_gaussian_blurs_are_combined(self):
+        steps = validate_adjustments([{"name": "gaussian_blur", "radius": 3}, {"name": "gaussian_blur", "radius": 4}])
+        self.assertEqual(plan_adjustments(steps), [("blur", 5.0)])
+
+        image = self._photo()
+        sequential = image.filter(ImageFilter.GaussianBlur(3)).filter(ImageFilter.GaussianBlur(4))
+        difference = ImageStat.Stat(ImageChops.difference(apply_adjustments(image, steps), sequential).crop((10, 10, 390, 290)))
+        self.assertLess(max(difference.mean), 1)
+        # Fixed kernels stay separate passes; a point step between them joins no kernel.
+        kinds = [kind for kind, _ in plan_adjustments(validate_adjustments([{"name": "sharpen"}, {"name": "invert"}, {"name": "detail"}]))]
+        self.assertEqual(kinds, ["kernel", "point", "kernel"])
+
+    def test_lookup_filters_keep_the_mode(self):
+        image = self._photo(mode="RGBA")
+        inverted = FILTERS["invert"](image)
+
+        self.assertEqual(inverted.mode, "RGBA")
+        self.assertEqual(inverted.getpixel((10, 10))[:3], tuple(255 - value for value in image.getpixel((10, 10))[:3]))
+        self.assertEqual(FILTERS["solarize"](self._photo().quantize(16)).mode, "RGB")
+        self.assertEqual(FILTERS["posterize"](Image.new("L", (4, 4), 200)).getpixel((0, 0)), 192)
+
+    def test_invalid_adjustments_are_rejected(self):
+        for steps in ([{"name": "swirl"}], [{"name": "gamma", "amount": 0}], [{"name": "levels", "black": 200, "white": 100}], "blur"):
+            with self.assertRaises(ValueError):
+                validate_adjustments(steps)
+
+    def test_pipeline_merges_filters_into_one_chain(self):
+        planned = plan_operations(
+            validate_operations(
+                [
+                    {"op": "filter", "name": "sharpen"},
+                    {"op": "filter", "name": "original"},
+                    {"op": "adjust", "steps": [{"name": "brightness", "amount": 1.2}]},
+                ]
+            )
+        )
+
+        self.assertEqual(planned, [{"op": "adjust", "steps": [{"name": "sharpen"}, {"name": "brightness", "amount": 1.2}]}])
+
+    def test_view_applies_the_adjustments(self):
+        response = self.client.post(
+            "/image-filters/",
+            {"target_format": "png", "filter_name": "original", "brightness": 50, "image_file": make_image_upload(color=(200, 40, 40))},
+            headers={"Accept": "image/png"},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Image.open(io.BytesIO(b"".join(response.streaming_content))).getpixel((0, 0)), (100, 20, 20))
+
+        response = self.client.post(
+            "/image-filters/", {"target_format": "png", "filter_name": "blur", "gamma": 20, "image_file": make_image_upload()}
+        )
+        self.assertContains(response, "Gamma must be between 0.1 and 10.0.")
+
+
+class TiledProcessingTest(SimpleTestCase):
+
+    def setUp(self):
+        # 17 rows per strip for the 333-pixel-wide test image, so every operation crosses
+        # many strip boundaries.
+        self.enterContext(override_settings(IMAGE_TILING={"STRIP_PIXELS": 333 * 17, "MAX_PIXELS": 10**7, "MAX_UPLOAD_SIZE": 10**7}))
+
+    def _image(self, mode="RGB"):
+        return synthetic_image((333, 251), mode)
+
+    def _encode(self, image, image_format="PNG", **save_kwargs):
+        buffer = io.BytesIO()
+        image.save(buffer, format=image_format, **save_kwargs)
+        return buffer.getvalue()
+
+    def _tiled(self, data, operations):
+        output = io.BytesIO()
+        run_tiled_pipeline(io.BytesIO(data), output, validate_operations(operations))
+        return Image.open(io.BytesIO(output.getvalue()))
+
+    def test_filters_and_watermark_match_full_frame(self):
+        steps = [{"name": "levels", "black": 10, "white": 240}, {"name": "sharpen"}, {"name": "gaussian_blur", "radius": 3}, {"name": "unsharp_mask"}]
+        for mode in ("RGB", "RGBA", "P"):
+            image = self._image(mode)
+            data = self._encode(image)
+            full = image.convert("RGB") if mode == "P" else image
+
+            tiled = self._tiled(data, [{"op": "adjust", "steps": steps}, {"op": "watermark", "text": "Tiles", "position": "tiled", "scale": 0.05}])
+            expected = apply_watermark(apply_adjustments(full, validate_adjustments(steps)), "Tiles", "tiled", 0.05)
+            self.assertIsNone(ImageChops.difference(tiled, expected).getbbox(), mode)
+
+    def test_resize_and_crop_match_full_frame(self):
+        for mode in ("RGB", "RGBA"):
+            image = self._image(mode)
+            data = self._encode(image)
+            for op, size in (("resize", (150, 90)), ("crop", (150, 150)), ("resize", (700, 500))):
+                box = center_crop_box(image.size, size) if op == "crop" else None
+                expected = image.resize(size, Image.Resampling.LANCZOS, box=box)
+                tiled = self._tiled(data, [{"op": op, "width": size[0], "height": size[1]}])
+
+                self.assertEqual(tiled.size, size)
+                # Only rounding differs: strip boxes start at fractional rows.
+                self.assertLessEqual(max(high for _, high in ImageChops.difference(tiled, expected).getextrema()), 2)
+
+    def test_pnm_input(self):
+        image = self._image()
+        for mode in ("RGB", "L"):
+            source = image.convert(mode)
+            tiled = self._tiled(self._encode(source, "PPM"), [])
+            self.assertEqual(tiled.format, "PNG")
+            self.assertIsNone(ImageChops.difference(tiled, source).getbbox())
+
+    def test_strips_hold_a_bounded_number_of_rows(self):
+        source = io.BytesIO(self._encode(self._image()))
+        strips = read_strips(source, read_header(source), 17)
+        heights = []
+
+        def tracked():
+            for strip in strips:
+                heights.append(strip.height)
+                yield strip
+
+        window = RowWindow(tracked())
+        for top in range(0, 251, 17):
+            rows = window.rows(max(0, top - 5), min(251, top + 22))
+            self.assertLessEqual(window.buffer.height, 17 + 22 + 5)
+            self.assertEqual(rows.height, min(251, top + 22) - max(0, top - 5))
+        self.assertEqual(sum(heights), 251)
+
+    def test_unsupported_inputs_are_rejected(self):
+        image = self._image()
+        interlaced = PNG_SIGNATURE + _chunk(b"IHDR", bytes.fromhex("0000014d000000fb0802000001"))
+        for data in (interlaced, self._encode(image.convert("I;16")), self._encode(image, "JPEG")):
+            with self.assertRaises(ValueError):
+                read_header(io.BytesIO(data))
+
+
+class SrcsetTest(SimpleTestCase):
+
+    def _post(self, data, headers=None, **fields):
+        return self.client.post("/image-resize/srcset/", {"image_file": SimpleUploadedFile("Photo 1.jpg", data), **fields}, headers=headers)
+
+    def test_archive_has_every_size_and_format_with_manifest(self):
+        response = self._post(make_photo_bytes())
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/zip")
+        self.assertIn("attachment", response["Content-Disposition"])
+        archive = zipfile.ZipFile(io.BytesIO(b"".join(response.streaming_content)))
+        manifest = json.loads(archive.read("manifest.json"))
+
+        # The 2400 pixel wide source is not upscaled to 2560.
+        self.assertEqual([(entry["width"], entry["format"]) for entry in manifest["files"]], [(1280, "webp"), (1280, "jpeg"), (640, "webp"), (640, "jpeg"), (320, "webp"), (320, "jpeg")])
+        for entry in manifest["files"]:
+            data = archive.read(entry["file"])
+            self.assertEqual(entry["bytes"], len(data))
+            image = Image.open(io.BytesIO(data))
+            self.assertEqual((image.format.lower(), image.size), (entry["format"], (entry["width"], entry["height"])))
+        self.assertEqual(manifest["files"][0]["height"], 853)
+        picture = archive.read("picture.html").decode()
+        self.assertEqual(picture, manifest["picture"])
+        self.assertIn('<source type="image/webp" srcset="Photo_1-320w.webp 320w, Photo_1-640w.webp 640w, Photo_1-1280w.webp 1280w"', picture)
+        self.assertIn('<img src="Photo_1-320w.jpg"', picture)
+        self.assertIn('width="1280" height="853"', picture)
+
+    def test_sizes_cascade_from_one_decode(self):
+        data = make_photo_bytes(image_format="PNG")
+        resize = Image.Image.resize
+        load = ImageFile.ImageFile.load
+        resized_from = []
+        loads = []
+
+        def recording_resize(image, size, *args, **kwargs):
+            resized_from.append(image.size)
+            return resize(image, size, *args, **kwargs)
+
+        def recording_load(image):
+            # Only calls that still have tiles to read decode anything.
+            if image.tile:
+                loads.append(image.size)
+            return load(image)
+
+        with mock.patch.object(Image.Image, "resize", recording_resize), mock.patch.object(ImageFile.ImageFile, "load", recording_load):
+            srcset_archive(io.BytesIO(data), "zip", [1280, 640, 320], ["webp"], 80)
+
+        self.assertEqual(resized_from, [(2400, 1600), (1280, 853), (640, 427)])
+        self.assertEqual(len(loads), 1)
+
+    def test_small_source_keeps_its_own_width(self):
+        response = self._post(make_image_upload().read(), formats=["png"])
+        manifest = json.loads(zipfile.ZipFile(io.BytesIO(b"".join(response.streaming_content))).read("manifest.json"))
+
+        self.assertEqual([(entry["file"], entry["width"], entry["height"]) for entry in manifest["files"]], [("Photo_1-64w.png", 64, 48)])
+
+    def test_json_clients_get_manifest_and_link(self):
+        response = self._post(make_photo_bytes(), widths="800, 400", formats=["jpeg"], headers={"Accept": "application/json"})
+
+        payload = response.json()
+        self.assertTrue(payload["result"].startswith("/result/"))
+        self.assertEqual([entry["width"] for entry in payload["files"]], [800, 400])
+        self.assertEqual(payload["source"]["width"], 2400)
+
+    def test_invalid_widths_are_rejected(self):
+        self.assertEqual(self._post(make_photo_bytes(), widths="big").status_code, 400)
+        self.assertEqual(self._post(make_photo_bytes(), widths="0,100").status_code, 400)
+        self.assertEqual(self._post(make_photo_bytes(), formats=["gif"]).status_code, 400)
+
+
+class ImageInspectTest(SimpleTestCase):
+
+    def _jpeg(self, **save_kwargs):
+        return image_bytes(Image.open(io.BytesIO(make_photo_bytes())), "JPEG", **save_kwargs)
+
+    def test_batch_reports_headers_and_metadata(self):
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        exif[0x010F] = "Canon"
+        icc = ImageCms.ImageCmsProfile(ImageCms.createProfile("sRGB")).tobytes()
+        frames = [Image.new("RGB", (30, 20), color) for color in ("red", "green", "blue")]
+        gif = image_bytes(frames[0], "GIF", save_all=True, append_images=frames[1:])
+
+        response = self.client.post(
+            "/inspect/",
+            {
+                "file": [
+                    SimpleUploadedFile("photo.jpg", self._jpeg(exif=exif.tobytes(), icc_profile=icc)),
+                    SimpleUploadedFile("anim.gif", gif),
+                    SimpleUploadedFile("notes.txt", b"not an image"),
+                ]
+            },
+        )
+
+        self.assertEqual(response.status_code, 200)
+        photo, anim, notes = response.json()["files"]
+        self.assertEqual((photo["format"], photo["width"], photo["height"], photo["mode"]), ("JPEG", 2400, 1600, "RGB"))
+        self.assertEqual((photo["orientation"], photo["display_width"], photo["display_height"]), (6, 1600, 2400))
+        self.assertEqual(photo["exif"]["Make"], "Canon")
+        self.assertEqual(photo["icc_profile"], {"bytes": len(icc), "description": "sRGB built-in"})
+        self.assertLess(photo["bytes_read"], photo["bytes"])
+        self.assertEqual((anim["format"], anim["frames"], anim["animated"]), ("GIF", 3, True))
+        self.assertEqual(notes["error"], "Not a supported image file.")
+
+    def test_raw_body_stops_reading_after_the_header(self):
+        data = make_photo_bytes(image_format="PNG")
+        read = WSGIRequest.read
+        reads = []
+
+        def recording_read(request, *args):
+            chunk = read(request, *args)
+            reads.append(len(chunk))
+            return chunk
+
+        with mock.patch.object(WSGIRequest, "read", recording_read):
+            response = self.client.generic("POST", "/inspect/", data, content_type="image/png", headers={"X-File-Name": "big.png"})
+
+        result = response.json()["files"][0]
+        self.assertEqual((result["name"], result["format"], result["width"], result["bytes"]), ("big.png", "PNG", 2400, len(data)))
+        self.assertEqual(sum(reads), result["bytes_read"])
+        self.assertLessEqual(result["bytes_read"], 64 * 1024)
+
+    def test_malformed_content_length_is_rejected(self):
+        response = self.client.generic("POST", "/inspect/", b"data", content_type="image/png", CONTENT_LENGTH="abc")
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["error"], "Invalid Content-Length header.")
+
+    def test_large_header_is_read_until_it_parses(self):
+        # A 200 KB profile pushes the JPEG header well past the first read.
+        data = self._jpeg(icc_profile=b"\0" * 200000)
+        with override_settings(IMAGE_INSPECT={"HEAD_BYTES": 4096, "MAX_BYTES": 1024 * 1024, "MAX_FILES": 10}):
+            response = self.client.post("/inspect/", {"file": SimpleUploadedFile("icc.jpg", data)})
+
+        result = response.json()["files"][0]
+        self.assertEqual((result["width"], result["icc_profile"]["bytes"]), (2400, 200000))
+        self.assertLess(result["bytes_read"], len(data))
+
+    def test_images_over_the_pixel_limit_are_still_described(self):
+        response = self.client.post("/inspect/", {"file": SimpleUploadedFile("huge.png", make_png_header(20000, 20000))})
+
+        result = response.json()["files"][0]
+        self.assertEqual((result["format"], result["width"], result["height"]), ("PNG", 20000, 20000))
+        self.assertTrue(result["exceeds_pixel_limit"])
+
+    def test_plugin_errors_on_oversized_headers_become_error_entries(self):
+        def failing_open(fp, filename):
+            raise EOFError("truncated header")
+
+        _, accept = Image.OPEN["PNG"]
+        bomb = Image.DecompressionBombError("too many pixels")
+        with mock.patch("tools.utils.inspect_utils.Image.open", side_effect=bomb), mock.patch.dict(Image.OPEN, {"PNG": (failing_open, accept)}):
+            response = self.client.post("/inspect/", {"file": SimpleUploadedFile("huge.png", make_png_header(20000, 20000))})
+
+        self.assertEqual(response.json()["files"][0]["error"], "Not a supported image file.")
+
+    def test_too_many_files_are_rejected(self):
+        files = [SimpleUploadedFile(f"{index}.png", make_image_upload().read()) for index in range(3)]
+        with override_settings(IMAGE_INSPECT={"HEAD_BYTES": 4096, "MAX_BYTES": 1024 * 1024, "MAX_FILES": 2}):
+            response = self.client.post("/inspect/", {"file": files})
+
+        self.assertEqual(response.status_code, 400)
+
+
+class ImageUploadHandlerTest(SimpleTestCase):
+
+    def _receive(self, content, **handler_options):
+        handler = ImageUploadHandler(**handler_options)
+        handler.handle_raw_input(None, {}, len(content), b"boundary")
+        handler.new_file("image_file", "photo.png", "image/png", len(content))
+        for start in range(0, len(content), handler.chunk_size):
+            handler.receive_data_chunk(content[start:start + handler.chunk_size], start)
+        return handler.file_complete(len(content))
+
+    def test_small_upload_is_handed_over_without_copying(self):
+        content = make_image_upload().read()
+        upload = self._receive(content)
+
+        self.assertIsNone(upload.file)
+        self.assertIs(_read_upload(upload), upload.content)
+        self.assertIs(_read_upload(upload), _read_upload(upload))
+        self.assertEqual(upload.hexdigests["sha256"], hashlib.sha256(content).hexdigest())
+
+    def test_large_upload_is_mapped_not_read_back(self):
+        content = make_photo_bytes(size=(600, 400), image_format="PNG")
+        with override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=4096):
+            upload = self._receive(content)
+
+        try:
+            self.assertEqual(os.path.getsize(upload.file.name), len(content))
+            # Hashing for the cache key and decoding both avoid reading the spooled file.
+            with mock.patch.object(upload.file, "read", side_effect=AssertionError("read back")):
+                self.assertEqual(calculate_file_hash(upload), hashlib.sha256(content).hexdigest())
+                get_transform_cache().make_key(upload, "convert", {"target_format": "jpeg"})
+                data = _read_upload(upload)
+                self.assertIsInstance(data, MappedFile)
+                self.assertEqual(run_transform(convert_image, data, {"target_format": "jpeg"}), convert_image(io.BytesIO(content), "jpeg"))
+        finally:
+            upload.close()
+
+        self.assertFalse(os.path.exists(upload.file.name))
+
+    def test_detached_data_outlives_the_upload(self):
+        content = make_photo_bytes(size=(300, 200), image_format="PNG")
+        with override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=4096):
+            upload = self._receive(content)
+        data = upload.detached_data()
+        upload.close()
+
+        try:
+            with open(data.path, "rb") as detached:
+                self.assertEqual(detached.read(), content)
+        finally:
+            os.remove(data.path)
+
+    def test_spooled_upload_through_view_and_process_pool(self):
+        get_transform_cache().clear()
+        content = make_photo_bytes(size=(600, 400), image_format="PNG")
+        with override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=4096):
+            response = self.client.post(
+                "/image-converter/",
+                {"target_format": "jpeg", "image_file": SimpleUploadedFile("photo.png", content)},
+                headers={"Accept": "image/jpeg"},
+            )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Image.open(io.BytesIO(b"".join(response.streaming_content))).size, (600, 400))
+
+    def test_oversized_request_is_refused_before_reading_the_body(self):
+        with override_settings(MAX_IMAGE_UPLOAD_SIZE=1024):
+            with mock.patch("tools.views._image_convert_form") as form:
+                response = self.client.post("/image-converter/", {"target_format": "png", "image_file": make_image_upload(size=(300, 300))})
+            pipeline = self.client.post("/pipeline/", {"image_file": make_image_upload(size=(300, 300)), "operations": "[]"})
+
+        self.assertEqual(response.status_code, 413)
+        form.assert_not_called()
+        self.assertEqual(pipeline.status_code, 413)
+        self.assertIn("error", pipeline.json())
+
+    def test_streamed_body_over_the_cap_stops_the_upload(self):
+        handler = ImageUploadHandler(max_size=100)
+        handler.handle_raw_input(None, {}, 0, b"boundary")
+        handler.new_file("image_file", "photo.png", "image/png", None)
+        handler.receive_data_chunk(b"x" * 60, 0)
+        with self.assertRaises(StopUpload):
+            handler.receive_data_chunk(b"x" * 60, 60)
+        self.assertTrue(handler.too_large)
+
+    def test_image_views_still_enforce_csrf(self):
+        client = Client(enforce_csrf_checks=True)
+        response = client.post("/image-converter/", {"target_format": "png", "image_file": make_image_upload()})
+
+        self.assertEqual(response.status_code, 403)
+
+
+class MetricsTest(SimpleTestCase):
+
+    def setUp(self):
+        get_transform_cache().clear()
+        for metric in REGISTRY:
+            metric.clear()
+
+    def test_histogram_exports_cumulative_buckets(self):
+        histogram = Histogram("demo_seconds", "Demo.", (0.1, 1), ("tool",))
+        for value in (0.05, 0.5, 5):
+            histogram.observe(value, tool="qr")
+
+        lines = histogram.collect()
+        self.assertIn('demo_seconds_bucket{tool="qr",le="0.1"} 1', lines)
+        self.assertIn('demo_seconds_bucket{tool="qr",le="1"} 2', lines)
+        self.assertIn('demo_seconds_bucket{tool="qr",le="+Inf"} 3', lines)
+        self.assertIn('demo_seconds_count{tool="qr"} 3', lines)
+        self.assertIn('demo_seconds_sum{tool="qr"} 5.55', lines)
+
+    def test_server_timing_lists_pipeline_stages_on_request(self):
+        response = self.client.post(
+            "/image-converter/",
+            {"target_format": "webp", "image_file": make_image_upload()},
+            headers={"X-Server-Timing": "1"},
+        )
+
+        stages = [entry.split(";")[0] for entry in response["Server-Timing"].split(", ")]
+        self.assertEqual(stages, ["parse", "decode", "transform", "encode", "response", "render", "total"])
+
+        untimed = self.client.post("/image-converter/", {"target_format": "webp", "image_file": make_image_upload()})
+        self.assertFalse(untimed.has_header("Server-Timing"))
+
+    def test_malformed_content_length_counts_as_empty_body(self):
+        response = self.client.get("/qr/", CONTENT_LENGTH="abc")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('tools_request_bytes_count{tool="qr",format="none"} 1', REQUEST_BYTES.collect())
+
+    def test_metrics_endpoint_exports_labeled_histograms(self):
+        self.client.post("/image-resize/", {"target_format": "png", "width": 32, "height": 24, "image_file": make_image_upload()})
+        self.client.post("/qr/", {"url": "https://example.com"})
+        self.client.get("/qr/")
+
+        response = self.client.get("/metrics")
+        body = response.content.decode("utf-8")
+
+        self.assertEqual(response["Content-Type"], "text/plain; version=0.0.4; charset=utf-8")
+        self.assertIn('tools_requests_total{tool="resize",format="png",status="200"} 1', body)
+        self.assertIn('tools_requests_total{tool="qr",format="none",status="200"} 1', body)
+        self.assertIn('tools_stage_duration_seconds_count{tool="resize",format="png",stage="decode"} 1', body)
+        self.assertIn('tools_stage_duration_seconds_count{tool="qr",format="png",stage="encode"} 1', body)
+        self.assertIn('tools_image_pixels_sum{tool="resize",format="png"} 3072', body)
+        self.assertIn('tools_response_bytes_count{tool="qr",format="png"} 1', body)
+        self.assertIn('tools_peak_rss_delta_bytes_count{tool="resize",format="png"} 1', body)
+        # The metrics endpoint itself is not a tool.
+        self.assertNotIn('tool="metrics"', body)
+
+    def test_hash_stages_are_recorded(self):
+        upload = SimpleUploadedFile("test.txt", b"hello world", content_type="text/plain")
+        with self.settings(METRICS={"SERVER_TIMING": True}):
+            response = self.client.post("/hash/", {"file": upload, "algorithm": "sha1"})
+
+        self.assertIn("parse;dur=", response["Server-Timing"])
+        self.assertIn("hash;dur=", response["Server-Timing"])
+
+    async def test_async_views_report_worker_stages(self):
+        response = await self.async_client.post(
+            "/async/image-filters/",
+            {"target_format": "png", "filter_name": "blur", "image_file": make_image_upload()},
+            headers={"X-Server-Timing": "1"},
+        )
+
+        self.assertIn("transform;dur=", response["Server-Timing"])
+
+
+class StreamingHashTest(SimpleTestCase):
+
+    def test_all_algorithms_from_single_read(self):
+        content = b"hello world" * 1000
+        uploaded_file = SimpleUploadedFile("test.txt", content, content_type="text/plain")
+
+        result = calculate_file_hashes(uploaded_file)
+
+        self.assertEqual(set(result), {"sha256", "sha1", "md5", "sha512", "blake2b"})
+        self.assertEqual(result["blake2b"], hashlib.blake2b(content).hexdigest())
+        self.assertEqual(result["sha512"], hashlib.sha512(content).hexdigest())
+
+    def test_digests_missing_from_the_upload_handler(self):
+        content = b"hello world" * 1000
+        uploaded_file = SimpleUploadedFile("test.txt", content, content_type="text/plain")
+        uploaded_file.hexdigests = {"sha256": "precomputed"}
+
+        result = calculate_file_hashes(uploaded_file, ("sha256", "md5"))
+        self.assertEqual(result, {"sha256": "precomputed", "md5": hashlib.md5(content).hexdigest()})
+
+        discarded = HashedUpload("test.txt", len(content), "text/plain", {"sha256": "precomputed"})
+        with self.assertRaisesMessage(ValueError, "The merkle-sha256 digest was not computed while the file was uploaded."):
+            calculate_file_hashes(discarded, ("merkle-sha256",))
+        with self.assertRaisesMessage(ValueError, "Unsupported algorithm: crc32"):
+            calculate_file_hashes(discarded, ("crc32",))
+
+    def test_hash_view_hashes_while_streaming(self):
+        content = b"x" * (3 * 1024 * 1024 + 7)
+        uploaded_file = SimpleUploadedFile("big.bin", content, content_type="application/octet-stream")
+
+        with mock.patch("django.core.files.uploadhandler.TemporaryFileUploadHandler.receive_data_chunk") as spill:
+            response = self.client.post("/hash/", {"file": uploaded_file, "algorithm": "sha512"})
+
+        spill.assert_not_called()
+        self.assertEqual(response.context["hash_value"], hashlib.sha512(content).hexdigest())
+        self.assertEqual(dict(response.context["all_hashes"])["md5"], hashlib.md5(content).hexdigest())
+
+    def test_hash_view_stops_reading_oversized_uploads(self):
+        uploaded_file = SimpleUploadedFile("big.bin", b"x" * (3 * 1024 * 1024), content_type="application/octet-stream")
+        with override_settings(MAX_UPLOAD_FILE_SIZE=1024 * 1024), mock.patch.object(ParallelHasher, "update", autospec=True) as update:
+            response = self.client.post("/hash/", {"file": uploaded_file, "algorithm": "sha256"})
+
+        self.assertEqual(response.context["error_message"], "File size is too large.")
+        self.assertLessEqual(sum(len(call.args[1]) for call in update.call_args_list), 1024 * 1024)
+
+    def test_hash_view_rejects_oversized_request_before_reading(self):
+        uploaded_file = SimpleUploadedFile("big.bin", b"x" * 4096, content_type="application/octet-stream")
+        with override_settings(MAX_HASH_REQUEST_SIZE=1024), mock.patch.object(ParallelHasher, "update") as update:
+            response = self.client.post("/hash/", {"file": uploaded_file})
+
+        self.assertEqual(response.context["error_message"], "File size is too large.")
+        update.assert_not_called()
+
+    def test_hash_view_enforces_csrf(self):
+        client = Client(enforce_csrf_checks=True)
+        uploaded_file = SimpleUploadedFile("test.txt", b"hello", content_type="text/plain")
+
+        response = client.post("/hash/", {"file": uploaded_file})
+
+        self.assertEqual(response.status_code, 403)
+
+    def test_hash_view_rejects_unknown_algorithm(self):
+        uploaded_file = SimpleUploadedFile("test.txt", b"hello", content_type="text/plain")
+
+        response = self.client.post("/hash/", {"file": uploaded_file, "algorithm": "crc32"})
+
+        self.assertEqual(response.context["error_message"], "Unsupported algorithm: crc32")
+
+
+class ParallelHashTest(SimpleTestCase):
+
+    def test_parallel_hasher_matches_serial(self):
+        content = bytes(range(256)) * 20000
+        serial = calculate_file_hashes(SimpleUploadedFile("a.bin", content))
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            parallel = calculate_file_hashes(SimpleUploadedFile("a.bin", content), executor=executor)
+
+        self.assertEqual(serial, parallel)
+
+    def test_hash_view_accepts_several_files(self):
+        response = self.client.post(
+            "/hash/",
+            {
+                "file": [
+                    SimpleUploadedFile("one.txt", b"one"),
+                    SimpleUploadedFile("two.txt", b"two"),
+                ],
+                "algorithm": "md5",
+            },
+        )
+
+        results = response.context["results"]
+        self.assertEqual([result["file_name"] for result in results], ["one.txt", "two.txt"])
+        self.assertEqual(results[1]["hash_value"], hashlib.md5(b"two").hexdigest())
+
+    def test_compare_identical_files(self):
+        response = self.client.post(
+            "/hash/",
+            {"file": [SimpleUploadedFile("a.txt", b"same"), SimpleUploadedFile("b.txt", b"same")], "mode": "compare"},
+        )
+
+        self.assertTrue(response.context["comparison"]["identical"])
+
+    def test_compare_stops_at_first_differing_digest(self):
+        result = compare_files(SimpleUploadedFile("a.txt", b"aaaa"), SimpleUploadedFile("b.txt", b"aaab"))
+
+        self.assertEqual(result["differing_algorithm"], "sha256")
+        self.assertEqual(result["compared"], ["sha256"])
+
+    def test_compare_different_sizes_needs_no_digest(self):
+        result = compare_files(SimpleUploadedFile("a.txt", b"a"), SimpleUploadedFile("b.txt", b"ab"))
+
+        self.assertEqual((result["identical"], result["compared"]), (False, []))
+
+    def test_compare_requires_two_files(self):
+        response = self.client.post("/hash/", {"file": SimpleUploadedFile("a.txt", b"a"), "mode": "compare"})
+
+        self.assertEqual(response.context["error_message"], "Please select exactly two files to compare.")
+
+
+class MerkleHashTest(SimpleTestCase):
+
+    def test_root_combines_block_digests(self):
+        hasher = MerkleSha256(block_size=4)
+        hasher.update(b"aaaabbbbcc")
+
+        leaves = [hashlib.sha256(b"\x00" + block).digest() for block in (b"aaaa", b"bbbb", b"cc")]
+        left = hashlib.sha256(b"\x01" + leaves[0] + leaves[1]).digest()
+        expected = hashlib.sha256(b"\x01" + left + leaves[2]).hexdigest()
+        self.assertEqual(hasher.hexdigest(), expected)
+        self.assertEqual(hasher.manifest()["chunks"], [leaf.hex() for leaf in leaves])
+
+    def test_root_is_independent_of_chunking_and_threads(self):
+        content = os.urandom(100_000)
+        serial = MerkleSha256(block_size=4096)
+        serial.update(content)
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            parallel = MerkleSha256(block_size=4096, executor=executor, max_pending=2)
+            for start in range(0, len(content), 1000):
+                parallel.update(content[start:start + 1000])
+            parallel_root = parallel.hexdigest()
+
+        self.assertEqual(serial.hexdigest(), parallel_root)
+
+    def test_hash_view_offers_chunk_manifest(self):
+        content = os.urandom(3 * 1024 * 1024 + 10)
+        response = self.client.post(
+            "/hash/",
+            {"file": SimpleUploadedFile("disk.iso", content), "algorithm": "merkle-sha256"},
+        )
+
+        self.assertEqual(response.context["chunk_count"], 4)
+        manifest = json.loads(b"".join(self.client.get(response.context["manifest_url"]).streaming_content))
+        self.assertEqual(manifest["root"], response.context["hash_value"])
+        self.assertEqual(manifest["size"], len(content))
+
+
+class QRCacheTest(SimpleTestCase):
+
+    def setUp(self):
+        for cache in get_qr_caches().values():
+            cache.clear()
+
+    def test_rendered_png_matches_qrcode_library(self):
+        qr = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_M, box_size=10, border=4)
+        qr.add_data("https://example.com/campaign")
+        qr.make(fit=True)
+        expected = qr.make_image(fill_color="black", back_color="white").get_image().convert("L")
+
+        rendered = Image.open(io.BytesIO(make_qr_png("https://example.com/campaign"))).convert("L")
+
+        self.assertEqual(rendered.size, expected.size)
+        self.assertEqual(rendered.tobytes(), expected.tobytes())
+
+    def test_svg_output_covers_dark_modules(self):
+        size, _ = qr_matrix("https://example.com")
+        svg = make_qr("https://example.com", "svg", box_size=4, border=2).decode("utf-8")
+
+        self.assertTrue(svg.startswith("<svg"))
+        self.assertIn(f'viewBox="0 0 {size + 4} {size + 4}"', svg)
+        self.assertIn(f'width="{(size + 4) * 4}"', svg)
+        # Top edge of the top-left finder pattern is one seven-module run.
+        self.assertIn("M2 2h7v1h-7z", svg)
+
+    def test_repeated_requests_hit_both_caches(self):
+        for _ in range(3):
+            response = self.client.post("/qr/", {"url": "https://example.com"})
+            self.assertEqual(response.status_code, 200)
+
+        stats = self.client.get("/qr/stats/").json()
+        self.assertEqual(stats["matrix"]["misses"], 1)
+        self.assertEqual(stats["matrix"]["hits"], 2)
+        self.assertEqual(stats["render"]["hits"], 2)
+        self.assertGreater(stats["matrix"]["compute_seconds"], 0)
+
+    def test_conditional_request_returns_not_modified(self):
+        headers = {"Accept": "image/png"}
+        response = self.client.get("/qr/", {"url": "https://example.com"}, headers=headers)
+        self.assertEqual(response["Content-Type"], "image/png")
+
+        cached = self.client.get("/qr/", {"url": "https://example.com"}, headers={**headers, "If-None-Match": response["ETag"]})
+        self.assertEqual(cached.status_code, 304)
+
+        changed = self.client.get("/qr/", {"url": "https://example.org"}, headers={**headers, "If-None-Match": response["ETag"]})
+        self.assertEqual(changed.status_code, 200)
+
+    def test_post_is_never_answered_with_not_modified(self):
+        headers = {"Accept": "image/png"}
+        response = self.client.post("/qr/", {"url": "https://example.com"}, headers=headers)
+
+        repeat = self.client.post("/qr/", {"url": "https://example.com"}, headers={**headers, "If-None-Match": response["ETag"]})
+        self.assertEqual(repeat.status_code, 200)
+        self.assertEqual(b"".join(repeat.streaming_content), b"".join(response.streaming_content))
+
+    def test_matrix_cache_evicts_least_recently_used(self):
+        with override_settings(QR_CACHE={"MATRIX_ENTRIES": 2, "RENDER_ENTRIES": 2}):
+            for data in ("a", "b", "a", "c", "a"):
+                qr_matrix(data)
+            stats = get_qr_caches()["matrix"].stats()
+
+        self.assertEqual(stats["entries"], 2)
+        self.assertEqual(stats["misses"], 3)
+        self.assertEqual(stats["hits"], 2)
+
+
+class QRBulkTest(SimpleTestCase):
+
+    def _zip(self, response):
+        return zipfile.ZipFile(io.BytesIO(b"".join(response.streaming_content)))
+
+    def test_matrix_matches_qrcode_library(self):
+        for data in ("https://example.com/badge/00001", "HELLO WORLD 123", "x" * 300):
+            for level in ("L", "H"):
+                for mask in (None, 5):
+                    qr = qrcode.QRCode(error_correction=ERROR_CORRECTION_LEVELS[level], mask_pattern=mask, border=0)
+                    qr.add_data(data)
+                    qr.make(fit=True)
+                    expected = bytes(int(module) for row in qr.get_matrix() for module in row)
+
+                    self.assertEqual(compute_qr_matrix(data, level, mask), (qr.modules_count, expected))
+
+    def test_parse_list_skips_header_and_blank_lines(self):
+        text = "url,name\nhttps://a.example,Ann\n\n\"https://b.example/?q=1,2\",Bob\nhttps://c.example\n"
+        self.assertEqual(parse_qr_list(text), ["https://a.example", "https://b.example/?q=1,2", "https://c.example"])
+
+    def test_bulk_endpoint_streams_zip_with_manifest(self):
+        urls = "\n".join([f"https://example.com/badge/{index}" for index in range(3)] + ["x" * 3000])
+        response = self.client.post("/qr/bulk/", {"urls": urls})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/zip")
+        archive = self._zip(response)
+        self.assertEqual(archive.namelist(), ["qr-00001.png", "qr-00002.png", "qr-00003.png", "manifest.json"])
+        self.assertEqual(Image.open(archive.open("qr-00001.png")).format, "PNG")
+
+        codes = json.loads(archive.read("manifest.json"))["codes"]
+        self.assertEqual(codes[1], {"index": 2, "data": "https://example.com/badge/1", "status": "ok", "entry": "qr-00002.png"})
+        self.assertEqual(codes[3]["status"], "error")
+
+    def test_bulk_endpoint_accepts_csv_upload_as_svg(self):
+        upload = SimpleUploadedFile("badges.csv", b"url\nhttps://a.example\nhttps://b.example\n", content_type="text/csv")
+        response = self.client.post("/qr/bulk/", {"file": upload, "format": "svg", "mask": "3"})
+
+        archive = self._zip(response)
+        self.assertEqual(archive.namelist(), ["qr-00001.svg", "qr-00002.svg", "manifest.json"])
+        self.assertTrue(archive.read("qr-00002.svg").startswith(b"<svg"))
+
+    def test_bulk_endpoint_rejects_bad_input(self):
+        self.assertEqual(self.client.get("/qr/bulk/").status_code, 405)
+        self.assertEqual(self.client.post("/qr/bulk/", {"urls": ""}).status_code, 400)
+
+        response = self.client.post("/qr/bulk/", {"urls": "https://a.example", "mask": "9"})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("Mask", response.json()["error"])
+
+    def test_management_command_writes_zip(self):
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, "urls.txt")
+            output = os.path.join(directory, "codes.zip")
+            with open(source, "w") as handle:
+                handle.write("https://a.example\nhttps://b.example\n")
+
+            stdout = io.StringIO()
+            call_command("qrbulk", source, "-o", output, stdout=stdout)
+
+            self.assertIn("2 codes written", stdout.getvalue())
+            with zipfile.ZipFile(output) as archive:
+                self.assertEqual(len(archive.namelist()), 3)
+
+
+class BenchCommandTest(SimpleTestCase):
+
+    def test_bench_writes_results_and_fails_on_regression(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, "bench.json")
+            options = [
+                "--sizes", "64x48", "--formats", "png,jpeg", "--modes", "RGB,RGBA",
+                "--tools", "convert,resize,qr,hash", "--iterations", "2", "--warmup", "0", "--hash-size", "1",
+            ]
+            call_command("bench", *options, "-o", output, stdout=io.StringIO())
+
+            with open(output) as handle:
+                report = json.load(handle)
+            results = report["results"]
+            self.assertIn("direct/convert/64x48-png-rgba", results)
+            self.assertIn("view/resize/64x48-jpeg-rgb", results)
+            self.assertNotIn("direct/convert/64x48-jpeg-rgba", results)
+            self.assertIn("view/qr/png", results)
+            self.assertGreater(results["direct/hash/sha256-1mib"]["mib_per_s"], 0)
+            for name in ("direct/resize/64x48-png-rgb", "view/convert/64x48-jpeg-rgb"):
+                self.assertEqual({"ops_per_s", "p50_ms", "p95_ms", "p99_ms", "peak_memory_bytes", "output_bytes"} - set(results[name]), set())
+
+            results["direct/resize/64x48-png-rgb"]["ops_per_s"] *= 1000
+            baseline = os.path.join(directory, "baseline.json")
+            with open(baseline, "w") as handle:
+                json.dump(report, handle)
+            with self.assertRaisesMessage(CommandError, "regression"):
+                call_command("bench", *options, "--tools", "resize", "--skip-views", "--baseline", baseline, stdout=io.StringIO(), stderr=io.StringIO())
+
+    def test_compare_flags_slower_bigger_and_failing_results(self):
+        before = {"ops_per_s": 100.0, "p95_ms": 10.0, "output_bytes": 1000, "peak_memory_bytes": 50 * 1024 * 1024}
+        baseline = {"results": {"a": before, "b": before, "c": before, "d": before}}
+        results = {
+            "a": dict(before, ops_per_s=95.0, p95_ms=11.0),
+            "b": dict(before, ops_per_s=50.0),
+            "c": dict(before, output_bytes=2000, peak_memory_bytes=100 * 1024 * 1024),
+            "d": {"error": "RuntimeError: boom"},
+            "e": dict(before),
+        }
+
+        regressions = compare(results, baseline, threshold=0.2)
+
+        self.assertEqual([line.split(":")[0] for line in regressions], ["b", "c", "c", "d"])
+
+
+@unittest.skipUnless(os.environ.get("TOOLSAPP_BENCH"), "set TOOLSAPP_BENCH=1 to run benchmarks")
+class QRThroughputBenchmark(SimpleTestCase):
+
+    def test_single_core_codes_per_second(self):
+        values = [f"https://example.com/badge/{index:05d}" for index in range(2000)]
+
+        for target_format in ("png", "svg"):
+            for mask_pattern in (None, 0):
+                start = time.perf_counter()
+                render_qr_chunk(values, target_format, mask_pattern=mask_pattern)
+                rate = len(values) / (time.perf_counter() - start)
+
+                print(f"\n{target_format}, mask {'auto' if mask_pattern is None else mask_pattern}: {rate:.0f} codes/s on one core")
+                if target_format == "png" and mask_pattern is None:
+                    self.assertGreaterEqual(rate, 1000)
+
+
+@unittest.skipUnless(os.environ.get("TOOLSAPP_BENCH"), "set TOOLSAPP_BENCH=1 to run benchmarks")
+class HashThroughputBenchmark(SimpleTestCase):
+
+    def test_multi_algorithm_throughput_by_thread_count(self):
+        chunk = os.urandom(1024 * 1024)
+        total_chunks = 256
+
+        for threads in (1, 2, 4):
+            with ThreadPoolExecutor(max_workers=threads) as executor:
+                hasher = ParallelHasher(tuple(SUPPORTED_ALLGORITHMS), executor)
+                start = time.perf_counter()
+                for _ in range(total_chunks):
+                    hasher.update(chunk)
+                hasher.hexdigests()
+                elapsed = time.perf_counter() - start
+
+            print(f"\n{threads} thread(s): {total_chunks * len(chunk) / elapsed / 1e9:.2f} GB/s (5 algorithms)")
+
+    def test_merkle_throughput_by_thread_count(self):
+        chunk = os.urandom(1024 * 1024)
+        total_chunks = 512
+
+        for threads in (1, 2, 4):
+            with ThreadPoolExecutor(max_workers=threads) as executor:
+                hasher = MerkleSha256(executor=executor, max_pending=threads * 2)
+                start = time.perf_counter()
+                for _ in range(total_chunks):
+                    hasher.update(chunk)
+                hasher.hexdigest()
+                elapsed = time.perf_counter() - start
+
+            print(f"\n{threads} thread(s): {total_chunks * len(chunk) / elapsed / 1e9:.2f} GB/s (merkle-sha256)")
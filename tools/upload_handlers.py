@@ -0,0 +1,260 @@
+import hashlib
+import os
+import tempfile
+import uuid
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.files.uploadhandler import FileUploadHandler, StopUpload
+from django.http import HttpResponse, JsonResponse, QueryDict
+from django.utils.datastructures import MultiValueDict
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+
+from .utils.executor import MappedFile, get_hash_executor
+from .utils.metrics import stage
+from .utils.hash_utils import ALL_ALGORITHMS, ParallelHasher
+from .utils.inspect_utils import header_complete, needs_whole_file
+
+
+class HashedUpload:
+    # Stands in for an UploadedFile whose content was hashed and then discarded.
+    def __init__(self, name, size, content_type, hexdigests, manifests=None):
+        self.name = name
+        self.size = size
+        self.content_type = content_type
+        self.hexdigests = hexdigests
+        self.manifests = manifests or {}
+
+    def close(self):
+        pass
+
+
+class HashingUploadHandler(FileUploadHandler):
+    # Hashes uploads chunk by chunk as they come off the socket; nothing is written to a
+    # temporary file or kept in memory. Like ImageUploadHandler, it refuses an oversized
+    # request from its Content-Length and stops reading once a file passes
+    # MAX_UPLOAD_FILE_SIZE, instead of hashing it all first.
+    chunk_size = 1024 * 1024
+
+    def __init__(self, request=None, algorithms=tuple(ALL_ALGORITHMS)):
+        super().__init__(request)
+        self.algorithms = algorithms
+        self.too_large = False
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        if content_length > settings.MAX_HASH_REQUEST_SIZE:
+            self.too_large = True
+            return QueryDict(), MultiValueDict()
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.hasher = ParallelHasher(self.algorithms, get_hash_executor())
+
+    def receive_data_chunk(self, raw_data, start):
+        if start + len(raw_data) > settings.MAX_UPLOAD_FILE_SIZE:
+            self.too_large = True
+            raise StopUpload(connection_reset=True)
+        self.hasher.update(raw_data)
+        return None
+
+    def file_complete(self, file_size):
+        return HashedUpload(
+            self.file_name,
+            file_size,
+            self.content_type,
+            self.hasher.hexdigests(),
+            self.hasher.manifests(),
+        )
+
+
+class ImageUpload:
+    # An upload kept as one bytes object, or spooled to a temporary file once it outgrows
+    # FILE_UPLOAD_MAX_MEMORY_SIZE. Its SHA-256 is computed while it arrives, so cache keys
+    # never re-read it, and data() hands it to the image executor without another copy.
+    def __init__(self, name, size, content_type, sha256, content=None, file=None):
+        self.name = name
+        self.size = size
+        self.content_type = content_type
+        self.hexdigests = {"sha256": sha256}
+        self.content = content
+        self.file = file
+
+    def data(self):
+        if self.file is not None:
+            return MappedFile(self.file.name, self.size)
+        return self.content
+
+    def detached_data(self):
+        # Like data(), but still readable after the request closes the upload: a spooled file
+        # gets a second link, which the caller removes once the job is done with it.
+        if self.file is None:
+            return self.content
+        path = f"{self.file.name}.{uuid.uuid4().hex}"
+        os.link(self.file.name, path)
+        return MappedFile(path, self.size)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+class ImageUploadHandler(FileUploadHandler):
+    # Replaces Django's memory and temporary-file handlers for the image tools. The request
+    # is refused from its Content-Length before the body is read, and again while streaming
+    # if it carries more than max_size bytes without one.
+    chunk_size = 256 * 1024
+
+    def __init__(self, request=None, max_size=None):
+        super().__init__(request)
+        self.max_size = max_size or settings.MAX_IMAGE_UPLOAD_SIZE
+        self.received = 0
+        self.too_large = False
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        if content_length > self.max_size:
+            self.too_large = True
+            return QueryDict(), MultiValueDict()
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.hasher = hashlib.sha256()
+        self.chunks = []
+        self.file = None
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > self.max_size:
+            self.too_large = True
+            raise StopUpload(connection_reset=True)
+
+        self.hasher.update(raw_data)
+        if self.file is None and start + len(raw_data) > settings.FILE_UPLOAD_MAX_MEMORY_SIZE:
+            self.file = tempfile.NamedTemporaryFile(suffix=".upload", dir=settings.FILE_UPLOAD_TEMP_DIR)
+            self.file.writelines(self.chunks)
+            self.chunks = []
+        if self.file is not None:
+            self.file.write(raw_data)
+        else:
+            self.chunks.append(raw_data)
+        return None
+
+    def file_complete(self, file_size):
+        if self.file is not None:
+            self.file.flush()
+            content = None
+        else:
+            content = b"".join(self.chunks)
+            self.chunks = []
+        return ImageUpload(self.file_name, file_size, self.content_type, self.hasher.hexdigest(), content, self.file)
+
+
+class HeaderUpload:
+    # The start of an upload, kept for header-only inspection; the rest was dropped unread or
+    # as it arrived. complete is True when head is the whole file.
+    def __init__(self, name, size, content_type, head):
+        self.name = name
+        self.size = size
+        self.content_type = content_type
+        self.head = head
+        self.complete = len(head) == size
+
+    def close(self):
+        pass
+
+
+class HeaderUploadHandler(FileUploadHandler):
+    # Keeps IMAGE_INSPECT["HEAD_BYTES"] of each file, doubling it until Pillow can parse the
+    # header, and drops everything after that. Nothing is hashed or spooled to disk.
+    chunk_size = 64 * 1024
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.files = 0
+        self.too_many = False
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.files += 1
+        if self.files > settings.IMAGE_INSPECT["MAX_FILES"]:
+            self.too_many = True
+            raise StopUpload(connection_reset=True)
+        self.head = bytearray()
+        self.wanted = settings.IMAGE_INSPECT["HEAD_BYTES"]
+        self.done = False
+
+    def receive_data_chunk(self, raw_data, start):
+        if not self.done:
+            self.head += raw_data
+            if len(self.head) >= self.wanted:
+                self._check_head()
+        return None
+
+    def _check_head(self):
+        limit = settings.IMAGE_INSPECT["MAX_BYTES"]
+        if len(self.head) >= limit:
+            del self.head[limit:]
+            self.done = True
+        elif not needs_whole_file(self.head) and header_complete(bytes(self.head)):
+            self.done = True
+        else:
+            self.wanted = min(2 * len(self.head), limit)
+
+    def file_complete(self, file_size):
+        return HeaderUpload(self.file_name, file_size, self.content_type, bytes(self.head))
+
+
+def read_header_upload(request, handler):
+    # For a request whose body is the file itself: reading stops as soon as the header parses,
+    # and the rest of the body is never read from the connection. Raises ValueError for a
+    # malformed Content-Length.
+    try:
+        size = int(request.META.get("CONTENT_LENGTH") or 0) or None
+    except (ValueError, TypeError):
+        raise ValueError("Invalid Content-Length header.")
+    handler.new_file("file", request.headers.get("X-File-Name", "upload"), request.content_type, size)
+    received = 0
+    while not handler.done:
+        chunk = request.read(handler.chunk_size)
+        if not chunk:
+            break
+        handler.receive_data_chunk(chunk, received)
+        received += len(chunk)
+    return handler.file_complete(size if handler.done else received)
+
+
+def _upload_too_large(as_json):
+    message = f"Uploads are limited to {settings.MAX_IMAGE_UPLOAD_SIZE // (1024 * 1024)} MB."
+    if as_json:
+        return JsonResponse({"error": message}, status=413)
+    return HttpResponse(message, status=413, content_type="text/plain")
+
+
+def image_uploads(view, as_json=False):
+    # Installs ImageUploadHandler before anything reads the body, so CSRF is checked by the
+    # wrapped view instead of the middleware (as file_hash_view does for hashing).
+    protected = csrf_protect(view)
+
+    def install(request):
+        handler = ImageUploadHandler(request)
+        request.upload_handlers = [handler]
+        with stage("parse"):
+            request.POST
+        return not handler.too_large
+
+    if iscoroutinefunction(view):
+        @csrf_exempt
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if not await sync_to_async(install, thread_sensitive=False)(request):
+                return _upload_too_large(as_json)
+            return await protected(request, *args, **kwargs)
+    else:
+        @csrf_exempt
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not install(request):
+                return _upload_too_large(as_json)
+            return protected(request, *args, **kwargs)
+
+    return wrapper
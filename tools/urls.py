@@ -1,25 +1,64 @@
 from django.urls import path
+from . import async_views
+from .upload_handlers import image_uploads
 from .views import (
     home_view,
+    image_batch_view,
     image_compress_view,
     image_convert_view,
     image_filters_view,
+    image_inspect_view,
+    image_memory_stats_view,
     image_resize_view,
+    image_srcset_view,
     image_watermark_view,
+    job_result_view,
+    job_status_view,
+    job_submit_view,
+    metrics_view,
+    pipeline_view,
+    qr_bulk_view,
+    qr_cache_stats_view,
     qr_view,
-    file_hash_view
+    file_hash_view,
+    result_status_view,
+    result_view,
+    transform_cache_stats_view,
 )
 
 app_name = "tools"
 
 
+# The image tools read uploads through ImageUploadHandler (size cap, no re-reads or temp-file copies).
 urlpatterns = [
     path("", home_view, name="home"),
     path("qr/", qr_view, name="qr"),
-    path("image-converter/", image_convert_view, name="image_convert"),
-    path("image-compressor/", image_compress_view, name="image_compress"),
-    path("image-filters/", image_filters_view, name="image_filters"),
-    path("image-resize/", image_resize_view, name="image_resize"),
-    path("watermark/", image_watermark_view, name="image_watermark"),
-    path("hash/",file_hash_view,name="hash")
+    path("image-converter/", image_uploads(image_convert_view), name="image_convert"),
+    path("image-compressor/", image_uploads(image_compress_view), name="image_compress"),
+    path("image-filters/", image_uploads(image_filters_view), name="image_filters"),
+    path("image-resize/", image_uploads(image_resize_view), name="image_resize"),
+    path("image-resize/srcset/", image_uploads(image_srcset_view, as_json=True), name="image_srcset"),
+    path("watermark/", image_uploads(image_watermark_view), name="image_watermark"),
+    path("hash/",file_hash_view,name="hash"),
+    path("batch/<str:tool>/", image_uploads(image_batch_view, as_json=True), name="image_batch"),
+    path("pipeline/", image_uploads(pipeline_view, as_json=True), name="pipeline"),
+    path("inspect/", image_inspect_view, name="image_inspect"),
+    path("result/<str:key>/", result_view, name="result"),
+    path("result/status/<str:token>/", result_status_view, name="result_status"),
+    path("cache/stats/", transform_cache_stats_view, name="transform_cache_stats"),
+    path("qr/stats/", qr_cache_stats_view, name="qr_cache_stats"),
+    path("qr/bulk/", qr_bulk_view, name="qr_bulk"),
+    path("memory/stats/", image_memory_stats_view, name="image_memory_stats"),
+    path("metrics", metrics_view, name="metrics"),
+    path("jobs/<str:kind>/", job_submit_view, name="job_submit"),
+    path("jobs/<uuid:job_id>/status/", job_status_view, name="job_status"),
+    path("jobs/<uuid:job_id>/result/", job_result_view, name="job_result"),
+    # ASGI-native variants of the tools; same forms and templates, served from /async/.
+    path("async/qr/", async_views.qr_view, name="async_qr"),
+    path("async/image-converter/", image_uploads(async_views.image_convert_view), name="async_image_convert"),
+    path("async/image-compressor/", image_uploads(async_views.image_compress_view), name="async_image_compress"),
+    path("async/image-filters/", image_uploads(async_views.image_filters_view), name="async_image_filters"),
+    path("async/image-resize/", image_uploads(async_views.image_resize_view), name="async_image_resize"),
+    path("async/watermark/", image_uploads(async_views.image_watermark_view), name="async_image_watermark"),
+    path("async/hash/", async_views.file_hash_view, name="async_hash"),
 ]
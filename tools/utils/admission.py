@@ -0,0 +1,149 @@
+import threading
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from PIL import Image
+
+from .executor import ExecutorBusy, open_source
+from .metrics import max_rss_bytes
+
+
+class ImageTooLarge(ValueError):
+    pass
+
+
+# Bytes per pixel in Pillow's decoded storage: RGB, LA and the other multi-band modes are
+# padded to four bytes.
+_MODE_BYTES = {"1": 1, "L": 1, "P": 1, "I;16": 2, "I;16L": 2, "I;16B": 2, "I;16N": 2}
+
+# Operations that keep more than one full-size RGBA image alive while they run; the PNG
+# optimizer encodes a copy per zlib setting (at most four at once), and the target-size search
+# holds a scaled copy and a probe's encode buffer next to the decoded source.
+_WORKING_COPIES = {"png_optimize": 4, "srcset": 3, "compress_target": 2}
+
+
+def inspect_image(data):
+    # Image.open only parses the header; the pixel data is not decoded until load().
+    try:
+        with open_source(data) as source, Image.open(source) as image:
+            return image.size, image.mode, image.format
+    except Image.DecompressionBombError as exc:
+        raise ImageTooLarge(str(exc))
+    except (OSError, SyntaxError, ValueError) as exc:
+        # A memory-mapped source raises ValueError when a format probe seeks past the end.
+        raise ValueError(f"Unreadable image: {exc}")
+
+
+def estimate_image_memory(size, mode, operations=()):
+    # The decoded source plus the largest step: each operation builds its result while the
+    # previous image is still referenced.
+    width, height = size
+    current = peak = width * height * _MODE_BYTES.get(mode, 4)
+    for operation in operations:
+        if operation["op"] in {"resize", "crop"}:
+            width, height = operation["width"], operation["height"]
+        step = width * height * 4 * _WORKING_COPIES.get(operation["op"], 1)
+        peak = max(peak, current + step)
+        current = width * height * 4
+    return peak
+
+
+class MemoryBudget:
+    # A counting semaphore over bytes. Jobs larger than the per-request limit (or the whole
+    # budget) are rejected up front; the rest wait until enough in-flight jobs have released.
+    def __init__(self, total_bytes, request_bytes, queue_timeout=10):
+        self.total_bytes = total_bytes
+        self.request_bytes = min(request_bytes, total_bytes)
+        self.queue_timeout = queue_timeout
+        self._condition = threading.Condition()
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.largest_admitted = 0
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    def check(self, nbytes):
+        if nbytes > self.request_bytes:
+            with self._condition:
+                self.rejected += 1
+            raise ImageTooLarge(
+                f"Processing this image needs about {nbytes // (1024 * 1024)} MB; the limit is {self.request_bytes // (1024 * 1024)} MB."
+            )
+
+    def acquire(self, nbytes, blocking=True):
+        self.check(nbytes)
+        with self._condition:
+            if self.in_use + nbytes > self.total_bytes:
+                if not blocking:
+                    return False
+                self.queued += 1
+                if not self._condition.wait_for(lambda: self.in_use + nbytes <= self.total_bytes, self.queue_timeout):
+                    self.timed_out += 1
+                    return False
+            self.in_use += nbytes
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+            self.largest_admitted = max(self.largest_admitted, nbytes)
+            self.admitted += 1
+            return True
+
+    def release(self, nbytes):
+        with self._condition:
+            self.in_use -= nbytes
+            self._condition.notify_all()
+
+    def stats(self):
+        with self._condition:
+            return {
+                "total_bytes": self.total_bytes,
+                "request_bytes": self.request_bytes,
+                "in_use_bytes": self.in_use,
+                "peak_in_use_bytes": self.peak_in_use,
+                "largest_admitted_bytes": self.largest_admitted,
+                "admitted": self.admitted,
+                "queued": self.queued,
+                "rejected": self.rejected,
+                "timed_out": self.timed_out,
+                "max_rss_bytes": max_rss_bytes(),
+            }
+
+
+_budget = None
+_budget_lock = threading.Lock()
+
+
+def get_memory_budget():
+    global _budget
+    with _budget_lock:
+        if _budget is None:
+            options = settings.IMAGE_MEMORY
+            _budget = MemoryBudget(options["TOTAL_BYTES"], options["REQUEST_BYTES"], options["QUEUE_TIMEOUT"])
+        return _budget
+
+
+@receiver(setting_changed)
+def _reset_memory_budget(setting, **kwargs):
+    global _budget
+    if setting == "IMAGE_MEMORY":
+        with _budget_lock:
+            _budget = None
+
+
+def submit_admitted(executor, fn, data, operations, *args, blocking=True, **kwargs):
+    # Reads the header of data, reserves its estimated decoded size and submits fn(*args);
+    # the reservation is held until the job really finishes, like the executor's queue slot.
+    size, mode, _ = inspect_image(data)
+    nbytes = estimate_image_memory(size, mode, operations)
+    budget = get_memory_budget()
+    if not budget.acquire(nbytes, blocking=blocking):
+        raise ExecutorBusy("Not enough image memory is free.")
+    try:
+        future = executor.submit(fn, *args, **kwargs)
+    except BaseException:
+        budget.release(nbytes)
+        raise
+    future.add_done_callback(lambda _: budget.release(nbytes))
+    return future
+
@@ -0,0 +1,242 @@
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from .hash_utils import calculate_file_hash
+
+
+class MemoryCacheBackend:
+    def __init__(self, max_bytes, **options):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+            return data
+
+    def set(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+            self._entries[key] = data
+            self._size += len(data)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._size}
+
+
+class FileSystemCacheBackend:
+    # Recency is tracked through the file mtime, which is refreshed on every hit.
+    def __init__(self, max_bytes, location, **options):
+        self.max_bytes = max_bytes
+        self.location = Path(location)
+        self.location.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return self.location / f"{key}.bin"
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return data
+
+    def set(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=self.location, suffix=".tmp")
+        with os.fdopen(fd, "wb") as tmp_file:
+            tmp_file.write(data)
+        os.replace(tmp_path, self._path(key))
+        self._evict()
+
+    def _entries(self):
+        entries = []
+        for entry in os.scandir(self.location):
+            if entry.name.endswith(".bin"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def _evict(self):
+        with self._lock:
+            entries = sorted(self._entries())
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+    def clear(self):
+        for _, _, path in self._entries():
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        entries = self._entries()
+        return {"entries": len(entries), "bytes": sum(size for _, size, _ in entries)}
+
+
+class DjangoCacheBackend:
+    # Eviction is left to the configured Django cache; only oversized entries are skipped here.
+    # The alias is usually shared with other data, so clear() moves the transform entries to a
+    # new cache key version rather than clearing the whole cache; the old entries expire or get
+    # evicted on their own.
+    VERSION_KEY = "tools:transform:version"
+
+    def __init__(self, max_bytes, location="default", timeout=None, **options):
+        self.max_bytes = max_bytes
+        self.cache = caches[location]
+        self.timeout = timeout
+
+    def _key(self, key):
+        return f"tools:transform:{key}"
+
+    def _version(self):
+        return self.cache.get_or_set(self.VERSION_KEY, 1, None)
+
+    def get(self, key):
+        return self.cache.get(self._key(key), version=self._version())
+
+    def set(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        self.cache.set(self._key(key), data, self.timeout, version=self._version())
+
+    def clear(self):
+        try:
+            self.cache.incr(self.VERSION_KEY)
+        except ValueError:
+            self.cache.add(self.VERSION_KEY, 2, None)
+
+    def stats(self):
+        return {}
+
+
+CACHE_BACKENDS = {
+    "memory": MemoryCacheBackend,
+    "filesystem": FileSystemCacheBackend,
+    "django": DjangoCacheBackend,
+}
+
+
+class TransformCache:
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def make_key(self, uploaded_file, operation, params):
+        # The watermark font is a setting rather than a parameter, but changing it changes
+        # every watermarked result, including watermark steps inside pipelines.
+        digest = calculate_file_hash(uploaded_file, "sha256")
+        normalized = tuple(sorted((name, str(value)) for name, value in params.items()))
+        key = (digest, operation, normalized, str(settings.WATERMARK_FONT))
+        return hashlib.sha256(repr(key).encode("utf-8")).hexdigest()
+
+    def _record(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, key):
+        data = self.backend.get(key)
+        self._record(data is not None)
+        return data
+
+    def set(self, key, data):
+        self.backend.set(key, data)
+
+    def get_or_compute(self, key, compute):
+        data = self.get(key)
+        if data is None:
+            data = compute()
+            self.set(key, data)
+        return data
+
+    async def aget_or_compute(self, key, compute):
+        data = await sync_to_async(self.backend.get, thread_sensitive=False)(key)
+        self._record(data is not None)
+        if data is None:
+            data = await compute()
+            await sync_to_async(self.backend.set, thread_sensitive=False)(key, data)
+        return data
+
+    def clear(self):
+        self.backend.clear()
+        with self._lock:
+            self.hits = self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        lookups = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            **self.backend.stats(),
+        }
+
+
+_transform_cache = None
+
+
+def get_transform_cache():
+    global _transform_cache
+    if _transform_cache is None:
+        options = {name.lower(): value for name, value in settings.TRANSFORM_CACHE.items()}
+        backend_name = options.pop("backend", "memory")
+        if backend_name not in CACHE_BACKENDS:
+            raise ValueError(f"Unsupported transform cache backend: {backend_name}")
+        _transform_cache = TransformCache(CACHE_BACKENDS[backend_name](**options))
+    return _transform_cache
+
+
+@receiver(setting_changed)
+def _reset_transform_cache(setting, **kwargs):
+    global _transform_cache
+    if setting == "TRANSFORM_CACHE":
+        _transform_cache = None
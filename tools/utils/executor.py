@@ -0,0 +1,201 @@
+import asyncio
+import io
+import mmap
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from .metrics import collect
+
+
+class ExecutorBusy(Exception):
+    pass
+
+
+class ExecutorTimeout(Exception):
+    pass
+
+
+class MappedFile:
+    # A spooled upload passed by path, so process workers map the file themselves instead of
+    # receiving a pickled copy of its bytes.
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+
+def open_source(data):
+    # A file-like view of job input: bytes are wrapped without copying (BytesIO shares an
+    # immutable bytes buffer) and spooled files are memory-mapped read-only.
+    if isinstance(data, MappedFile):
+        with open(data.path, "rb") as handle:
+            return mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+    return io.BytesIO(data)
+
+
+def run_transform(transform, data, params):
+    with open_source(data) as source:
+        return transform(source, **params)
+
+
+def run_transform_timed(transform, data, params):
+    # Returns (result, stats) with the stage timings recorded while the job ran; they cannot
+    # reach the request's collector directly from a worker process.
+    return collect(run_transform, transform, data, params)
+
+
+class _InlineExecutor:
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as exc:
+            future.set_exception(exc)
+        return future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        pass
+
+
+def _process_context():
+    # Workers are started by a small fork server (or spawned) rather than forked from the
+    # threaded server process, whose locks may be held by other threads at fork time. The
+    # fork server imports the image modules once, so new workers start quickly.
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload(["tools.utils.pipeline", "tools.utils.srcset_utils"])
+        return context
+    return multiprocessing.get_context("spawn")
+
+
+class ImageExecutor:
+    # A slot is held from submission until the job really finishes, so jobs that outlive
+    # their timeout keep counting against the queue instead of silently piling up.
+    def __init__(self, backend="process", max_workers=None, max_queue=16, timeout=30):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.backend = backend
+        self._pool_lock = threading.Lock()
+        self._pool = self._make_pool()
+        self._slots = threading.BoundedSemaphore(self.max_workers + self.max_queue)
+
+    def _make_pool(self):
+        if self.backend == "process":
+            return ProcessPoolExecutor(max_workers=self.max_workers, mp_context=_process_context())
+        if self.backend == "thread":
+            return ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="tools-image")
+        if self.backend == "inline":
+            return _InlineExecutor()
+        raise ValueError(f"Unsupported executor backend: {self.backend}")
+
+    def _replace_broken_pool(self, pool):
+        # A worker that dies (for example killed for running out of memory) breaks the whole
+        # process pool; later jobs get a new one. The broken pool has already stopped its workers.
+        with self._pool_lock:
+            if self._pool is pool:
+                self._pool = self._make_pool()
+
+    def submit(self, fn, *args, **kwargs):
+        if not self._slots.acquire(blocking=False):
+            raise ExecutorBusy("Too many image jobs are queued.")
+        pool = self._pool
+        try:
+            try:
+                future = pool.submit(fn, *args, **kwargs)
+            except BrokenProcessPool:
+                # The job never started, so it goes to the new pool instead.
+                self._replace_broken_pool(pool)
+                pool = self._pool
+                future = pool.submit(fn, *args, **kwargs)
+        except BrokenProcessPool:
+            self._slots.release()
+            raise ExecutorBusy("The image workers could not be restarted.")
+        except BaseException:
+            self._slots.release()
+            raise
+
+        def finished(future):
+            self._slots.release()
+            if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+                self._replace_broken_pool(pool)
+
+        future.add_done_callback(finished)
+        return future
+
+    def result(self, future):
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise ExecutorTimeout(f"Image job exceeded {self.timeout} seconds.")
+        except BrokenProcessPool:
+            raise ExecutorBusy("An image worker stopped while running this job.")
+
+    def run(self, fn, *args, **kwargs):
+        return self.result(self.submit(fn, *args, **kwargs))
+
+    async def aresult(self, future):
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            future.cancel()
+            raise ExecutorTimeout(f"Image job exceeded {self.timeout} seconds.")
+        except BrokenProcessPool:
+            raise ExecutorBusy("An image worker stopped while running this job.")
+
+    async def arun(self, fn, *args, **kwargs):
+        return await self.aresult(self.submit(fn, *args, **kwargs))
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait, cancel_futures=True)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            options = {name.lower(): value for name, value in settings.IMAGE_EXECUTOR.items()}
+            _executor = ImageExecutor(**options)
+        return _executor
+
+
+_hash_executor = None
+
+
+def get_hash_executor():
+    # Hashing is I/O-bound around GIL-free hashlib calls, so a plain thread pool is enough.
+    global _hash_executor
+    with _executor_lock:
+        if _hash_executor is None:
+            _hash_executor = ThreadPoolExecutor(max_workers=settings.HASH_THREADS, thread_name_prefix="tools-hash")
+        return _hash_executor
+
+
+@receiver(setting_changed)
+def _reset_executor(setting, **kwargs):
+    global _executor, _hash_executor
+    if setting == "IMAGE_EXECUTOR":
+        with _executor_lock:
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+            _executor = None
+    elif setting == "HASH_THREADS":
+        with _executor_lock:
+            if _hash_executor is not None:
+                _hash_executor.shutdown(wait=False)
+            _hash_executor = None
@@ -0,0 +1,191 @@
+import math
+
+from PIL import ImageFilter
+
+
+# Every adjustment step: name -> (kind, {param: (default, minimum, maximum)}). "point" steps
+# map each channel value on its own and fuse into one lookup table, "color" steps mix the
+# channels, and "blur", "kernel" and "unsharp" steps are convolutions.
+ADJUSTMENTS = {
+    "levels": ("point", {"black": (0, 0, 254), "white": (255, 1, 255)}),
+    "brightness": ("point", {"amount": (1.0, 0.0, 4.0)}),
+    "contrast": ("point", {"amount": (1.0, 0.0, 4.0)}),
+    "gamma": ("point", {"amount": (1.0, 0.1, 10.0)}),
+    "invert": ("point", {}),
+    "solarize": ("point", {"threshold": (128, 0, 255)}),
+    "posterize": ("point", {"bits": (4, 1, 8)}),
+    "saturation": ("color", {"amount": (1.0, 0.0, 4.0)}),
+    "grayscale": ("color", {}),
+    "gaussian_blur": ("blur", {"radius": (2.0, 0.0, 50.0)}),
+    "unsharp_mask": ("unsharp", {"radius": (2.0, 0.1, 50.0), "percent": (150, 0, 500), "threshold": (3, 0, 255)}),
+    "blur": ("kernel", {}),
+    "contour": ("kernel", {}),
+    "detail": ("kernel", {}),
+    "edge_enhance": ("kernel", {}),
+    "emboss": ("kernel", {}),
+    "find_edges": ("kernel", {}),
+    "sharpen": ("kernel", {}),
+    "smooth": ("kernel", {}),
+}
+
+KERNELS = {
+    "blur": ImageFilter.BLUR,
+    "contour": ImageFilter.CONTOUR,
+    "detail": ImageFilter.DETAIL,
+    "edge_enhance": ImageFilter.EDGE_ENHANCE_MORE,
+    "emboss": ImageFilter.EMBOSS,
+    "find_edges": ImageFilter.FIND_EDGES,
+    "sharpen": ImageFilter.SHARPEN,
+    "smooth": ImageFilter.SMOOTH_MORE,
+}
+
+# Contrast pivots on mid-gray rather than the image mean (as ImageEnhance does), so it is a
+# fixed mapping that can join the lookup table.
+POINT_FUNCTIONS = {
+    "levels": lambda value, black, white: (value - black) * 255 / (white - black),
+    "brightness": lambda value, amount: value * amount,
+    "contrast": lambda value, amount: (value - 128) * amount + 128,
+    "gamma": lambda value, amount: 255 * (value / 255) ** (1 / amount),
+    "invert": lambda value: 255 - value,
+    "solarize": lambda value, threshold: value if value < threshold else 255 - value,
+    "posterize": lambda value, bits: value & ~(2 ** (8 - bits) - 1),
+}
+
+IDENTITY_LUT = list(range(256))
+
+
+def _parameter(step, name, default, minimum, maximum):
+    value = step.get(name, default)
+    try:
+        value = int(value) if isinstance(default, int) else float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be a number.")
+    if not minimum <= value <= maximum:
+        raise ValueError(f"{name} must be between {minimum} and {maximum}.")
+    return value
+
+
+def validate_adjustments(steps):
+    if not isinstance(steps, list):
+        raise ValueError("Adjustments must be a list.")
+
+    validated = []
+    for step in steps:
+        if not isinstance(step, dict) or step.get("name") not in ADJUSTMENTS:
+            raise ValueError(f"Unknown adjustment: {step!r}")
+        _, spec = ADJUSTMENTS[step["name"]]
+        params = {name: _parameter(step, name, *limits) for name, limits in spec.items()}
+        if step["name"] == "levels" and params["black"] >= params["white"]:
+            raise ValueError("black must be below white.")
+        validated.append({"name": step["name"], **params})
+    return validated
+
+
+def scale_adjustments(steps, scale):
+    # The same chain for a copy scaled by scale, e.g. a preview: radii shrink with the image.
+    return [{**step, "radius": step["radius"] * scale} if "radius" in step else step for step in steps]
+
+
+def point_lut(steps):
+    # Composes point steps into one table. Each step is clamped and rounded like its own
+    # Image.point pass would be, so the fused table gives exactly the sequential result.
+    lut = IDENTITY_LUT
+    for step in steps:
+        function = POINT_FUNCTIONS[step["name"]]
+        params = {name: value for name, value in step.items() if name != "name"}
+        lut = [max(0, min(255, round(function(value, **params)))) for value in lut]
+    return lut
+
+
+def plan_adjustments(steps):
+    # Groups a validated chain into passes over the pixels: runs of point steps become one
+    # lookup table, consecutive Gaussian blurs one blur (variances add) and consecutive
+    # saturation steps one matrix. Two 3x3 kernels are not merged into a 5x5 one: Pillow
+    # does more work for the 5x5 pass than for both small ones.
+    passes = []
+    for step in steps:
+        kind, _ = ADJUSTMENTS[step["name"]]
+        previous = passes[-1] if passes else None
+        if kind == "point":
+            if previous and previous[0] == "point":
+                previous[1].append(step)
+            else:
+                passes.append(["point", [step]])
+        elif step["name"] == "saturation":
+            if previous and previous[0] == "saturation":
+                previous[1] *= step["amount"]
+            else:
+                passes.append(["saturation", step["amount"]])
+        elif kind == "blur":
+            if not step["radius"]:
+                continue
+            if previous and previous[0] == "blur":
+                previous[1] = math.hypot(previous[1], step["radius"])
+            else:
+                passes.append(["blur", step["radius"]])
+        elif kind == "kernel":
+            passes.append(["kernel", KERNELS[step["name"]]])
+        elif kind == "unsharp":
+            passes.append(["unsharp", (step["radius"], step["percent"], step["threshold"])])
+        else:
+            passes.append([step["name"], None])
+    return [(kind, point_lut(value) if kind == "point" else value) for kind, value in passes]
+
+
+def adjustment_halo(steps):
+    # Rows above and below a strip that a chain reads from: kernels reach half their size and
+    # Pillow's Gaussian blur (three box passes) a little over three times its radius.
+    halo = 0
+    for kind, value in plan_adjustments(steps):
+        if kind == "kernel":
+            halo += value.filterargs[0][1] // 2
+        elif kind in ("blur", "unsharp"):
+            radius = value if kind == "blur" else value[0]
+            halo += 3 * (math.ceil(radius) + 2)
+    return halo
+
+
+def _saturate(image, amount):
+    # Blends every pixel with its own luma in one matrix conversion; the matrix only takes
+    # RGB, so an alpha channel is split off and put back.
+    if image.mode in ("L", "LA"):
+        return image
+    rest = 1 - amount
+    matrix = []
+    for channel in range(3):
+        row = [0.299 * rest, 0.587 * rest, 0.114 * rest, 0]
+        row[channel] += amount
+        matrix.extend(row)
+    if image.mode == "RGBA":
+        result = image.convert("RGB").convert("RGB", matrix)
+        result.putalpha(image.getchannel("A"))
+        return result
+    return image.convert("RGB", matrix)
+
+
+def _apply_pass(image, kind, value):
+    if kind == "point":
+        # The alpha channel keeps its values; no mode conversion or copy is needed first.
+        if image.mode in ("RGBA", "LA"):
+            return image.point(value * (len(image.getbands()) - 1) + IDENTITY_LUT)
+        return image.point(value * len(image.getbands()))
+    if kind == "saturation":
+        return _saturate(image, value)
+    if kind == "grayscale":
+        return image.convert("L")
+    if kind == "blur":
+        return image.filter(ImageFilter.GaussianBlur(value))
+    if kind == "kernel":
+        return image.filter(value)
+    return image.filter(ImageFilter.UnsharpMask(*value))
+
+
+def apply_adjustments(image, steps):
+    # Applies a validated chain with one pass over the pixels per planned group.
+    passes = plan_adjustments(steps)
+    if passes and image.mode not in ("L", "LA", "RGB", "RGBA"):
+        # Palette, bilevel and 16-bit images cannot be filtered or mapped per channel.
+        image = image.convert("RGBA" if image.has_transparency_data else "RGB")
+    for kind, value in passes:
+        image = _apply_pass(image, kind, value)
+    return image
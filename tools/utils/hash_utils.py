@@ -1,19 +1,218 @@
 import hashlib
+from concurrent.futures import ThreadPoolExecutor
 
 
 SUPPORTED_ALLGORITHMS = {
     "sha256": hashlib.sha256,
     "sha1":hashlib.sha1,
     "md5": hashlib.md5,
+    "sha512": hashlib.sha512,
+    "blake2b": hashlib.blake2b,
 }
 
-def calculate_file_hash(uploaded_file, algorithm="sha256"):
-    if algorithm not in SUPPORTED_ALLGORITHMS:
-        raise ValueError(f"Unsupported algorithm: {algorithm}")
-    
-    hasher = SUPPORTED_ALLGORITHMS[algorithm]()
 
+MERKLE_BLOCK_SIZE = 1024 * 1024
+
+
+def _merkle_leaf(block):
+    hasher = hashlib.sha256(b"\x00")
+    hasher.update(block)
+    return hasher.digest()
+
+
+def merkle_root(leaves):
+    # RFC 6962-style domain separation: leaves are prefixed with 0x00 and nodes with 0x01;
+    # an odd node at the end of a level is promoted unchanged.
+    level = list(leaves) or [_merkle_leaf(b"")]
+    while len(level) > 1:
+        parents = [hashlib.sha256(b"\x01" + level[i] + level[i + 1]).digest() for i in range(0, len(level) - 1, 2)]
+        if len(level) % 2:
+            parents.append(level[-1])
+        level = parents
+    return level[0]
+
+
+class MerkleSha256:
+    # Fixed-size blocks are hashed independently, on the executor when one is given, so
+    # large files use every core and changed blocks can be re-verified on their own.
+    # Blocks beyond max_pending are hashed inline, which bounds the memory held by queued blocks.
+    def __init__(self, block_size=MERKLE_BLOCK_SIZE, executor=None, max_pending=8):
+        self.block_size = block_size
+        self.executor = executor
+        self.max_pending = max_pending
+        self.size = 0
+        self._buffer = bytearray()
+        self._leaves = []
+        self._pending = []
+        self._finished = None
+
+    def _add_leaf(self, block):
+        self._pending = [future for future in self._pending if not future.done()]
+        if self.executor is not None and len(self._pending) < self.max_pending:
+            future = self.executor.submit(_merkle_leaf, block)
+            self._pending.append(future)
+            self._leaves.append(future)
+        else:
+            self._leaves.append(_merkle_leaf(block))
+
+    def update(self, data):
+        view = memoryview(data)
+        self.size += len(view)
+
+        if self._buffer:
+            needed = self.block_size - len(self._buffer)
+            self._buffer += view[:needed]
+            view = view[needed:]
+            if len(self._buffer) < self.block_size:
+                return
+            self._add_leaf(bytes(self._buffer))
+            self._buffer = bytearray()
+
+        while len(view) >= self.block_size:
+            self._add_leaf(view[:self.block_size])
+            view = view[self.block_size:]
+        self._buffer += view
+
+    def _finish(self):
+        if self._finished is None:
+            if self._buffer or not self._leaves:
+                self._add_leaf(bytes(self._buffer))
+                self._buffer = bytearray()
+            leaves = [leaf.result() if hasattr(leaf, "result") else leaf for leaf in self._leaves]
+            self._finished = (merkle_root(leaves), leaves)
+        return self._finished
+
+    def hexdigest(self):
+        return self._finish()[0].hex()
+
+    def manifest(self):
+        root, leaves = self._finish()
+        return {
+            "algorithm": "merkle-sha256",
+            "block_size": self.block_size,
+            "size": self.size,
+            "root": root.hex(),
+            "chunks": [leaf.hex() for leaf in leaves],
+        }
+
+
+TREE_ALGORITHMS = {
+    "merkle-sha256": MerkleSha256,
+}
+
+ALL_ALGORITHMS = {**SUPPORTED_ALLGORITHMS, **TREE_ALGORITHMS}
+
+
+class MultiHasher:
+    # Feeds every chunk to all requested algorithms so one read of the stream yields every digest.
+    def __init__(self, algorithms, executor=None):
+        for algorithm in algorithms:
+            if algorithm not in ALL_ALGORITHMS:
+                raise ValueError(f"Unsupported algorithm: {algorithm}")
+        self.hashers = {
+            algorithm: TREE_ALGORITHMS[algorithm](executor=executor) if algorithm in TREE_ALGORITHMS else SUPPORTED_ALLGORITHMS[algorithm]()
+            for algorithm in algorithms
+        }
+
+    def update(self, chunk):
+        for hasher in self.hashers.values():
+            hasher.update(chunk)
+
+    def hexdigests(self):
+        return {algorithm: hasher.hexdigest() for algorithm, hasher in self.hashers.items()}
+
+    def manifests(self):
+        return {algorithm: hasher.manifest() for algorithm, hasher in self.hashers.items() if algorithm in TREE_ALGORITHMS}
+
+
+class ParallelHasher(MultiHasher):
+    # Each algorithm hashes the same read-only memoryview on its own pool thread (hashlib
+    # releases the GIL for large buffers). Updates for chunk N run while chunk N+1 is read;
+    # chunks must not be mutated after they are passed in.
+    def __init__(self, algorithms, executor):
+        super().__init__(algorithms, executor)
+        self.executor = executor
+        self._pending = []
+
+    def _wait(self):
+        for future in self._pending:
+            future.result()
+        self._pending = []
+
+    def update(self, chunk):
+        view = memoryview(chunk)
+        self._wait()
+        self._pending = [self.executor.submit(hasher.update, view) for hasher in self.hashers.values()]
+
+    def hexdigests(self):
+        self._wait()
+        return super().hexdigests()
+
+    def manifests(self):
+        self._wait()
+        return super().manifests()
+
+
+def calculate_file_hashes(uploaded_file, algorithms=tuple(SUPPORTED_ALLGORITHMS), executor=None):
+    # Digests the upload handler already computed are reused; the rest are read from the file,
+    # which is only possible when the handler kept its content.
+    for algorithm in algorithms:
+        if algorithm not in ALL_ALGORITHMS:
+            raise ValueError(f"Unsupported algorithm: {algorithm}")
+    precomputed = getattr(uploaded_file, "hexdigests", None) or {}
+    missing = [algorithm for algorithm in algorithms if algorithm not in precomputed]
+    computed = {}
+    if missing:
+        if not hasattr(uploaded_file, "chunks"):
+            raise ValueError(f"The {missing[0]} digest was not computed while the file was uploaded.")
+        hasher = MultiHasher(missing) if executor is None else ParallelHasher(missing, executor)
+        for chunk in uploaded_file.chunks():
+            hasher.update(chunk)
+        computed = hasher.hexdigests()
+
+    return {algorithm: precomputed[algorithm] if algorithm in precomputed else computed[algorithm] for algorithm in algorithms}
+
+
+def calculate_file_manifest(uploaded_file, algorithm="merkle-sha256", executor=None):
+    if algorithm not in TREE_ALGORITHMS:
+        raise ValueError(f"Unsupported tree algorithm: {algorithm}")
+
+    precomputed = getattr(uploaded_file, "manifests", None)
+    if precomputed is not None and algorithm in precomputed:
+        return precomputed[algorithm]
+
+    hasher = TREE_ALGORITHMS[algorithm](executor=executor)
     for chunk in uploaded_file.chunks():
         hasher.update(chunk)
 
-    return hasher.hexdigest()   
\ No newline at end of file
+    return hasher.manifest()
+
+
+def hash_files(uploaded_files, algorithms=tuple(SUPPORTED_ALLGORITHMS), executor=None):
+    # Files get their own short-lived pool so per-file tasks never wait on the shared
+    # algorithm pool they feed.
+    if len(uploaded_files) <= 1:
+        return [calculate_file_hashes(uploaded_file, algorithms, executor) for uploaded_file in uploaded_files]
+
+    with ThreadPoolExecutor(max_workers=min(len(uploaded_files), 4)) as pool:
+        return list(pool.map(lambda uploaded_file: calculate_file_hashes(uploaded_file, algorithms, executor), uploaded_files))
+
+
+def compare_files(first, second, algorithms=tuple(SUPPORTED_ALLGORITHMS)):
+    if first.size != second.size:
+        return {"identical": False, "differing_algorithm": None, "compared": []}
+
+    compared = []
+    for algorithm in algorithms:
+        compared.append(algorithm)
+        if calculate_file_hash(first, algorithm) != calculate_file_hash(second, algorithm):
+            return {"identical": False, "differing_algorithm": algorithm, "compared": compared}
+
+    return {"identical": True, "differing_algorithm": None, "compared": compared}
+
+
+def calculate_file_hash(uploaded_file, algorithm="sha256"):
+    if algorithm not in ALL_ALGORITHMS:
+        raise ValueError(f"Unsupported algorithm: {algorithm}")
+
+    return calculate_file_hashes(uploaded_file, (algorithm,))[algorithm]
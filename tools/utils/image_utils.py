@@ -0,0 +1,228 @@
+import functools
+import io
+import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageDraw, ImageFilter, ImageFont, ImageOps
+
+from .filter_utils import apply_adjustments
+
+
+FILTERS = {
+    "original": lambda img: img,
+    "blur": lambda img: img.filter(ImageFilter.BLUR),
+    "contour": lambda img: img.filter(ImageFilter.CONTOUR),
+    "detail": lambda img: img.filter(ImageFilter.DETAIL),
+    "edge_enhance": lambda img: img.filter(ImageFilter.EDGE_ENHANCE_MORE),
+    "emboss": lambda img: img.filter(ImageFilter.EMBOSS),
+    "find_edges": lambda img: img.filter(ImageFilter.FIND_EDGES),
+    "sharpen": lambda img: img.filter(ImageFilter.SHARPEN),
+    "smooth": lambda img: img.filter(ImageFilter.SMOOTH_MORE),
+    "grayscale": lambda img: ImageOps.grayscale(img),
+    # Lookup tables applied in the image's own mode, alpha included, instead of an RGB copy.
+    "invert": lambda img: apply_adjustments(img, [{"name": "invert"}]),
+    "solarize": lambda img: apply_adjustments(img, [{"name": "solarize", "threshold": 128}]),
+    "posterize": lambda img: apply_adjustments(img, [{"name": "posterize", "bits": 4}]),
+}
+
+
+# With reduce() doing the coarse integer downscale first, a gap of 3 keeps the final
+# LANCZOS pass visually indistinguishable from a full-resolution resample.
+REDUCING_GAP = 3.0
+
+
+def center_crop_box(image_size, size):
+    source_width, source_height = image_size
+    source_ratio = source_width / source_height
+    output_ratio = size[0] / size[1]
+
+    if source_ratio >= output_ratio:
+        crop_width = output_ratio * source_height
+        crop_height = source_height
+    else:
+        crop_width = source_width
+        crop_height = source_width / output_ratio
+
+    left = (source_width - crop_width) / 2
+    top = (source_height - crop_height) / 2
+    return (left, top, left + crop_width, top + crop_height)
+
+
+def draft_for_size(image, size, box=None):
+    # JPEG can decode straight to 1/2, 1/4 or 1/8 scale; ask for the smallest scale that
+    # still covers the requested output so the final resample only ever shrinks.
+    box = box or (0, 0, image.width, image.height)
+    if image.format != "JPEG":
+        return box
+
+    box_width = box[2] - box[0]
+    box_height = box[3] - box[1]
+    scale = max(size[0] / box_width, size[1] / box_height)
+    if scale >= 0.5:
+        return box
+
+    full_size = image.size
+    requested = (math.ceil(full_size[0] * scale), math.ceil(full_size[1] * scale))
+    image.draft(image.mode, requested)
+
+    x_scale = image.width / full_size[0]
+    y_scale = image.height / full_size[1]
+    return (box[0] * x_scale, box[1] * y_scale, box[2] * x_scale, box[3] * y_scale)
+
+
+def downscale_image(image, size, box=None):
+    box = draft_for_size(image, size, box)
+    return image.resize(size, Image.Resampling.LANCZOS, box=box, reducing_gap=REDUCING_GAP)
+
+
+def fit_image(image, size):
+    return downscale_image(image, size, center_crop_box(image.size, size))
+
+
+def encode_image(image, target_format, **save_kwargs):
+    if target_format == "jpeg" and image.mode in ("RGBA", "P"):
+        image = image.convert("RGB")
+
+    buffer = io.BytesIO()
+    image.save(buffer, format=target_format.upper(), **save_kwargs)
+    return buffer.getvalue()
+
+
+ENCODE_THREADS = 4
+
+_encode_pool = None
+_encode_pool_lock = threading.Lock()
+
+
+def get_encode_pool():
+    # zlib, libjpeg and libwebp run without the GIL, so the independent encodes of one job
+    # share a small thread pool; on a single core they run one after another.
+    global _encode_pool
+    with _encode_pool_lock:
+        if _encode_pool is None:
+            workers = min(ENCODE_THREADS, os.cpu_count() or 1)
+            _encode_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tools-encode")
+        return _encode_pool
+
+
+def _reset_encode_pool():
+    # A forked image worker inherits the pool object but not its threads.
+    global _encode_pool, _encode_pool_lock
+    _encode_pool = None
+    _encode_pool_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_encode_pool)
+
+
+def high_quality_save_kwargs(target_format):
+    save_kwargs = {}
+    if target_format in {"jpeg", "webp"}:
+        save_kwargs.update({"quality": 90, "optimize": True})
+        if target_format == "webp":
+            save_kwargs["method"] = 6
+    return save_kwargs
+
+
+def compress_save_kwargs(target_format, quality):
+    if target_format in {"jpeg", "webp"}:
+        save_kwargs = {"quality": quality, "optimize": True}
+        if target_format == "webp":
+            save_kwargs["method"] = 6
+    else:
+        save_kwargs = {
+            "optimize": True,
+            "compress_level": max(0, min(9, int((100 - quality) / 10))),
+        }
+    return save_kwargs
+
+
+def fast_save_kwargs(target_format, quality):
+    # Cheap encoder settings for probing how big an output will be; sizes track the
+    # high-effort encode closely enough to pick a quality.
+    if target_format == "webp":
+        return {"quality": quality, "method": 2}
+    if target_format == "jpeg":
+        return {"quality": quality}
+    return {"compress_level": 1}
+
+
+WATERMARK_POSITIONS = {"top_left", "top_right", "bottom_left", "bottom_right", "center", "tiled"}
+
+# Text height as a fraction of the image's shorter side, and the smallest size drawn.
+WATERMARK_SCALE = 0.03
+WATERMARK_MIN_SIZE = 11
+
+WATERMARK_TEXT_COLOR = (255, 255, 255, 200)
+WATERMARK_SHADOW_COLOR = (0, 0, 0, 120)
+
+
+@functools.lru_cache(maxsize=64)
+def watermark_tile(text, font_size, font_path=None):
+    # The text and its shadow on a transparent tile just big enough to hold them. Tiles are
+    # shared between calls and must not be modified.
+    if font_path:
+        font = ImageFont.truetype(font_path, font_size)
+    else:
+        font = ImageFont.load_default(size=font_size)
+    left, top, right, bottom = font.getbbox(text)
+    shadow = max(1, font_size // 16)
+
+    tile = Image.new("RGBA", (right - left + shadow, bottom - top + shadow), (255, 255, 255, 0))
+    draw = ImageDraw.Draw(tile)
+    draw.text((shadow - left, shadow - top), text, font=font, fill=WATERMARK_SHADOW_COLOR)
+    draw.text((-left, -top), text, font=font, fill=WATERMARK_TEXT_COLOR)
+    return tile
+
+
+def _watermark_positions(image_size, tile_size, position, padding):
+    width, height = image_size
+    tile_width, tile_height = tile_size
+    if position == "tiled":
+        # A brick pattern: every other row is shifted by half a step.
+        step_x, step_y = tile_width + 4 * padding, tile_height + 4 * padding
+        for row, y in enumerate(range(padding, height, step_y)):
+            offset = step_x // 2 if row % 2 else 0
+            for x in range(padding - offset, width, step_x):
+                yield x, y
+    elif position == "top_left":
+        yield padding, padding
+    elif position == "top_right":
+        yield width - tile_width - padding, padding
+    elif position == "bottom_left":
+        yield padding, height - tile_height - padding
+    elif position == "center":
+        yield (width - tile_width) // 2, (height - tile_height) // 2
+    else:
+        yield width - tile_width - padding, height - tile_height - padding
+
+
+def apply_watermark(image, watermark_text, position, scale=WATERMARK_SCALE, font_path=None, frame=None):
+    # Only the tile's bounding box is blended; RGB and RGBA images are drawn on in place,
+    # other modes are converted first. frame is (full size, top row) when image is a
+    # full-width strip of a larger image; the watermark is laid out for the full image.
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if "A" in image.getbands() or "transparency" in image.info else "RGB")
+    size, top = frame or (image.size, 0)
+
+    font_size = max(WATERMARK_MIN_SIZE, round(min(size) * scale))
+    tile = watermark_tile(watermark_text, font_size, font_path)
+    padding = max(12, font_size // 2)
+
+    for x, y in _watermark_positions(size, tile.size, position, padding):
+        y -= top
+        # Crop the tile where it hangs over the edge; alpha_composite needs a destination
+        # inside the image.
+        box = (max(0, -x), max(0, -y), min(tile.width, image.width - x), min(tile.height, image.height - y))
+        if box[0] >= box[2] or box[1] >= box[3]:
+            continue
+        part = tile if box == (0, 0, tile.width, tile.height) else tile.crop(box)
+        destination = (x + box[0], y + box[1])
+        if image.mode == "RGBA":
+            image.alpha_composite(part, destination)
+        else:
+            image.paste(part, destination, part)
+    return image
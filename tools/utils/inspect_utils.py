@@ -0,0 +1,128 @@
+import io
+
+from PIL import ExifTags, Image, TiffImagePlugin, UnidentifiedImageError
+
+try:
+    from PIL import ImageCms
+except ImportError:
+    ImageCms = None
+
+
+# EXIF orientations 5-8 rotate by 90 degrees, so the image is shown with width and height swapped.
+TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+
+
+def needs_whole_file(head):
+    # Pillow counts GIF and TIFF frames by walking the whole file, and opens WEBP through a
+    # demuxer that needs all of it; for other formats the header carries everything.
+    return (
+        head[:4] == b"GIF8"
+        or (head[:4] == b"RIFF" and head[8:12] == b"WEBP")
+        or head[:4] in (b"II*\x00", b"MM\x00*")
+    )
+
+
+def header_complete(head):
+    # Whether head holds the whole header. A header cut short fails to parse; data that is not
+    # an image at all never will, however much more is read.
+    try:
+        with Image.open(io.BytesIO(head)):
+            return True
+    except (UnidentifiedImageError, Image.DecompressionBombError):
+        return True
+    except Exception:
+        return False
+
+
+def _exif(image):
+    # PNG's getexif() loads the pixels to look for an eXIf chunk after the image data.
+    if image.format == "PNG" and "exif" not in image.info:
+        return Image.Exif()
+    return image.getexif()
+
+
+def _exif_value(value):
+    if isinstance(value, TiffImagePlugin.IFDRational):
+        return float(value) if value.denominator else None
+    if isinstance(value, bytes):
+        return None
+    if isinstance(value, str):
+        return value.strip("\x00 ")
+    return value if isinstance(value, (int, float)) else None
+
+
+def _icc_profile(data):
+    if not data:
+        return None
+    profile = {"bytes": len(data), "description": None}
+    if ImageCms is not None:
+        try:
+            profile["description"] = ImageCms.getProfileDescription(ImageCms.ImageCmsProfile(io.BytesIO(data))).strip()
+        except (ImageCms.PyCMSError, OSError):
+            pass
+    return profile
+
+
+def _open_header(data):
+    # Image.open refuses images over Image.MAX_IMAGE_PIXELS once it has read their header. Only
+    # the header is wanted here, so for those the plugins are tried directly, the way Image.open
+    # does it, which skips that check for this call alone. Raising MAX_IMAGE_PIXELS instead
+    # would lift the limit for every thread decoding images in the process at the same time.
+    try:
+        return Image.open(io.BytesIO(data))
+    except Image.DecompressionBombError:
+        if not hasattr(Image, "ID") or not hasattr(Image, "OPEN"):
+            raise
+    Image.init()
+    prefix = data[:16]
+    for format_id in Image.ID:
+        factory, accept = Image.OPEN[format_id]
+        # accept returns a string to reject the data with a reason.
+        result = accept(prefix) if accept is not None else True
+        if not result or isinstance(result, str):
+            continue
+        try:
+            return factory(io.BytesIO(data), "")
+        except Exception:
+            continue
+    raise UnidentifiedImageError("cannot identify image file")
+
+
+def describe_image(data, complete=True):
+    # What Image.open reads from the header; no pixel data is decoded. data may be only the
+    # start of the file (complete=False), in which case a frame count that needs the whole
+    # file is None. Images over Pillow's pixel limit are still described, with
+    # exceeds_pixel_limit set, since nothing is decoded.
+    try:
+        with _open_header(data) as image:
+            exif = _exif(image)
+            orientation = exif.get(ExifTags.Base.Orientation, 1)
+            if complete or not needs_whole_file(data):
+                frames = getattr(image, "n_frames", 1)
+                animated = getattr(image, "is_animated", False)
+            else:
+                frames = animated = None
+            width, height = image.size
+            display_size = (height, width) if orientation in TRANSPOSED_ORIENTATIONS else (width, height)
+            tags = {ExifTags.TAGS.get(tag, str(tag)): _exif_value(value) for tag, value in exif.items()}
+            return {
+                "format": image.format,
+                "mime_type": image.get_format_mimetype(),
+                "width": width,
+                "height": height,
+                "mode": image.mode,
+                "exceeds_pixel_limit": Image.MAX_IMAGE_PIXELS is not None and width * height > Image.MAX_IMAGE_PIXELS,
+                "frames": frames,
+                "animated": animated,
+                "orientation": orientation,
+                "display_width": display_size[0],
+                "display_height": display_size[1],
+                "icc_profile": _icc_profile(image.info.get("icc_profile")),
+                "exif": {name: value for name, value in tags.items() if value is not None},
+            }
+    except UnidentifiedImageError:
+        raise ValueError("Not a supported image file.")
+    except Exception:
+        if not complete:
+            raise ValueError("The image header could not be read from the start of the file.")
+        raise ValueError("Unreadable image header.")
@@ -0,0 +1,211 @@
+import bisect
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+BYTE_BUCKETS = tuple(1024 * 4 ** power for power in range(10))
+PIXEL_BUCKETS = tuple(10 ** power for power in range(3, 10))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Histogram:
+    def __init__(self, name, documentation, buckets, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # One count per bucket plus +Inf, then the running sum.
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[bisect.bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip((*self.buckets, "+Inf"), series):
+                    cumulative += count
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', bound)])} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {series[-1]}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+
+REQUESTS = Counter("tools_requests_total", "Requests handled by each tool.", ("tool", "format", "status"))
+REQUEST_DURATION = Histogram("tools_request_duration_seconds", "Time until the response was returned.", DURATION_BUCKETS, ("tool", "format"))
+STAGE_DURATION = Histogram(
+    "tools_stage_duration_seconds",
+    "Time spent in each stage: parse, decode, transform, encode, hash, response and render.",
+    DURATION_BUCKETS,
+    ("tool", "format", "stage"),
+)
+REQUEST_BYTES = Histogram("tools_request_bytes", "Request body size.", BYTE_BUCKETS, ("tool", "format"))
+RESPONSE_BYTES = Histogram("tools_response_bytes", "Response body size, when known up front.", BYTE_BUCKETS, ("tool", "format"))
+IMAGE_PIXELS = Histogram("tools_image_pixels", "Pixels in each decoded source image.", PIXEL_BUCKETS, ("tool", "format"))
+PEAK_RSS_DELTA = Histogram(
+    "tools_peak_rss_delta_bytes",
+    "Growth of the peak resident size of the web process or image worker during the request.",
+    BYTE_BUCKETS,
+    ("tool", "format"),
+)
+
+REGISTRY = [REQUESTS, REQUEST_DURATION, STAGE_DURATION, REQUEST_BYTES, RESPONSE_BYTES, IMAGE_PIXELS, PEAK_RSS_DELTA]
+
+
+def render_metrics():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.collect())
+    return "\n".join(lines) + "\n"
+
+
+def max_rss_bytes():
+    # Peak resident size of this process so far.
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+class RequestMetrics:
+    # Stage timings and measurements for one request (or one executor job). Stages that run
+    # more than once, such as the decode of every file in a batch, are summed.
+    def __init__(self):
+        self.stages = {}
+        self.labels = {}
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def add_stage(self, name, seconds):
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def record(self, **values):
+        with self._lock:
+            for name, value in values.items():
+                self.values[name] = max(self.values.get(name, 0), value)
+
+    def merge(self, stats):
+        for name, seconds in stats["stages"].items():
+            self.add_stage(name, seconds)
+        self.record(**stats["values"])
+
+    def export(self):
+        with self._lock:
+            return {"stages": dict(self.stages), "values": dict(self.values)}
+
+
+_current = ContextVar("tools_request_metrics", default=None)
+
+
+def current_metrics():
+    return _current.get()
+
+
+def begin(metrics):
+    return _current.set(metrics)
+
+
+def end(token):
+    _current.reset(token)
+
+
+@contextmanager
+def stage(name):
+    metrics = _current.get()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if metrics is not None:
+            metrics.add_stage(name, time.perf_counter() - start)
+
+
+def set_labels(**labels):
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.labels.update(labels)
+
+
+def record(**values):
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.record(**values)
+
+
+def merge(stats):
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.merge(stats)
+
+
+def collect(fn, *args, **kwargs):
+    # Runs fn with its own collector and returns (result, stats); used inside executor jobs,
+    # whose stats travel back with the result and are merged into the request.
+    metrics = RequestMetrics()
+    token = begin(metrics)
+    rss_before = max_rss_bytes()
+    try:
+        result = fn(*args, **kwargs)
+    finally:
+        end(token)
+    if rss_before is not None:
+        metrics.record(rss_delta=max_rss_bytes() - rss_before)
+    return result, metrics.export()
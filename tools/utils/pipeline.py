@@ -0,0 +1,294 @@
+import math
+
+from django.conf import settings
+from PIL import Image
+
+from .filter_utils import ADJUSTMENTS, apply_adjustments, validate_adjustments
+from .image_utils import (
+    FILTERS,
+    WATERMARK_POSITIONS,
+    WATERMARK_SCALE,
+    apply_watermark,
+    center_crop_box,
+    compress_save_kwargs,
+    downscale_image,
+    draft_for_size,
+    encode_image,
+    fast_save_kwargs,
+    fit_image,
+    high_quality_save_kwargs,
+)
+from .metrics import record, stage
+from .png_utils import optimize_png
+
+
+CONVERT_MODES = {"RGB", "RGBA", "L", "LA"}
+
+# The largest width or height a resize or crop may ask for (JPEG's limit).
+MAX_DIMENSION = 65535
+
+
+def _positive_int(value, name, maximum=MAX_DIMENSION):
+    # JSON numbers such as 1e400 arrive as float("inf"), which int() rejects with OverflowError.
+    try:
+        value = int(value)
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError(f"{name} must be a number.")
+    if not 0 < value <= maximum:
+        raise ValueError(f"{name} must be between 1 and {maximum}.")
+    return value
+
+
+def _validate_size(params):
+    return {
+        "width": _positive_int(params.get("width"), "width"),
+        "height": _positive_int(params.get("height"), "height"),
+    }
+
+
+def _validate_filter(params):
+    name = params.get("name")
+    if name not in FILTERS:
+        raise ValueError(f"Unknown filter: {name}")
+    return {"name": name}
+
+
+def _validate_adjust(params):
+    return {"steps": validate_adjustments(params.get("steps"))}
+
+
+def _validate_watermark(params):
+    text = str(params.get("text", "")).strip()
+    position = params.get("position", "bottom_right")
+    if not text:
+        raise ValueError("Watermark text is required.")
+    if position not in WATERMARK_POSITIONS:
+        raise ValueError(f"Unknown watermark position: {position}")
+    try:
+        scale = float(params.get("scale", WATERMARK_SCALE))
+    except (TypeError, ValueError):
+        raise ValueError("scale must be a number.")
+    if not 0.005 <= scale <= 0.5:
+        raise ValueError("scale must be between 0.005 and 0.5.")
+    return {"text": text, "position": position, "scale": scale}
+
+
+def _validate_convert(params):
+    mode = str(params.get("mode", "")).upper()
+    if mode not in CONVERT_MODES:
+        raise ValueError(f"Unsupported mode: {mode}")
+    return {"mode": mode}
+
+
+def _validate_compress(params):
+    try:
+        quality = int(params.get("quality", 80))
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError("quality must be a number.")
+    return {"quality": max(10, min(95, quality))}
+
+
+# Each operation is (validator, apply). "compress" only configures the final encode.
+OPERATIONS = {
+    "resize": (_validate_size, lambda image, width, height: downscale_image(image, (width, height))),
+    "crop": (_validate_size, lambda image, width, height: fit_image(image, (width, height))),
+    "filter": (_validate_filter, lambda image, name: FILTERS[name](image)),
+    "adjust": (_validate_adjust, lambda image, steps: apply_adjustments(image, steps)),
+    "watermark": (
+        _validate_watermark,
+        lambda image, text, position, scale=WATERMARK_SCALE: apply_watermark(image, text, position, scale, settings.WATERMARK_FONT),
+    ),
+    "convert": (_validate_convert, lambda image, mode: image if image.mode == mode else image.convert(mode)),
+    "compress": (_validate_compress, None),
+}
+
+
+def validate_operations(operations):
+    if not isinstance(operations, list):
+        raise ValueError("Operations must be a list.")
+
+    validated = []
+    for operation in operations:
+        if not isinstance(operation, dict) or operation.get("op") not in OPERATIONS:
+            raise ValueError(f"Unknown operation: {operation!r}")
+        validator, _ = OPERATIONS[operation["op"]]
+        validated.append({"op": operation["op"], **validator(operation)})
+
+    # Every step of an adjustment chain is a pass of its own, so each one counts.
+    limit = settings.PIPELINE["MAX_OPERATIONS"]
+    if sum(len(operation["steps"]) if operation["op"] == "adjust" else 1 for operation in validated) > limit:
+        raise ValueError(f"Pipelines are limited to {limit} operations.")
+    return validated
+
+
+def plan_operations(operations):
+    # A mode conversion that is immediately replaced by another one is wasted work, so only the
+    # last conversion of a run is kept; conversions to the current mode are skipped at apply time.
+    # Named filters become adjustment steps, and neighbouring adjustments join one chain so
+    # their point operations and kernels can be fused.
+    planned = []
+    for operation in operations:
+        if operation["op"] == "filter":
+            if operation["name"] not in ADJUSTMENTS:
+                continue
+            operation = {"op": "adjust", "steps": validate_adjustments([{"name": operation["name"]}])}
+        if operation["op"] == "convert" and planned and planned[-1]["op"] == "convert":
+            planned[-1] = operation
+        elif operation["op"] == "adjust" and planned and planned[-1]["op"] == "adjust":
+            planned[-1] = {"op": "adjust", "steps": planned[-1]["steps"] + operation["steps"]}
+        else:
+            planned.append(operation)
+    return planned
+
+
+def _decode(source, operations):
+    # Decodes up front so decode time is measured on its own. A leading resize or crop still
+    # gets its JPEG draft first; the later draft_for_size call then sees an already reduced image.
+    image = Image.open(source)
+    record(pixels=image.width * image.height)
+    first = next((operation for operation in operations if operation["op"] != "compress"), None)
+    if first is not None and first["op"] in {"resize", "crop"}:
+        size = (first["width"], first["height"])
+        box = center_crop_box(image.size, size) if first["op"] == "crop" else None
+        draft_for_size(image, size, box)
+    image.load()
+    return image
+
+
+def run_pipeline(source, target_format, operations, save_kwargs=None):
+    operations = plan_operations(operations)
+    with stage("decode"):
+        image = _decode(source, operations)
+
+    with stage("transform"):
+        for operation in operations:
+            params = {name: value for name, value in operation.items() if name != "op"}
+            if operation["op"] == "compress":
+                save_kwargs = compress_save_kwargs(target_format, params["quality"])
+                continue
+            _, apply = OPERATIONS[operation["op"]]
+            image = apply(image, **params)
+
+    if save_kwargs is None:
+        save_kwargs = high_quality_save_kwargs(target_format)
+    with stage("encode"):
+        return encode_image(image, target_format, **save_kwargs)
+
+
+def convert_image(source, target_format):
+    return run_pipeline(source, target_format, [], save_kwargs={})
+
+
+def compress_image(source, target_format, quality):
+    return run_pipeline(source, target_format, [{"op": "compress", "quality": quality}])
+
+
+TARGET_QUALITIES = range(10, 96)
+TARGET_MAX_PROBES = 12
+TARGET_MAX_SCALES = 4
+TARGET_MIN_SCALE = 0.1
+
+
+def _probe_key(quality):
+    return "lossless" if quality is None else str(quality)
+
+
+def compress_to_size(source, target_format, target_bytes, curve=None, max_probes=TARGET_MAX_PROBES):
+    # Decodes once, then binary-searches the highest quality whose fast encode fits; only
+    # the chosen quality is encoded at full effort. When even the lowest quality is too big,
+    # the image is scaled down by the estimated ratio and searched again. curve holds the
+    # probe sizes of earlier searches ({scale: {quality: bytes}}), so repeats skip probing.
+    curve = {scale: dict(sizes) for scale, sizes in (curve or {}).items()}
+    qualities = list(TARGET_QUALITIES) if target_format in {"jpeg", "webp"} else [None]
+    attempts = 0
+
+    with stage("decode"):
+        original = _decode(source, [])
+    if target_format == "jpeg" and original.mode in ("RGBA", "P"):
+        original = original.convert("RGB")
+
+    scale, best = 1.0, None
+    with stage("search"):
+        for _ in range(TARGET_MAX_SCALES):
+            if scale == 1.0:
+                image = original
+            else:
+                size = (max(1, round(original.width * scale)), max(1, round(original.height * scale)))
+                image = original.resize(size, Image.Resampling.LANCZOS)
+            sizes = curve.setdefault(f"{scale:.4f}", {})
+
+            def probe(quality):
+                nonlocal attempts
+                key = _probe_key(quality)
+                if key not in sizes:
+                    attempts += 1
+                    save_kwargs = fast_save_kwargs(target_format, quality)
+                    sizes[key] = len(encode_image(image, target_format, **save_kwargs))
+                return sizes[key]
+
+            # The lowest quality goes first: if even that is too big, scale down straight away.
+            smallest = probe(qualities[0])
+            if smallest <= target_bytes:
+                best = qualities[0]
+                low, high = 1, len(qualities) - 1
+                while low <= high:
+                    middle = (low + high) // 2
+                    if attempts >= max_probes and _probe_key(qualities[middle]) not in sizes:
+                        break
+                    if probe(qualities[middle]) <= target_bytes:
+                        best, low = qualities[middle], middle + 1
+                    else:
+                        high = middle - 1
+                break
+
+            if scale <= TARGET_MIN_SCALE or attempts >= max_probes:
+                break
+            scale = max(TARGET_MIN_SCALE, scale * math.sqrt(target_bytes / smallest) * 0.95)
+
+    quality = best if best is not None else qualities[0]
+    with stage("encode"):
+        data = encode_image(image, target_format, **compress_save_kwargs(target_format, quality or 10))
+        attempts += 1
+        if best is not None and len(data) > target_bytes:
+            # The full-effort encode came out larger than its probe; the probe settings fit.
+            data = encode_image(image, target_format, **fast_save_kwargs(target_format, quality))
+            attempts += 1
+
+    return {
+        "data": data,
+        "quality": quality,
+        "scale": scale,
+        "width": image.width,
+        "height": image.height,
+        "fits": len(data) <= target_bytes,
+        "attempts": attempts,
+        "curve": curve,
+    }
+
+
+def compress_to_size_data(source, target_format, target_bytes):
+    return compress_to_size(source, target_format, target_bytes)["data"]
+
+
+def optimize_png_image(source, target_format, colors=None, dither=True, time_budget=None):
+    with stage("decode"):
+        image = _decode(source, [])
+    with stage("encode"):
+        return optimize_png(image, colors, dither, time_budget)
+
+
+def watermark_image(source, target_format, watermark_text, position, scale=WATERMARK_SCALE):
+    return run_pipeline(source, target_format, [{"op": "watermark", "text": watermark_text, "position": position, "scale": scale}])
+
+
+def resize_image(source, target_format, mode, width, height):
+    operation = "crop" if mode == "crop" else "resize"
+    return run_pipeline(source, target_format, [{"op": operation, "width": width, "height": height}])
+
+
+def filter_image(source, target_format, filter_name):
+    return run_pipeline(source, target_format, [{"op": "filter", "name": filter_name}])
+
+
+def adjust_image(source, target_format, steps):
+    return run_pipeline(source, target_format, [{"op": "adjust", "steps": steps}])
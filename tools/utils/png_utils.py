@@ -0,0 +1,76 @@
+import time
+import zlib
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from PIL import Image
+
+from .image_utils import encode_image, get_encode_pool
+
+
+# zlib settings tried for every image, cheapest first, encoded in parallel on the shared
+# encode pool. The first one is always waited for, so there is a result even when the time
+# budget runs out.
+PNG_CANDIDATES = (
+    {"compress_level": 6},
+    {"compress_level": 9, "compress_type": zlib.Z_FILTERED},
+    {"compress_level": 9},
+    {"compress_level": 9, "compress_type": zlib.Z_RLE},
+)
+
+
+def reduce_mode(image):
+    # Lossless mode reductions: drop an alpha channel that is fully opaque and store images
+    # with at most 256 colors as a palette.
+    if image.mode in ("RGBA", "LA") and image.getchannel("A").getextrema()[0] == 255:
+        image = image.convert(image.mode[:-1])
+    if image.mode == "RGB":
+        colors = image.getcolors(256)
+        if colors is not None:
+            palette = Image.new("P", (1, 1))
+            palette.putpalette([value for _, color in colors for value in color])
+            image = image.quantize(palette=palette, dither=Image.Dither.NONE)
+    return image
+
+
+def quantize_image(image, colors=256, dither=True):
+    dither = Image.Dither.FLOYDSTEINBERG if dither else Image.Dither.NONE
+    if image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info:
+        # Only the octree quantizer keeps the alpha channel.
+        return image.convert("RGBA").quantize(colors, method=Image.Quantize.FASTOCTREE, dither=dither)
+    return image.convert("RGB").quantize(colors, method=Image.Quantize.MEDIANCUT, dither=dither)
+
+
+def _encode_candidate(image, save_kwargs, deadline=None):
+    # Saving stores the encoder settings on the image object, so every candidate encodes
+    # its own copy. A candidate that only starts after the deadline returns None: cancel()
+    # cannot stop one the pool has already picked up, and its result would be ignored anyway.
+    if deadline is not None and time.monotonic() >= deadline:
+        return None
+    return encode_image(image.copy(), "png", **save_kwargs)
+
+
+def optimize_png(image, colors=None, dither=True, time_budget=None):
+    # Returns the smallest encoding of image found within time_budget seconds. colors
+    # quantizes to a palette first (lossy); without it only lossless reductions are applied.
+    image = quantize_image(image, colors, dither) if colors else reduce_mode(image)
+
+    deadline = None if time_budget is None else time.monotonic() + time_budget
+    pool = get_encode_pool()
+    futures = [pool.submit(_encode_candidate, image, PNG_CANDIDATES[0])]
+    futures += [pool.submit(_encode_candidate, image, save_kwargs, deadline) for save_kwargs in PNG_CANDIDATES[1:]]
+    try:
+        smallest = futures[0].result()
+        pending = futures[1:]
+        while pending:
+            timeout = None if deadline is None else max(0, deadline - time.monotonic())
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                data = future.result()
+                if data is not None and len(data) < len(smallest):
+                    smallest = data
+    finally:
+        for future in futures:
+            future.cancel()
+    return smallest
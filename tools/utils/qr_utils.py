@@ -0,0 +1,523 @@
+import csv
+import hashlib
+import itertools
+import json
+import operator
+import re
+import struct
+import threading
+import time
+import zipfile
+import zlib
+from collections import OrderedDict, deque
+
+import qrcode
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from PIL import ImageColor
+from qrcode import LUT, base, util
+
+from .executor import ExecutorBusy
+
+
+ERROR_CORRECTION_LEVELS = {
+    "L": qrcode.constants.ERROR_CORRECT_L,
+    "M": qrcode.constants.ERROR_CORRECT_M,
+    "Q": qrcode.constants.ERROR_CORRECT_Q,
+    "H": qrcode.constants.ERROR_CORRECT_H,
+}
+
+
+class _LRUCache:
+    # Counts hits and misses, and the time spent computing misses, so the stats endpoint can
+    # show what the cache actually saves.
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.compute_seconds = 0.0
+
+    def get_or_compute(self, key, compute):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+
+        start = time.perf_counter()
+        value = compute()
+        elapsed = time.perf_counter() - start
+
+        with self._lock:
+            self.misses += 1
+            self.compute_seconds += elapsed
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+            self.compute_seconds = 0.0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "compute_seconds": self.compute_seconds,
+                "avg_compute_ms": self.compute_seconds * 1000 / self.misses if self.misses else 0.0,
+            }
+
+
+_caches = None
+_caches_lock = threading.Lock()
+
+
+def get_qr_caches():
+    global _caches
+    with _caches_lock:
+        if _caches is None:
+            options = settings.QR_CACHE
+            _caches = {
+                "matrix": _LRUCache(options["MATRIX_ENTRIES"]),
+                "render": _LRUCache(options["RENDER_ENTRIES"]),
+            }
+        return _caches
+
+
+@receiver(setting_changed)
+def _reset_qr_caches(setting, **kwargs):
+    global _caches
+    if setting == "QR_CACHE":
+        with _caches_lock:
+            _caches = None
+
+
+def qr_cache_stats():
+    return {name: cache.stats() for name, cache in get_qr_caches().items()}
+
+
+class _BitWriter:
+    # Accumulates bits in one int; qrcode's BitBuffer appends them one at a time.
+    def __init__(self):
+        self.value = 0
+        self.length = 0
+
+    def put(self, num, length):
+        self.value = (self.value << length) | (num & ((1 << length) - 1))
+        self.length += length
+
+
+def _data_bits(data):
+    if data.mode == util.MODE_8BIT_BYTE:
+        return len(data.data) * 8
+    bits = _BitWriter()
+    data.write(bits)
+    return bits.length
+
+
+def _fit_version(level, data_list):
+    payload_bits = [_data_bits(data) for data in data_list]
+    for version in range(1, 41):
+        needed = sum(4 + util.length_in_bits(data.mode, version) + bits for data, bits in zip(data_list, payload_bits))
+        if needed <= util.BIT_LIMIT_TABLE[level][version]:
+            return version
+    raise ValueError("The data is too long to fit in a QR code.")
+
+
+_generator_products_cache = {}
+
+
+def _generator_products(ec_count):
+    # Entry f is f times the generator polynomial packed into one int, so each Reed-Solomon
+    # step is a shift and an XOR.
+    if ec_count not in _generator_products_cache:
+        exp, log = base.EXP_TABLE, base.LOG_TABLE
+        generator = [log[coefficient] for coefficient in LUT.rsPoly_LUT[ec_count][1:]]
+        _generator_products_cache[ec_count] = [0] + [
+            int.from_bytes(bytes(exp[(g + log[factor]) % 255] for g in generator), "big") for factor in range(1, 256)
+        ]
+    return _generator_products_cache[ec_count]
+
+
+def _codewords(version, level, data_list):
+    # Same output as qrcode.util.create_data, with table-driven Reed-Solomon instead of
+    # polynomial objects; it is most of the encode time for short URLs.
+    bits = _BitWriter()
+    for data in data_list:
+        bits.put(data.mode, 4)
+        bits.put(len(data), util.length_in_bits(data.mode, version))
+        if data.mode == util.MODE_8BIT_BYTE:
+            bits.put(int.from_bytes(data.data, "big"), len(data.data) * 8)
+        else:
+            data.write(bits)
+
+    rs_blocks = base.rs_blocks(version, level)
+    capacity = sum(block.data_count for block in rs_blocks)
+    bits.put(0, min(capacity * 8 - bits.length, 4))
+    bits.put(0, -bits.length % 8)
+    payload = bits.value.to_bytes(bits.length // 8, "big")
+    payload = (payload + bytes([util.PAD0, util.PAD1]) * ((capacity - len(payload)) // 2 + 1))[:capacity]
+
+    data_blocks = []
+    ec_blocks = []
+    offset = 0
+    for block in rs_blocks:
+        data_block = payload[offset:offset + block.data_count]
+        offset += block.data_count
+        ec_count = block.total_count - block.data_count
+        products = _generator_products(ec_count)
+        top_shift = 8 * (ec_count - 1)
+        keep = (1 << (8 * ec_count)) - 1
+        remainder = 0
+        for byte in data_block:
+            remainder = ((remainder << 8) & keep) ^ products[byte ^ (remainder >> top_shift)]
+        data_blocks.append(data_block)
+        ec_blocks.append(remainder.to_bytes(ec_count, "big"))
+
+    # Interleave: blocks in a group have equal length and the second group is one longer.
+    codewords = bytearray()
+    for blocks in (data_blocks, ec_blocks):
+        shortest = min(len(block) for block in blocks)
+        codewords += bytes(itertools.chain.from_iterable(zip(*blocks)))
+        codewords += bytes(block[shortest] for block in blocks if len(block) > shortest)
+    return bytes(codewords)
+
+
+def _function_layout(version, level, fill, test, mask_pattern=0):
+    # A bare matrix with qrcode's function patterns and format/version information placed.
+    qr = qrcode.QRCode(version=version, error_correction=level, border=0)
+    size = qr.modules_count = version * 4 + 17
+    qr.modules = [[fill] * size for _ in range(size)]
+    if fill is None:
+        qr.setup_position_probe_pattern(0, 0)
+        qr.setup_position_probe_pattern(size - 7, 0)
+        qr.setup_position_probe_pattern(0, size - 7)
+        qr.setup_position_adjust_pattern()
+        qr.setup_timing_pattern()
+    qr.setup_type_info(test, mask_pattern)
+    if version >= 7:
+        qr.setup_type_number(test)
+    return qr.modules
+
+
+_MODULE_DIGITS = bytes.maketrans(b"\x00\x01", b"01")
+_DIGIT_MODULES = bytes.maketrans(b"01", b"\x00\x01")
+
+
+def _to_bits(modules):
+    # One byte per module (0/1) to an int with module i at bit i.
+    return int(modules[::-1].translate(_MODULE_DIGITS), 2)
+
+
+def _from_bits(value, count):
+    return bin(value)[2:].zfill(count)[::-1].encode("ascii").translate(_DIGIT_MODULES)
+
+
+def _transpose(modules, size):
+    return b"".join(modules[column::size] for column in range(size))
+
+
+def _starts(size, lines, width):
+    # Bit set at every position where a window of `width` modules fits inside its line.
+    return _to_bits((b"\x01" * (size - width + 1) + b"\x00" * (width - 1)) * lines)
+
+
+class _VersionLayout:
+    # Everything about a version that does not depend on the data, built once per version.
+    # Matrices are ints with one bit per module in row-major order; "lines" ints hold the
+    # rows followed by the columns, so runs and patterns are found for both at once.
+    def __init__(self, version):
+        size = self.size = version * 4 + 17
+        count = self.count = size * size
+        layout = _function_layout(version, 0, None, True)
+
+        # Data bits are placed in qrcode's map_data order. Each module gathers its value by
+        # index from the data bits followed by a light and a dark sentinel.
+        order = []
+        row, step = size - 1, -1
+        for col in range(size - 1, 0, -2):
+            if col <= 6:
+                col -= 1
+            while 0 <= row < size:
+                order.extend(row * size + c for c in (col, col - 1) if layout[row][c] is None)
+                row += step
+            row -= step
+            step = -step
+        self.capacity = len(order)
+        gather = [self.capacity + 1 if module else self.capacity for row in layout for module in row]
+        for bit, position in enumerate(order):
+            gather[position] = bit
+        self.gather = operator.itemgetter(*gather)
+
+        self.masks = []
+        for pattern in range(8):
+            flips = util.mask_func(pattern)
+            flipped = bytes(layout[r][c] is None and flips(r, c) for r in range(size) for c in range(size))
+            flipped_bits = _to_bits(flipped)
+            self.masks.append((flipped_bits, flipped_bits | _to_bits(_transpose(flipped, size)) << count))
+
+        self.run_starts = _starts(size, 2 * size, 5)
+        self.pattern_starts = _starts(size, 2 * size, 11)
+        self.block_starts = _starts(size, size - 1, 2)
+
+    def place(self, codewords):
+        bits = bin(int.from_bytes(codewords, "big"))[2:].zfill(len(codewords) * 8)
+        bits = (bits[:self.capacity].ljust(self.capacity, "0") + "01").encode("ascii").translate(_DIGIT_MODULES)
+        return bytes(self.gather(bits))
+
+
+_layouts = {}
+
+
+def _version_layout(version):
+    if version not in _layouts:
+        _layouts[version] = _VersionLayout(version)
+    return _layouts[version]
+
+
+_info_layers_cache = {}
+
+
+def _info_layer(version, level, mask_pattern):
+    key = (version, level, mask_pattern)
+    if key not in _info_layers_cache:
+        layout = _function_layout(version, level, False, False, mask_pattern)
+        _info_layers_cache[key] = _to_bits(b"".join(bytes(row) for row in layout))
+    return _info_layers_cache[key]
+
+
+_FINDER_LIKE_PATTERNS = ((1, 0, 1, 1, 1, 0, 1, 0, 0, 0, 0), (0, 0, 0, 0, 1, 0, 1, 1, 1, 0, 1))
+
+
+def _mask_penalty(value, lines, layout):
+    # qrcode.util.lost_point computed with whole-matrix bit operations instead of per module;
+    # it scores every mask identically, so the same mask is chosen.
+    size = layout.size
+
+    # Rule 1: runs of five or more same-coloured modules score their length - 2. Counting the
+    # five-module windows that are uniform gives sum(length - 4); each run adds 2 more.
+    equal = ~(lines ^ (lines >> 1))
+    windows = equal & (equal >> 1) & (equal >> 2) & (equal >> 3) & layout.run_starts
+    penalty = windows.bit_count() + 2 * (windows & ~(windows << 1)).bit_count()
+
+    # Rule 2: 3 for every uniform 2x2 block.
+    horizontal = value ^ (value >> 1)
+    mixed = horizontal | (horizontal >> size) | (value ^ (value >> size))
+    penalty += 3 * (layout.block_starts & ~mixed).bit_count()
+
+    # Rule 3: 40 for every 1:1:3:1:1 finder-like pattern with four light modules on either side.
+    light = ~lines
+    for pattern in _FINDER_LIKE_PATTERNS:
+        found = layout.pattern_starts
+        for offset, dark in enumerate(pattern):
+            found &= (lines if dark else light) >> offset
+        penalty += 40 * found.bit_count()
+
+    # Rule 4: 10 for every 5% the dark proportion is away from 50%.
+    return penalty + int(abs(float(value.bit_count()) / layout.count * 100 - 50) / 5) * 10
+
+
+def compute_qr_matrix(data, error_correction="M", mask_pattern=None):
+    # The module matrix is returned as (size, bytes) with one byte per module (1 = dark),
+    # which is immutable, cheap to hash and small enough to keep thousands of in memory.
+    # The data is placed once; the eight masked candidates are derived from it with XOR
+    # layers and scored in bulk. Pass mask_pattern (0-7) to skip the scoring.
+    if error_correction not in ERROR_CORRECTION_LEVELS:
+        raise ValueError(f"Unsupported error correction level: {error_correction}")
+
+    level = ERROR_CORRECTION_LEVELS[error_correction]
+    qr = qrcode.QRCode(error_correction=level, border=0, mask_pattern=mask_pattern)
+    qr.add_data(data)
+    version = _fit_version(level, qr.data_list)
+    layout = _version_layout(version)
+    modules = layout.place(_codewords(version, level, qr.data_list))
+    unmasked = _to_bits(modules)
+
+    if mask_pattern is None:
+        unmasked_lines = unmasked | _to_bits(_transpose(modules, layout.size)) << layout.count
+        penalties = [
+            _mask_penalty(unmasked ^ flipped, unmasked_lines ^ flipped_lines, layout)
+            for flipped, flipped_lines in layout.masks
+        ]
+        mask_pattern = penalties.index(min(penalties))
+
+    matrix = unmasked ^ layout.masks[mask_pattern][0] | _info_layer(version, level, mask_pattern)
+    return layout.size, _from_bits(matrix, layout.count)
+
+
+def qr_matrix(data, error_correction="M"):
+    return get_qr_caches()["matrix"].get_or_compute(
+        (data, error_correction),
+        lambda: compute_qr_matrix(data, error_correction),
+    )
+
+
+def _png_chunk(tag, data):
+    return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data))
+
+
+def _render_png(matrix, box_size, border, fill_color, back_color):
+    size, modules = matrix
+    width = (size + 2 * border) * box_size
+    row_bytes = (width + 7) // 8
+    padding = b"0" * (row_bytes * 8 - width)
+    # A 1-bit palette PNG (index 1 is the foreground). Three replaces widen every module into
+    # box_size binary digits and turn the row separators into the quiet zone and byte padding;
+    # the box_size - 1 repeats of each row use the PNG "Up" filter, so they are all zero bytes.
+    edge = b"0" * (border * box_size)
+    rows = b"\x02".join(modules[y * size:(y + 1) * size] for y in range(size))
+    digits = rows.replace(b"\x01", b"1" * box_size).replace(b"\x00", b"0" * box_size).replace(b"\x02", edge + padding + edge)
+    packed = int(edge + digits + edge + padding, 2).to_bytes(row_bytes * size, "big")
+
+    blank = (b"\0" + bytes(row_bytes)) * (border * box_size)
+    repeats = (b"\x02" + bytes(row_bytes)) * (box_size - 1)
+    lines = [blank]
+    for y in range(size):
+        lines.append(b"\0" + packed[y * row_bytes:(y + 1) * row_bytes] + repeats)
+    lines.append(blank)
+
+    palette = bytes(ImageColor.getrgb(back_color)[:3] + ImageColor.getrgb(fill_color)[:3])
+    return b"".join((
+        b"\x89PNG\r\n\x1a\n",
+        _png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, width, 1, 3, 0, 0, 0)),
+        _png_chunk(b"PLTE", palette),
+        _png_chunk(b"IDAT", zlib.compress(b"".join(lines))),
+        _png_chunk(b"IEND", b""),
+    ))
+
+
+_DARK_RUN = re.compile(b"\x01+")
+
+
+def _render_svg(matrix, box_size, border, fill_color, back_color):
+    size, modules = matrix
+    full_size = size + 2 * border
+    path = []
+    # Horizontal runs of dark modules become one rectangle each.
+    for y in range(size):
+        for run in _DARK_RUN.finditer(modules, y * size, (y + 1) * size):
+            start, length = run.start() - y * size, run.end() - run.start()
+            path.append(f"M{start + border} {y + border}h{length}v1h-{length}z")
+
+    svg = (
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {full_size} {full_size}" '
+        f'width="{full_size * box_size}" height="{full_size * box_size}" shape-rendering="crispEdges">'
+        f'<rect width="100%" height="100%" fill="{back_color}"/>'
+        f'<path fill="{fill_color}" d="{"".join(path)}"/></svg>'
+    )
+    return svg.encode("utf-8")
+
+
+RENDERERS = {
+    "png": _render_png,
+    "svg": _render_svg,
+}
+
+QR_FORMATS = set(RENDERERS)
+
+
+def render_qr(matrix, target_format="png", box_size=10, border=4, fill_color="black", back_color="white"):
+    if target_format not in QR_FORMATS:
+        raise ValueError(f"Unsupported QR format: {target_format}")
+
+    renderer = RENDERERS[target_format]
+    return get_qr_caches()["render"].get_or_compute(
+        (matrix, target_format, box_size, border, fill_color, back_color),
+        lambda: renderer(matrix, box_size, border, fill_color, back_color),
+    )
+
+
+def qr_etag(data, error_correction="M", target_format="png", box_size=10, border=4, fill_color="black", back_color="white"):
+    # Derived from the inputs alone, so a conditional request can be answered before the
+    # code is encoded or rendered.
+    key = (data, error_correction, target_format, box_size, border, fill_color, back_color)
+    return hashlib.sha256(repr(key).encode("utf-8")).hexdigest()
+
+
+def make_qr(data, target_format="png", error_correction="M", **render_options):
+    return render_qr(qr_matrix(data, error_correction), target_format, **render_options)
+
+
+def make_qr_png(data):
+    return make_qr(data, "png")
+
+
+def parse_qr_list(text):
+    # One code per line; for CSV input the first column is used and a "url" header is skipped.
+    values = []
+    for row in csv.reader(text.splitlines()):
+        value = row[0].strip() if row else ""
+        if not value or (not values and value.lower() in {"url", "urls", "data"}):
+            continue
+        values.append(value)
+    return values
+
+
+def render_qr_chunk(values, target_format="png", error_correction="M", mask_pattern=None, box_size=10, border=4, fill_color="black", back_color="white"):
+    # Runs on the image executor: no caches, since bulk inputs are almost always unique.
+    renderer = RENDERERS[target_format]
+    results = []
+    for value in values:
+        try:
+            matrix = compute_qr_matrix(value, error_correction, mask_pattern)
+        except ValueError as exc:
+            results.append((None, str(exc)))
+        else:
+            results.append((renderer(matrix, box_size, border, fill_color, back_color), None))
+    return results
+
+
+def bulk_qr(values, executor, chunk_size=250, **options):
+    # Chunks go to the executor with at most one per worker in flight and come back in input
+    # order; when the executor is full the chunk is rendered in the calling thread instead.
+    chunks = (values[start:start + chunk_size] for start in range(0, len(values), chunk_size))
+    pending = deque()
+
+    def drain(limit):
+        while len(pending) > limit:
+            chunk, future = pending.popleft()
+            if future is None:
+                results = render_qr_chunk(chunk, **options)
+            else:
+                try:
+                    results = future.result(timeout=executor.timeout)
+                except Exception:
+                    future.cancel()
+                    results = [(None, "Could not generate this QR code.")] * len(chunk)
+            yield from zip(chunk, results)
+
+    for chunk in chunks:
+        try:
+            future = executor.submit(render_qr_chunk, chunk, **options)
+        except ExecutorBusy:
+            future = None
+        pending.append((chunk, future))
+        yield from drain(executor.max_workers)
+    yield from drain(0)
+
+
+def qr_zip_entries(values, executor, target_format="png", **options):
+    # Entries are numbered in input order so they line up with the source list; manifest.json
+    # maps each entry back to its data and lists the values that could not be encoded.
+    width = max(len(str(len(values))), 5)
+    manifest = []
+    for index, (value, (data, error)) in enumerate(bulk_qr(values, executor, target_format=target_format, **options), start=1):
+        if error is not None:
+            manifest.append({"index": index, "data": value, "status": "error", "error": error})
+            continue
+        entry_name = f"qr-{index:0{width}d}.{target_format}"
+        manifest.append({"index": index, "data": value, "status": "ok", "entry": entry_name})
+        yield entry_name, data, zipfile.ZIP_STORED if target_format == "png" else zipfile.ZIP_DEFLATED
+
+    yield "manifest.json", json.dumps({"codes": manifest}, indent=2).encode("utf-8"), zipfile.ZIP_DEFLATED
@@ -0,0 +1,200 @@
+import base64
+import hashlib
+import io
+import json
+import os
+import re
+import tempfile
+import time
+import uuid
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponseNotModified
+from django.urls import reverse
+
+
+CONTENT_TYPES = {
+    "png": "image/png",
+    "jpeg": "image/jpeg",
+    "webp": "image/webp",
+    "json": "application/json",
+    "zip": "application/zip",
+}
+
+
+# Results live in files under RESULT_STORE["ROOT"] so that every worker process (and every
+# server sharing that directory) can serve a result another one produced. Each file holds one
+# line of JSON metadata followed by the output bytes.
+_RESULT_NAME = re.compile(r"^[0-9a-f]{64}$")
+_TOKEN_NAME = re.compile(r"^[0-9a-f]{32}$")
+
+# Touched by whichever process pruned last; its mtime is when the store was last pruned.
+_PRUNE_MARKER = ".pruned"
+
+
+def _store_path(name):
+    return os.path.join(settings.RESULT_STORE["ROOT"], name)
+
+
+def _write_atomic(name, metadata, data=b""):
+    # Written under a temporary name and renamed, so readers never see a partial file.
+    root = settings.RESULT_STORE["ROOT"]
+    os.makedirs(root, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=root, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as file:
+            file.write(json.dumps(metadata).encode("utf-8") + b"\n")
+            file.write(data)
+        os.replace(temp_path, _store_path(name))
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def _open_fresh(name):
+    # The stored file with its metadata read, or None when it is missing or expired.
+    path = _store_path(name)
+    try:
+        file = open(path, "rb")
+    except FileNotFoundError:
+        return None, None
+    if time.time() - os.fstat(file.fileno()).st_mtime > settings.RESULT_CACHE_TIMEOUT:
+        file.close()
+        return None, None
+    return file, json.loads(file.readline())
+
+
+def prune_results():
+    # Drops expired files, then the oldest ones until the store fits RESULT_STORE["MAX_BYTES"].
+    # Several processes may prune at once, so files that are already gone are skipped.
+    root = settings.RESULT_STORE["ROOT"]
+    expires = time.time() - settings.RESULT_CACHE_TIMEOUT
+    entries = []
+    try:
+        with os.scandir(root) as scan:
+            for entry in scan:
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                if entry.name == _PRUNE_MARKER or (entry.name.startswith(".tmp-") and stat.st_mtime >= expires):
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+    except FileNotFoundError:
+        return
+
+    total = sum(size for _, size, _ in entries)
+    for mtime, size, path in sorted(entries):
+        if mtime >= expires and total <= settings.RESULT_STORE["MAX_BYTES"]:
+            break
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def _prune_due():
+    # Pruning scans the whole store, so it runs at most once per RESULT_STORE["PRUNE_INTERVAL"]
+    # seconds across all processes. The marker is touched before the scan; two processes that
+    # both find it stale just prune twice.
+    marker = _store_path(_PRUNE_MARKER)
+    try:
+        if time.time() - os.stat(marker).st_mtime < settings.RESULT_STORE["PRUNE_INTERVAL"]:
+            return False
+    except FileNotFoundError:
+        pass
+    with open(marker, "ab"):
+        os.utime(marker)
+    return True
+
+
+def store_result(data, target_format, download_name):
+    key = hashlib.sha256(data).hexdigest()
+    metadata = {"content_type": CONTENT_TYPES[target_format], "download_name": download_name}
+    _write_atomic(key, metadata, data)
+    if _prune_due():
+        prune_results()
+    return key
+
+
+def load_result(key):
+    if not _RESULT_NAME.match(key):
+        return None
+    file, metadata = _open_fresh(key)
+    if file is None:
+        return None
+    with file:
+        return {**metadata, "data": file.read()}
+
+
+def start_pending_result(download_name):
+    # A token for a result that is still being computed in the background.
+    token = uuid.uuid4().hex
+    _write_atomic(token, {"status": "pending", "download_name": download_name})
+    return token
+
+
+def finish_pending_result(token, download_name, key=None, error=None):
+    status = {"status": "error", "error": error} if error else {"status": "done", "key": key}
+    _write_atomic(token, {**status, "download_name": download_name})
+
+
+def load_pending_result(token):
+    if not _TOKEN_NAME.match(token):
+        return None
+    file, metadata = _open_fresh(token)
+    if file is None:
+        return None
+    file.close()
+    return metadata
+
+
+def wants_image(request, target_format):
+    # Browsers put text/html first; API clients that ask for the image get the bytes directly.
+    content_type = CONTENT_TYPES[target_format]
+    return request.get_preferred_type(["text/html", content_type]) == content_type
+
+
+def result_response(data, target_format, download_name, etag=None):
+    etag = etag or hashlib.sha256(data).hexdigest()
+    response = FileResponse(
+        io.BytesIO(data),
+        content_type=CONTENT_TYPES[target_format],
+        filename=download_name,
+    )
+    response["ETag"] = f'"{etag}"'
+    response["Cache-Control"] = f"private, max-age={settings.RESULT_CACHE_TIMEOUT}, immutable"
+    return response
+
+
+def result_src(request, data, target_format, download_name):
+    # Inline base64 is opt-in and only for small outputs; everything else is served by URL.
+    if request.POST.get("inline") and len(data) <= settings.INLINE_RESULT_MAX_SIZE:
+        encoded = base64.b64encode(data).decode("ascii")
+        return f"data:{CONTENT_TYPES[target_format]};base64,{encoded}"
+
+    key = store_result(data, target_format, download_name)
+    return reverse("tools:result", args=[key])
+
+
+def serve_result(request, key):
+    if request.headers.get("If-None-Match", "").strip('"') == key and _RESULT_NAME.match(key):
+        response = HttpResponseNotModified()
+        response["ETag"] = f'"{key}"'
+        return response
+
+    file, result = _open_fresh(key) if _RESULT_NAME.match(key) else (None, None)
+    if file is None:
+        return None
+
+    # The open file is streamed from just past its metadata line; FileResponse closes it.
+    response = FileResponse(
+        file,
+        content_type=result["content_type"],
+        filename=result["download_name"],
+        as_attachment=bool(request.GET.get("download")),
+    )
+    response["ETag"] = f'"{key}"'
+    response["Cache-Control"] = f"private, max-age={settings.RESULT_CACHE_TIMEOUT}, immutable"
+    return response
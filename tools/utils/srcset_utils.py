@@ -0,0 +1,128 @@
+import html
+import json
+import zipfile
+
+from PIL import Image
+
+from .image_utils import REDUCING_GAP, compress_save_kwargs, draft_for_size, encode_image, get_encode_pool
+from .metrics import record, stage
+from .zip_utils import stream_zip
+
+
+SRCSET_WIDTHS = (320, 640, 1280, 2560)
+SRCSET_FORMATS = ("webp", "jpeg")
+SRCSET_MAX_WIDTHS = 8
+
+# <source> elements are listed in this order, and the last format requested is the <img>
+# fallback, so browsers pick the first type they support.
+SRCSET_FORMAT_ORDER = ("webp", "png", "jpeg")
+SRCSET_EXTENSIONS = {"webp": "webp", "jpeg": "jpg", "png": "png"}
+SRCSET_MIME_TYPES = {"webp": "image/webp", "jpeg": "image/jpeg", "png": "image/png"}
+
+
+def validate_srcset(widths, formats):
+    # Returns (widths, formats) with the widths sorted from largest to smallest.
+    if not widths or len(widths) > SRCSET_MAX_WIDTHS:
+        raise ValueError(f"Give between 1 and {SRCSET_MAX_WIDTHS} widths.")
+    if any(width <= 0 for width in widths):
+        raise ValueError("Widths must be positive numbers.")
+    if not formats or any(fmt not in SRCSET_EXTENSIONS for fmt in formats):
+        raise ValueError("Formats must be webp, jpeg or png.")
+    formats = [fmt for fmt in SRCSET_FORMAT_ORDER if fmt in formats]
+    return sorted(set(widths), reverse=True), formats
+
+
+def srcset_sizes(image_size, widths):
+    # Output sizes from largest to smallest. Widths at or above the source width are dropped
+    # (upscaling only adds bytes); if none are left the source width is used on its own.
+    source_width, source_height = image_size
+    widths = [width for width in widths if width < source_width] or [source_width]
+    return [(width, max(1, round(width * source_height / source_width))) for width in widths]
+
+
+def _decode(image, sizes):
+    # A JPEG source decodes straight at the smallest scale that still covers the largest size.
+    record(pixels=image.width * image.height)
+    draft_for_size(image, sizes[0])
+    image.load()
+    if image.mode not in ("RGB", "RGBA"):
+        # Palette images would be resized with NEAREST; everything else cannot be encoded
+        # as both JPEG and WEBP.
+        image = image.convert("RGBA" if image.has_transparency_data else "RGB")
+    return image
+
+
+def cascade_downscales(image, sizes):
+    # Each size is resampled from the previous, larger one rather than from the source, so
+    # the whole set costs little more than the first downscale.
+    variants = []
+    for size in sizes:
+        if image.size != size:
+            image = image.resize(size, Image.Resampling.LANCZOS, reducing_gap=REDUCING_GAP)
+        variants.append(image)
+    return variants
+
+
+def _encode_variant(image, fmt, quality):
+    # Saving stores the encoder settings on the image object, so every encode gets its own copy.
+    return encode_image(image.copy(), fmt, **compress_save_kwargs(fmt, quality))
+
+
+def _file_name(name, width, fmt):
+    return f"{name}-{width}w.{SRCSET_EXTENSIONS[fmt]}"
+
+
+def picture_snippet(name, variants, formats, sizes_attribute="100vw"):
+    # variants are (width, height) pairs from largest to smallest; the <img> uses the largest
+    # one for its intrinsic size so the browser reserves the right aspect ratio.
+    def srcset(fmt):
+        return ", ".join(f"{html.escape(_file_name(name, width, fmt))} {width}w" for width, _ in reversed(variants))
+
+    fallback = formats[-1]
+    width, height = variants[0]
+    lines = ["<picture>"]
+    for fmt in formats[:-1]:
+        lines.append(f'  <source type="{SRCSET_MIME_TYPES[fmt]}" srcset="{srcset(fmt)}" sizes="{sizes_attribute}">')
+    lines.append(
+        f'  <img src="{html.escape(_file_name(name, variants[-1][0], fallback))}" srcset="{srcset(fallback)}" '
+        f'sizes="{sizes_attribute}" width="{width}" height="{height}" alt="" loading="lazy" decoding="async">'
+    )
+    lines.append("</picture>")
+    return "\n".join(lines) + "\n"
+
+
+def srcset_archive(source, target_format, widths, formats, quality, name="image"):
+    # One decode, a cascade of downscales and every size x format encode in parallel. Returns
+    # a ZIP of the images plus picture.html and a manifest.json with each file's byte size.
+    with stage("decode"):
+        image = Image.open(source)
+        sizes = srcset_sizes(image.size, widths)
+        source_info = {"width": image.width, "height": image.height, "format": image.format, "mode": image.mode}
+        image = _decode(image, sizes)
+
+    with stage("transform"):
+        variants = cascade_downscales(image, sizes)
+
+    with stage("encode"):
+        pool = get_encode_pool()
+        futures = {
+            (size[0], fmt): pool.submit(_encode_variant, variant, fmt, quality)
+            for size, variant in zip(sizes, variants)
+            for fmt in formats
+        }
+        encoded = {key: future.result() for key, future in futures.items()}
+
+    files = []
+    entries = []
+    for width, height in sizes:
+        for fmt in formats:
+            data = encoded[(width, fmt)]
+            file_name = _file_name(name, width, fmt)
+            files.append({"file": file_name, "format": fmt, "width": width, "height": height, "bytes": len(data)})
+            entries.append((file_name, data, zipfile.ZIP_STORED))
+
+    snippet = picture_snippet(name, sizes, formats)
+    manifest = {"source": source_info, "quality": quality, "files": files, "picture": snippet}
+    entries.append(("picture.html", snippet.encode("utf-8"), zipfile.ZIP_DEFLATED))
+    entries.append(("manifest.json", json.dumps(manifest, indent=2).encode("utf-8"), zipfile.ZIP_DEFLATED))
+    return b"".join(stream_zip(entries))
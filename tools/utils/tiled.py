@@ -0,0 +1,373 @@
+import io
+import math
+import struct
+import zlib
+
+from django.conf import settings
+from PIL import Image
+
+from .filter_utils import adjustment_halo, apply_adjustments
+from .image_utils import apply_watermark, center_crop_box, compress_save_kwargs, encode_image
+from .metrics import record, stage
+from .pipeline import plan_operations
+
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# 8-bit PNG colour types -> Pillow mode and bytes per pixel.
+PNG_COLOR_TYPES = {0: ("L", 1), 2: ("RGB", 3), 3: ("P", 1), 4: ("LA", 2), 6: ("RGBA", 4)}
+PNG_MODES = {mode: color_type for color_type, (mode, _) in PNG_COLOR_TYPES.items() if mode != "P"}
+PNM_MODES = {b"P5": ("L", 1), b"P6": ("RGB", 3)}
+
+# LANCZOS reaches three source pixels (scaled by the reduction) from each output pixel.
+LANCZOS_SUPPORT = 3.0
+READ_SIZE = 1024 * 1024
+
+
+def _read(source, size):
+    data = source.read(size)
+    if len(data) < size:
+        raise ValueError("The image file is truncated.")
+    return data
+
+
+def _chunk(kind, data):
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+
+def _png_chunks(data):
+    position = len(PNG_SIGNATURE)
+    while position < len(data):
+        length, kind = struct.unpack(">I4s", data[position : position + 8])
+        yield kind, data[position + 8 : position + 8 + length]
+        position += length + 12
+
+
+def _png_header(source):
+    # Reads up to the first IDAT chunk. Only the palette and transparency chunks are kept;
+    # they are all a strip needs to decode.
+    header = {"format": "png", "chunks": b""}
+    while True:
+        length, kind = struct.unpack(">I4s", _read(source, 8))
+        if kind == b"IDAT":
+            break
+        data, crc = _read(source, length), _read(source, 4)
+        if kind == b"IHDR":
+            width, height, bits, color_type, _, _, interlace = struct.unpack(">IIBBBBB", data)
+            if bits != 8 or color_type not in PNG_COLOR_TYPES or interlace:
+                raise ValueError("Only non-interlaced PNGs with 8 bits per channel can be processed in strips.")
+            header.update(size=(width, height), color_type=color_type, mode=PNG_COLOR_TYPES[color_type][0])
+            header["row_bytes"] = width * PNG_COLOR_TYPES[color_type][1]
+        elif kind in (b"PLTE", b"tRNS"):
+            header["chunks"] += struct.pack(">I", length) + kind + data + crc
+    if "size" not in header:
+        raise ValueError("The PNG has no header.")
+    header["idat_length"] = length
+    return header
+
+
+def _idat_pieces(source, length):
+    # The compressed image data in pieces of at most READ_SIZE, across IDAT chunks.
+    while True:
+        while length:
+            piece = _read(source, min(length, READ_SIZE))
+            length -= len(piece)
+            yield piece
+        _read(source, 4)
+        length, kind = struct.unpack(">I4s", _read(source, 8))
+        if kind != b"IDAT":
+            return
+
+
+def _inflate(inflater, pieces, size):
+    data = bytearray()
+    while len(data) < size:
+        piece = inflater.unconsumed_tail or next(pieces, None)
+        if piece is None:
+            raise ValueError("The image file is truncated.")
+        data += inflater.decompress(piece, size - len(data))
+    return bytes(data)
+
+
+def _png_strips(source, header, strip_height):
+    # Inflates the rows of one strip at a time and lets Pillow unfilter them as a small PNG
+    # of their own. Rows can be filtered against the row above, so every strip after the
+    # first starts with the previous strip's last row, stored unfiltered, and drops it again.
+    width, height = header["size"]
+    pieces = _idat_pieces(source, header["idat_length"])
+    inflater = zlib.decompressobj()
+    previous = None
+    for top in range(0, height, strip_height):
+        rows = min(strip_height, height - top)
+        data = _inflate(inflater, pieces, rows * (header["row_bytes"] + 1))
+        if previous is not None:
+            data = b"\0" + previous + data
+        extra = previous is not None
+        strip_png = b"".join(
+            (
+                PNG_SIGNATURE,
+                _chunk(b"IHDR", struct.pack(">IIBBBBB", width, rows + extra, 8, header["color_type"], 0, 0, 0)),
+                header["chunks"],
+                _chunk(b"IDAT", zlib.compress(data, 0)),
+                _chunk(b"IEND", b""),
+            )
+        )
+        strip = Image.open(io.BytesIO(strip_png))
+        strip.load()
+        if extra:
+            strip = strip.crop((0, 1, width, rows + 1))
+        previous = strip.crop((0, rows - 1, width, rows)).tobytes()
+        yield strip
+
+
+def _pnm_header(source):
+    # Binary PGM/PPM: magic, width, height and maxval separated by whitespace or comments,
+    # then a single whitespace character before the raw rows.
+    magic = source.read(2)
+    if magic not in PNM_MODES:
+        raise ValueError("Only binary PGM and PPM files can be processed in strips.")
+    values, token = [], b""
+    while len(values) < 3:
+        char = _read(source, 1)
+        if char == b"#" and not token:
+            source.readline()
+        elif char.isspace():
+            if token:
+                values.append(int(token))
+                token = b""
+        else:
+            token += char
+    width, height, maxval = values
+    if maxval != 255:
+        raise ValueError("Only PGM and PPM files with 8 bits per channel can be processed in strips.")
+    mode, channels = PNM_MODES[magic]
+    return {"format": "pnm", "size": (width, height), "mode": mode, "row_bytes": width * channels}
+
+
+def _pnm_strips(source, header, strip_height):
+    width, height = header["size"]
+    for top in range(0, height, strip_height):
+        rows = min(strip_height, height - top)
+        yield Image.frombytes(header["mode"], (width, rows), _read(source, rows * header["row_bytes"]))
+
+
+def read_header(source):
+    # The size and mode of a PNG or PNM file that can be read in strips; ValueError otherwise.
+    # Only the header is read, so there is no decompression bomb limit to hit.
+    start = source.read(len(PNG_SIGNATURE))
+    if start == PNG_SIGNATURE:
+        header = _png_header(source)
+    else:
+        source.seek(-len(start), io.SEEK_CUR)
+        header = _pnm_header(source)
+    if not all(header["size"]):
+        raise ValueError("The image is empty.")
+    if header["size"][0] * header["size"][1] > settings.IMAGE_TILING["MAX_PIXELS"]:
+        raise ValueError("This image is too large to process, even in strips.")
+    return header
+
+
+def can_stream(path):
+    try:
+        with open(path, "rb") as source:
+            read_header(source)
+    except (OSError, ValueError, struct.error):
+        return False
+    return True
+
+
+def read_strips(source, header, strip_height):
+    strips = (_png_strips if header["format"] == "png" else _pnm_strips)(source, header, strip_height)
+    for strip in strips:
+        # Palettes and single-colour transparency become real channels, as in a full decode
+        # followed by any of the operations.
+        if strip.mode == "P" or "transparency" in strip.info:
+            strip = strip.convert("RGBA" if strip.has_transparency_data else "RGB")
+        yield strip
+
+
+class RowWindow:
+    # Serves row ranges of a stream of full-width strips. Ranges must not move backwards;
+    # rows above the last range's start are dropped, so only a window is ever held.
+    def __init__(self, strips):
+        self.strips = iter(strips)
+        self.buffer = None
+        self.top = self.bottom = 0
+
+    def rows(self, top, bottom):
+        while self.bottom < bottom:
+            strip = next(self.strips)
+            if self.buffer is None or self.bottom <= top:
+                self.buffer, self.top = strip, self.bottom
+            else:
+                keep = max(top, self.top)
+                merged = Image.new(strip.mode, (strip.width, self.bottom - keep + strip.height))
+                merged.paste(self.buffer, (0, self.top - keep))
+                merged.paste(strip, (0, self.bottom - keep))
+                self.buffer, self.top = merged, keep
+            self.bottom += strip.height
+        return self.buffer.crop((0, top - self.top, self.buffer.width, bottom - self.top))
+
+
+def _adjust_strips(strips, size, steps, strip_height):
+    # Each output strip is filtered together with enough rows above and below for every
+    # kernel in the chain, so strip edges come out as in a full-frame pass.
+    halo = adjustment_halo(steps)
+    if not halo:
+        for strip in strips:
+            yield apply_adjustments(strip, steps)
+        return
+
+    width, height = size
+    window = RowWindow(strips)
+    for top in range(0, height, strip_height):
+        bottom = min(height, top + strip_height)
+        start = max(0, top - halo)
+        result = apply_adjustments(window.rows(start, min(height, bottom + halo)), steps)
+        yield result.crop((0, top - start, width, bottom - start))
+
+
+def _resize_strips(strips, size, box, output_size, strip_height):
+    # LANCZOS in the same two passes as Image.resize: every strip is resampled horizontally
+    # on its own, then each band of output rows vertically from the rows it reaches. Alpha is
+    # premultiplied for both passes, as Image.resize does.
+    left, upper, right, lower = box
+    output_width, output_height = output_size
+
+    def horizontal():
+        for strip in strips:
+            if strip.mode in ("RGBA", "LA"):
+                strip = strip.convert(strip.mode[:-1] + "a")
+            if (left, right) != (0, size[0]) or output_width != size[0]:
+                strip = strip.resize((output_width, strip.height), Image.Resampling.LANCZOS, box=(left, 0, right, strip.height))
+            yield strip
+
+    scale = (lower - upper) / output_height
+    support = LANCZOS_SUPPORT * max(scale, 1.0)
+    step = max(1, int(strip_height / max(scale, 1.0)))
+    window = RowWindow(horizontal())
+    for top in range(0, output_height, step):
+        bottom = min(output_height, top + step)
+        start = max(0, math.floor(upper + top * scale - support) - 1)
+        end = min(size[1], math.ceil(upper + bottom * scale + support) + 1)
+        rows = window.rows(start, end)
+        strip = rows.resize(
+            (output_width, bottom - top),
+            Image.Resampling.LANCZOS,
+            box=(0, upper + top * scale - start, output_width, upper + bottom * scale - start),
+        )
+        if strip.mode in ("RGBa", "La"):
+            strip = strip.convert(strip.mode[:-1] + "A")
+        yield strip
+
+
+def _watermark_strips(strips, size, text, position, scale):
+    top = 0
+    for strip in strips:
+        yield apply_watermark(strip, text, position, scale, settings.WATERMARK_FONT, frame=(size, top))
+        top += strip.height
+
+
+def _convert_strips(strips, mode):
+    for strip in strips:
+        yield strip if strip.mode == mode else strip.convert(mode)
+
+
+class PNGStripWriter:
+    # Writes a PNG strip by strip. Pillow filters each strip (stored, not compressed) below
+    # the previous strip's last row, so its first row is filtered against its real
+    # neighbour; the filtered rows then go through one zlib stream for the whole image.
+    def __init__(self, destination, size, compress_level=6):
+        self.destination = destination
+        self.size = size
+        self.compressor = zlib.compressobj(compress_level)
+        self.previous = None
+        self.rows = 0
+        self.written = 0
+
+    def _write(self, data):
+        self.destination.write(data)
+        self.written += len(data)
+
+    def write(self, strip):
+        width, height = self.size
+        if self.previous is None:
+            if strip.mode not in PNG_MODES:
+                raise ValueError(f"Cannot write {strip.mode} images in strips.")
+            self._write(PNG_SIGNATURE + _chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, PNG_MODES[strip.mode], 0, 0, 0)))
+            image, skip = strip, 0
+        else:
+            image = Image.new(strip.mode, (width, strip.height + 1))
+            image.paste(self.previous, (0, 0))
+            image.paste(strip, (0, 1))
+            skip = 1
+
+        stored = encode_image(image, "png", compress_level=0)
+        filtered = zlib.decompress(b"".join(data for kind, data in _png_chunks(stored) if kind == b"IDAT"))
+        row_bytes = len(filtered) // image.height
+        compressed = self.compressor.compress(filtered[skip * row_bytes :])
+        if compressed:
+            self._write(_chunk(b"IDAT", compressed))
+        self.previous = strip.crop((0, strip.height - 1, width, strip.height))
+        self.rows += strip.height
+
+    def close(self):
+        if self.rows != self.size[1]:
+            raise ValueError(f"Wrote {self.rows} of {self.size[1]} rows.")
+        self._write(_chunk(b"IDAT", self.compressor.flush()) + _chunk(b"IEND", b""))
+        return self.written
+
+
+def strip_height_for(width):
+    return max(1, settings.IMAGE_TILING["STRIP_PIXELS"] // width)
+
+
+def estimate_tiled_memory(size, operations):
+    # The largest window of rows held at once: a strip plus the rows kernels and resampling
+    # reach above and below it, with room for a few working copies.
+    width, height = size
+    strip_height = strip_height_for(width)
+    reach = 0
+    for operation in plan_operations(operations):
+        if operation["op"] == "adjust":
+            reach = max(reach, adjustment_halo(operation["steps"]))
+        elif operation["op"] in {"resize", "crop"}:
+            scale = max(1.0, height / operation["height"])
+            reach = max(reach, strip_height * (scale - 1) + 2 * LANCZOS_SUPPORT * scale)
+            width, height = operation["width"], operation["height"]
+    return int(max(width, size[0]) * min(size[1], strip_height + 2 * reach) * 4 * 4)
+
+
+def run_tiled_pipeline(source, destination, operations):
+    # The pipeline for images too large to decode at once: source (a PNG or PNM file) is read
+    # one full-width strip at a time, every operation runs on strips, and the result is
+    # written to destination as a PNG while later strips are still being read. Memory grows
+    # with the image width, not its height.
+    header = read_header(source)
+    size = header["size"]
+    record(pixels=size[0] * size[1])
+    strip_height = strip_height_for(size[0])
+    strips = read_strips(source, header, strip_height)
+    compress_level = 6
+
+    for operation in plan_operations(operations):
+        op = operation["op"]
+        if op == "adjust":
+            strips = _adjust_strips(strips, size, operation["steps"], strip_height)
+        elif op in {"resize", "crop"}:
+            output_size = (operation["width"], operation["height"])
+            box = center_crop_box(size, output_size) if op == "crop" else (0, 0, *size)
+            strips = _resize_strips(strips, size, box, output_size, strip_height)
+            size = output_size
+            strip_height = strip_height_for(size[0])
+        elif op == "watermark":
+            strips = _watermark_strips(strips, size, operation["text"], operation["position"], operation["scale"])
+        elif op == "convert":
+            strips = _convert_strips(strips, operation["mode"])
+        elif op == "compress":
+            compress_level = compress_save_kwargs("png", operation["quality"])["compress_level"]
+
+    writer = PNGStripWriter(destination, size, compress_level)
+    with stage("transform"):
+        for strip in strips:
+            writer.write(strip)
+        return writer.close()
@@ -0,0 +1,38 @@
+import zipfile
+
+
+class _ZipStreamSink:
+    # Write-only sink without seek(), which makes zipfile emit a streamable archive.
+    def __init__(self):
+        self._chunks = []
+        self._offset = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._offset
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def stream_zip(entries):
+    # Entries are (name, bytes, compress_type) tuples; each one is yielded as soon as it is written.
+    sink = _ZipStreamSink()
+    with zipfile.ZipFile(sink, "w") as archive:
+        for name, data, compress_type in entries:
+            archive.writestr(name, data, compress_type=compress_type)
+            chunk = sink.drain()
+            if chunk:
+                yield chunk
+    chunk = sink.drain()
+    if chunk:
+        yield chunk
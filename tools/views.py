@@ -1,234 +1,659 @@
-import base64
-import io
 import hashlib
-import qrcode
+import io
+import json
+import os
+import shutil
+import time
+import uuid
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, wait
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotAllowed, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
-from PIL import Image, ImageDraw, ImageFilter, ImageFont, ImageOps
+from django.urls import reverse
+from django.utils.text import get_valid_filename
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
 from django.conf import settings
-from .utils.hash_utils import calculate_file_hash
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.cache import caches
+from PIL import Image
+from .jobs import JobUploadHandler, create_job, job_directory
+from .models import Job
+from .upload_handlers import HashingUploadHandler, HeaderUploadHandler, read_header_upload
+from .utils.admission import ImageTooLarge, get_memory_budget, inspect_image, submit_admitted
+from .utils.cache_utils import get_transform_cache
+from .utils.executor import ExecutorBusy, ExecutorTimeout, MappedFile, get_executor, get_hash_executor, run_transform_timed
+from .utils.hash_utils import ALL_ALGORITHMS, TREE_ALGORITHMS, calculate_file_hash, calculate_file_manifest, compare_files, hash_files
+from .utils.filter_utils import plan_adjustments, scale_adjustments, validate_adjustments
+from .utils.image_utils import FILTERS, WATERMARK_POSITIONS, fast_save_kwargs
+from .utils.inspect_utils import describe_image
+from .utils.metrics import merge, render_metrics, set_labels, stage
+from .utils.pipeline import (
+    adjust_image,
+    compress_image,
+    compress_to_size,
+    compress_to_size_data,
+    convert_image,
+    optimize_png_image,
+    plan_operations,
+    resize_image,
+    run_pipeline,
+    validate_operations,
+    watermark_image,
+)
+from .utils.qr_utils import ERROR_CORRECTION_LEVELS, QR_FORMATS, make_qr_png, parse_qr_list, qr_cache_stats, qr_etag, qr_zip_entries
+from .utils.result_utils import (
+    finish_pending_result,
+    load_pending_result,
+    result_response,
+    result_src,
+    serve_result,
+    start_pending_result,
+    store_result,
+    wants_image,
+)
+from .utils.srcset_utils import SRCSET_FORMATS, SRCSET_WIDTHS, srcset_archive, validate_srcset
+from .utils.zip_utils import stream_zip
+
+def _render(request, template_name, context, status=200):
+    with stage("render"):
+        return render(request, template_name, context, status=status)
+
 
 def home_view(request):
     return render(request, "tools/home.html")
 
 
-def qr_view(request):
-    qr_image = None
-    url_value = ""
-    error_message = None
+def _read_upload(uploaded_file):
+    if hasattr(uploaded_file, "data"):
+        return uploaded_file.data()
+    uploaded_file.seek(0)
+    return uploaded_file.read()
 
-    if request.method == "POST":
-        url_value = request.POST.get("url", "").strip()
-        if url_value:
-            qr = qrcode.QRCode(
-                version=1,
-                error_correction=qrcode.constants.ERROR_CORRECT_M,
-                box_size=10,
-                border=4,
-            )
-            qr.add_data(url_value)
-            qr.make(fit=True)
 
-            image = qr.make_image(fill_color="black", back_color="white")
-            buffer = io.BytesIO()
-            image.save(buffer, format="PNG")
-            qr_image = base64.b64encode(buffer.getvalue()).decode("ascii")
+def _image_job(image_file, operation, transform, params, download_name, result_field):
+    return {
+        "image_file": image_file,
+        "operation": operation,
+        "transform": transform,
+        "params": params,
+        "target_format": params["target_format"],
+        "download_name": download_name,
+        "result_field": result_field,
+    }
+
+
+def _download_name(prefix, target_format):
+    download_ext = "jpg" if target_format == "jpeg" else target_format
+    return f"{prefix}.{download_ext}"
+
+
+def _adjustment_passes(steps):
+    # A filter chain builds a new full-size image for every pass over the pixels, so each
+    # pass counts as an operation; fused point steps and merged blurs share one.
+    return [{"op": "adjust"} for _ in plan_adjustments(steps)]
+
+
+def _job_operations(job):
+    # The pipeline operations a job runs, for estimating its peak memory before it is decoded.
+    params = job["params"]
+    if job["operation"] == "pipeline":
+        operations = []
+        for operation in plan_operations(params["operations"]):
+            operations += _adjustment_passes(operation["steps"]) if operation["op"] == "adjust" else [operation]
+        return operations
+    if job["operation"] == "resize":
+        return [{"op": "crop" if params["mode"] == "crop" else "resize", "width": params["width"], "height": params["height"]}]
+    if job["operation"] == "filter":
+        return _adjustment_passes(params["steps"])
+    if job["operation"] == "watermark":
+        return [{"op": "watermark"}]
+    if job["operation"] in {"png_optimize", "srcset"}:
+        return [{"op": job["operation"]}]
+    return []
+
+
+def _submit_image_job(executor, job, data, blocking=True):
+    return submit_admitted(executor, run_transform_timed, data, _job_operations(job), job["transform"], data, job["params"], blocking=blocking)
+
+
+def _job_result(executor, job):
+    data, stats = executor.result(_submit_image_job(executor, job, _read_upload(job["image_file"])))
+    merge(stats)
+    return data
+
+
+def _cached_transform(job):
+    cache = get_transform_cache()
+    executor = get_executor()
+    key = cache.make_key(job["image_file"], job["operation"], job["params"])
+    set_labels(format=job["target_format"])
+    return cache.get_or_compute(key, lambda: _job_result(executor, job))
+
+
+def _image_error(error):
+    # The message and status code shown for a failed image job.
+    if isinstance(error, ImageTooLarge):
+        return "This image is too large to process. Please upload a smaller image.", 413
+    if isinstance(error, ExecutorBusy):
+        return "The server is busy processing other images. Please try again in a moment.", 503
+    if isinstance(error, ExecutorTimeout):
+        return "Processing took too long. Please try a smaller image.", 504
+    return "Could not process the uploaded image. Please try another file.", 200
+
+
+def _render_image_tool(request, template_name, context, job, data=None, error=None):
+    status = 200
+
+    if error is not None:
+        context["error_message"], status = _image_error(error)
+    elif job is not None:
+        target_format = job["target_format"]
+        download_name = job["download_name"]
+        with stage("response"):
+            if wants_image(request, target_format):
+                return result_response(data, target_format, download_name)
+            context["download_name"] = download_name
+            context[job["result_field"]] = result_src(request, data, target_format, download_name)
+
+    return _render(request, template_name, context, status=status)
+
+
+# Tools whose pages can show a quick preview first while the full-quality encode runs on.
+PREVIEW_OPERATIONS = {"watermark", "filter", "resize"}
+
+
+def _wants_preview(request, context, job):
+    context["preview"] = request.POST.get("preview") == "1"
+    return (
+        context["preview"]
+        and job is not None
+        and job["operation"] in PREVIEW_OPERATIONS
+        and not wants_image(request, job["target_format"])
+    )
+
+
+def _preview_job(job, image_size):
+    # The same transform on a copy scaled to fit IMAGE_PREVIEW["MAX_SIZE"]; the leading resize
+    # lets JPEG sources decode at reduced size.
+    params = job["params"]
+    max_size = settings.IMAGE_PREVIEW["MAX_SIZE"]
+    if job["operation"] == "resize":
+        width, height = params["width"], params["height"]
+        scale = min(1.0, max_size / max(width, height))
+        operations = [{"op": "crop" if params["mode"] == "crop" else "resize", "width": width, "height": height}]
+    else:
+        width, height = image_size
+        scale = min(1.0, max_size / max(width, height))
+        operations = [{"op": "resize", "width": width, "height": height}]
+        if job["operation"] == "watermark":
+            operations.append({"op": "watermark", "text": params["watermark_text"], "position": params["position"], "scale": params["scale"]})
         else:
-            error_message = "Please enter a URL before generating a QR code."
+            operations.append({"op": "adjust", "steps": scale_adjustments(params["steps"], scale)})
+    operations[0].update(width=max(1, round(width * scale)), height=max(1, round(height * scale)))
+    if scale == 1.0 and job["operation"] != "resize":
+        operations.pop(0)
+
+    return _image_job(
+        job["image_file"],
+        "pipeline",
+        run_pipeline,
+        {
+            "target_format": "webp",
+            "operations": operations,
+            "save_kwargs": fast_save_kwargs("webp", settings.IMAGE_PREVIEW["QUALITY"]),
+        },
+        job["download_name"],
+        job["result_field"],
+    )
+
+
+def _detached_upload(uploaded_file):
+    if hasattr(uploaded_file, "detached_data"):
+        return uploaded_file.detached_data()
+    return _read_upload(uploaded_file)
+
+
+def _start_background_result(executor, job, key):
+    # Submits the full-quality job without waiting for it, or for memory to free up: when the
+    # budget cannot take it right now this raises ExecutorBusy. When it finishes, the result
+    # goes into the transform cache and the result store, and its token's status turns "done".
+    data = _detached_upload(job["image_file"])
+    try:
+        future = _submit_image_job(executor, job, data, blocking=False)
+    except BaseException:
+        if isinstance(data, MappedFile):
+            os.remove(data.path)
+        raise
+    token = start_pending_result(job["download_name"])
+
+    def finish(future):
+        if isinstance(data, MappedFile):
+            os.remove(data.path)
+        try:
+            result, _ = future.result()
+        except Exception as exc:
+            finish_pending_result(token, job["download_name"], error=_image_error(exc)[0])
+            return
+        get_transform_cache().set(key, result)
+        finish_pending_result(token, job["download_name"], key=store_result(result, job["target_format"], job["download_name"]))
+
+    future.add_done_callback(finish)
+    return token
+
+
+def _preview_response(request, template_name, context, job):
+    cache = get_transform_cache()
+    key = cache.make_key(job["image_file"], job["operation"], job["params"])
+    set_labels(format=job["target_format"])
+    data = cache.get(key)
+    if data is not None:
+        return _render_image_tool(request, template_name, context, job, data)
+
+    executor = get_executor()
+    try:
+        source = _read_upload(job["image_file"])
+        size, _, _ = inspect_image(source)
+        preview_job = _preview_job(job, size)
+        # The preview is queued first so a busy pool still starts it before the full encode.
+        preview_future = _submit_image_job(executor, preview_job, source)
+        try:
+            token = _start_background_result(executor, job, key)
+        except ExecutorBusy:
+            # Waiting here for the full job's memory would hold up the preview too, so the
+            # request falls back to the ordinary synchronous result.
+            preview_future.cancel()
+            return _image_tool_response(request, template_name, context, job, preview=False)
+        preview, stats = executor.result(preview_future)
+        merge(stats)
+    except Exception as exc:
+        return _render_image_tool(request, template_name, context, job, error=exc)
+
+    context["pending_result"] = reverse("tools:result_status", args=[token])
+    return _render_image_tool(request, template_name, context, preview_job, preview)
+
+
+def _single_image(request, context, job):
+    # The tool pages handle one upload; a multi-file selection belongs to the batch ZIP action,
+    # so it is refused here rather than silently keeping only one of the files.
+    if job is not None and len(request.FILES.getlist("image_file")) > 1:
+        context["error_message"] = 'Several files were selected. Use "Process all selected files as ZIP" for more than one.'
+        return context, None
+    return context, job
+
+
+def _image_tool_response(request, template_name, context, job, preview=True):
+    if preview and _wants_preview(request, context, job):
+        return _preview_response(request, template_name, context, job)
+
+    data = error = None
+    if job is not None:
+        try:
+            data = _cached_transform(job)
+        except Exception as exc:
+            error = exc
+    return _render_image_tool(request, template_name, context, job, data, error)
+
 
+def _qr_form(request):
     context = {
-        "qr_image": qr_image,
-        "url_value": url_value,
-        "error_message": error_message,
+        "qr_image": None,
+        "url_value": "",
+        "error_message": None,
     }
-    return render(request, "tools/qr.html", context)
 
+    # The form posts; GET /qr/?url=... gives API clients a cacheable, conditional request.
+    values = request.POST if request.method == "POST" else request.GET
+    if request.method == "POST" or "url" in values:
+        context["url_value"] = values.get("url", "").strip()
+        if not context["url_value"]:
+            context["error_message"] = "Please enter a URL before generating a QR code."
 
-def image_convert_view(request):
+    return context
+
+
+def _qr_requested(context):
+    return bool(context["url_value"]) and not context["error_message"]
+
+
+def _qr_not_modified(request, context):
+    # API clients that already hold the PNG get a 304 without the code being encoded again.
+    # Only GET and HEAD are conditional; a POST always gets the code.
+    if request.method not in ("GET", "HEAD") or not _qr_requested(context) or not wants_image(request, "png"):
+        return None
+
+    etag = qr_etag(context["url_value"])
+    if request.headers.get("If-None-Match", "").strip('"') != etag:
+        return None
+
+    response = HttpResponseNotModified()
+    response["ETag"] = f'"{etag}"'
+    return response
+
+
+def _render_qr(request, context, data=None):
+    if data is not None:
+        with stage("response"):
+            if wants_image(request, "png"):
+                return result_response(data, "png", "qr-code.png", etag=qr_etag(context["url_value"]))
+            context["qr_image"] = result_src(request, data, "png", "qr-code.png")
+    return _render(request, "tools/qr.html", context)
+
+
+def qr_view(request):
+    context = _qr_form(request)
+    not_modified = _qr_not_modified(request, context)
+    if not_modified is not None:
+        return not_modified
+
+    data = None
+    if _qr_requested(context):
+        set_labels(format="png")
+        with stage("encode"):
+            data = make_qr_png(context["url_value"])
+    return _render_qr(request, context, data)
+
+
+def _qr_bulk_form(request):
+    # Returns (values, options, error_message); the list comes from the "urls" field or an uploaded CSV/text file.
+    upload = request.FILES.get("file")
+    if upload is not None:
+        text = _read_upload(upload).decode("utf-8-sig", errors="replace")
+    else:
+        text = request.POST.get("urls", "")
+    values = parse_qr_list(text)
+
+    target_format = request.POST.get("format", "png").lower()
+    error_correction = request.POST.get("error_correction", "M").upper()
+    mask = request.POST.get("mask", "auto")
+
+    if not values:
+        return values, None, "Please provide at least one URL."
+    if len(values) > settings.QR_BULK_MAX_CODES:
+        return values, None, f"At most {settings.QR_BULK_MAX_CODES} codes can be generated per request."
+    if target_format not in QR_FORMATS:
+        return values, None, "Unsupported format requested."
+    if error_correction not in ERROR_CORRECTION_LEVELS:
+        return values, None, "Unsupported error correction level."
+    if mask != "auto" and mask not in {str(pattern) for pattern in range(8)}:
+        return values, None, "Mask must be auto or a number from 0 to 7."
+
+    options = {
+        "target_format": target_format,
+        "error_correction": error_correction,
+        "mask_pattern": None if mask == "auto" else int(mask),
+    }
+    return values, options, None
+
+
+def qr_bulk_view(request):
+    if request.method != "POST":
+        return HttpResponseNotAllowed(["POST"])
+
+    values, options, error_message = _qr_bulk_form(request)
+    if error_message:
+        return JsonResponse({"error": error_message}, status=400)
+    set_labels(format=options["target_format"])
+
+    response = StreamingHttpResponse(stream_zip(qr_zip_entries(values, get_executor(), **options)), content_type="application/zip")
+    response["Content-Disposition"] = f'attachment; filename="qr-codes-{options["target_format"]}.zip"'
+    return response
+
+
+def _image_convert_form(request):
     allowed_formats = {"png", "jpeg", "webp"}
-    converted_image = None
-    target_format = "png"
-    download_name = "converted.png"
-    error_message = None
+    context = {
+        "converted_image": None,
+        "target_format": "png",
+        "download_name": "converted.png",
+        "error_message": None,
+    }
+    job = None
 
     if request.method == "POST":
         target_format = request.POST.get("target_format", "png").lower()
         image_file = request.FILES.get("image_file")
+        context["target_format"] = target_format
 
         if target_format not in allowed_formats:
-            error_message = "Unsupported format requested."
+            context["error_message"] = "Unsupported format requested."
         elif not image_file:
-            error_message = "Please upload an image file."
+            context["error_message"] = "Please upload an image file."
         else:
-            try:
-                image = Image.open(image_file)
-                if target_format == "jpeg" and image.mode in ("RGBA", "P"):
-                    image = image.convert("RGB")
-
-                buffer = io.BytesIO()
-                image.save(buffer, format=target_format.upper())
-                converted_image = base64.b64encode(buffer.getvalue()).decode("ascii")
-                download_ext = "jpg" if target_format == "jpeg" else target_format
-                download_name = f"converted.{download_ext}"
-            except Exception:
-                error_message = "Could not process the uploaded image. Please try another file."
+            job = _image_job(
+                image_file,
+                "convert",
+                convert_image,
+                {"target_format": target_format},
+                _download_name("converted", target_format),
+                "converted_image",
+            )
 
-    context = {
-        "converted_image": converted_image,
-        "target_format": target_format,
-        "download_name": download_name,
-        "error_message": error_message,
-    }
-    return render(request, "tools/image_convert.html", context)
+    return context, job
 
 
-def image_compress_view(request):
+def image_convert_view(request):
+    context, job = _single_image(request, *_image_convert_form(request))
+    return _image_tool_response(request, "tools/image_convert.html", context, job)
+
+
+def _image_compress_form(request):
     allowed_formats = {"jpeg", "webp", "png"}
-    compressed_image = None
-    target_format = "jpeg"
-    quality = 80
-    download_name = "compressed.jpg"
-    error_message = None
+    context = {
+        "compressed_image": None,
+        "target_format": "jpeg",
+        "compress_mode": "quality",
+        "quality": 80,
+        "target_kb": None,
+        "palette_colors": 0,
+        "dither": True,
+        "compress_report": None,
+        "download_name": "compressed.jpg",
+        "error_message": None,
+    }
+    job = None
 
     if request.method == "POST":
         target_format = request.POST.get("target_format", "jpeg").lower()
+        compress_mode = request.POST.get("compress_mode", "quality")
         image_file = request.FILES.get("image_file")
         try:
             quality = int(request.POST.get("quality", 80))
         except (TypeError, ValueError):
             quality = 80
+        try:
+            target_kb = int(request.POST.get("target_kb", "0"))
+        except (TypeError, ValueError):
+            target_kb = 0
+        try:
+            palette_colors = int(request.POST.get("palette_colors", "0"))
+        except (TypeError, ValueError):
+            palette_colors = 0
+        dither = request.POST.get("dither", "1") in {"1", "on", "true"}
 
         quality = max(10, min(95, quality))
+        context.update(
+            {
+                "target_format": target_format,
+                "compress_mode": compress_mode,
+                "quality": quality,
+                "target_kb": target_kb,
+                "palette_colors": palette_colors,
+                "dither": dither,
+            }
+        )
 
         if target_format not in allowed_formats:
-            error_message = "Unsupported format requested."
+            context["error_message"] = "Unsupported format requested."
+        elif compress_mode not in {"quality", "target", "optimize"}:
+            context["error_message"] = "Unsupported compression mode requested."
         elif not image_file:
-            error_message = "Please upload an image file."
+            context["error_message"] = "Please upload an image file."
+        elif compress_mode == "target" and target_kb <= 0:
+            context["error_message"] = "Target size must be a positive number of KB."
+        elif compress_mode == "optimize" and target_format != "png":
+            context["error_message"] = "The PNG optimizer only produces PNG files."
+        elif compress_mode == "optimize" and palette_colors and not 2 <= palette_colors <= 256:
+            context["error_message"] = "Palette colors must be between 2 and 256."
+        elif compress_mode == "optimize":
+            job = _image_job(
+                image_file,
+                "png_optimize",
+                optimize_png_image,
+                {
+                    "target_format": "png",
+                    "colors": palette_colors or None,
+                    "dither": dither,
+                    "time_budget": settings.PNG_OPTIMIZE_TIME_BUDGET,
+                },
+                "compressed.png",
+                "compressed_image",
+            )
+        elif compress_mode == "target":
+            job = _image_job(
+                image_file,
+                "compress_target",
+                compress_to_size_data,
+                {"target_format": target_format, "target_bytes": target_kb * 1024},
+                _download_name("compressed", target_format),
+                "compressed_image",
+            )
         else:
-            try:
-                image = Image.open(image_file)
-                if target_format == "jpeg" and image.mode in ("RGBA", "P"):
-                    image = image.convert("RGB")
+            job = _image_job(
+                image_file,
+                "compress",
+                compress_image,
+                {"target_format": target_format, "quality": quality},
+                _download_name("compressed", target_format),
+                "compressed_image",
+            )
 
-                buffer = io.BytesIO()
-                save_kwargs = {"format": target_format.upper()}
+    return context, job
 
-                if target_format in {"jpeg", "webp"}:
-                    save_kwargs.update({"quality": quality, "optimize": True})
-                    if target_format == "webp":
-                        save_kwargs["method"] = 6
-                else:
-                    save_kwargs.update(
-                        {
-                            "optimize": True,
-                            "compress_level": max(0, min(9, int((100 - quality) / 10))),
-                        }
-                    )
-
-                image.save(buffer, **save_kwargs)
-                compressed_image = base64.b64encode(buffer.getvalue()).decode("ascii")
-                download_ext = "jpg" if target_format == "jpeg" else target_format
-                download_name = f"compressed.{download_ext}"
-            except Exception:
-                error_message = "Could not process the uploaded image. Please try another file."
 
-    context = {
-        "compressed_image": compressed_image,
-        "target_format": target_format,
-        "quality": quality,
-        "download_name": download_name,
-        "error_message": error_message,
-    }
-    return render(request, "tools/image_compress.html", context)
+def _compress_curve_key(job):
+    digest = calculate_file_hash(job["image_file"], "sha256")
+    return f"tools:compress-curve:{digest}:{job['target_format']}"
 
 
-def image_watermark_view(request):
+def _submit_target_size_job(executor, job):
+    # Probe sizes from earlier searches on the same image and format are reused, so trying
+    # another target size usually costs only the final encode.
+    data = _read_upload(job["image_file"])
+    params = {**job["params"], "curve": caches[settings.RESULT_CACHE_ALIAS].get(_compress_curve_key(job))}
+    return submit_admitted(executor, run_transform_timed, data, [{"op": "compress_target"}], compress_to_size, data, params)
+
+
+def _finish_target_size_job(job, result, stats):
+    merge(stats)
+    caches[settings.RESULT_CACHE_ALIAS].set(_compress_curve_key(job), result.pop("curve"), settings.RESULT_CACHE_TIMEOUT)
+    result["size"] = len(result["data"])
+    return result
+
+
+def _render_target_size(request, context, job, result=None, error=None):
+    data = None
+    if result is not None:
+        data = result.pop("data")
+        context["compress_report"] = result
+    response = _render_image_tool(request, "tools/image_compress.html", context, job, data, error)
+    if result is not None:
+        response["X-Compress-Quality"] = result["quality"] or "lossless"
+        response["X-Compress-Scale"] = f"{result['scale']:.4f}"
+        response["X-Compress-Attempts"] = result["attempts"]
+        response["X-Compress-Fits"] = "1" if result["fits"] else "0"
+    return response
+
+
+def image_compress_view(request):
+    context, job = _single_image(request, *_image_compress_form(request))
+    if job is None or job["operation"] != "compress_target":
+        return _image_tool_response(request, "tools/image_compress.html", context, job)
+
+    set_labels(format=job["target_format"])
+    executor = get_executor()
+    try:
+        result = _finish_target_size_job(job, *executor.result(_submit_target_size_job(executor, job)))
+    except Exception as exc:
+        return _render_target_size(request, context, job, error=exc)
+    return _render_target_size(request, context, job, result)
+
+
+def _image_watermark_form(request):
     allowed_formats = {"png", "jpeg", "webp"}
-    watermarked_image = None
-    target_format = "png"
-    position = "bottom_right"
-    watermark_text = "© ToolsApp"
-    download_name = "watermarked.png"
-    error_message = None
+    context = {
+        "watermarked_image": None,
+        "target_format": "png",
+        "position": "bottom_right",
+        "watermark_text": "© ToolsApp",
+        "text_size": 3,
+        "download_name": "watermarked.png",
+        "error_message": None,
+    }
+    job = None
 
     if request.method == "POST":
         image_file = request.FILES.get("image_file")
         watermark_text = request.POST.get("watermark_text", "").strip()
         position = request.POST.get("position", "bottom_right")
         target_format = request.POST.get("target_format", "png").lower()
+        try:
+            text_size = float(request.POST.get("text_size", 3))
+        except (TypeError, ValueError):
+            text_size = 3
+        # Percent of the image's shorter side.
+        text_size = max(1, min(20, text_size))
+        context.update(
+            {
+                "watermark_text": watermark_text,
+                "position": position,
+                "target_format": target_format,
+                "text_size": text_size,
+            }
+        )
 
         if target_format not in allowed_formats:
-            error_message = "Unsupported format requested."
+            context["error_message"] = "Unsupported format requested."
+        elif position not in WATERMARK_POSITIONS:
+            context["error_message"] = "Unsupported watermark position."
         elif not image_file:
-            error_message = "Please upload an image file."
+            context["error_message"] = "Please upload an image file."
         elif not watermark_text:
-            error_message = "Please enter watermark text."
+            context["error_message"] = "Please enter watermark text."
         else:
-            try:
-                base_image = Image.open(image_file).convert("RGBA")
-                text_layer = Image.new("RGBA", base_image.size, (255, 255, 255, 0))
-                draw = ImageDraw.Draw(text_layer)
-                font = ImageFont.load_default()
-
-                text_width, text_height = draw.textsize(watermark_text, font=font)
-                padding = 12
-
-                if position == "top_left":
-                    coords = (padding, padding)
-                elif position == "top_right":
-                    coords = (base_image.width - text_width - padding, padding)
-                elif position == "bottom_left":
-                    coords = (padding, base_image.height - text_height - padding)
-                elif position == "center":
-                    coords = ((base_image.width - text_width) / 2, (base_image.height - text_height) / 2)
-                else:
-                    coords = (base_image.width - text_width - padding, base_image.height - text_height - padding)
-
-                shadow_offset = (1, 1)
-                shadow_color = (0, 0, 0, 120)
-                text_color = (255, 255, 255, 200)
+            job = _image_job(
+                image_file,
+                "watermark",
+                watermark_image,
+                {
+                    "target_format": target_format,
+                    "watermark_text": watermark_text,
+                    "position": position,
+                    "scale": text_size / 100,
+                },
+                _download_name("watermarked", target_format),
+                "watermarked_image",
+            )
 
-                draw.text((coords[0] + shadow_offset[0], coords[1] + shadow_offset[1]), watermark_text, font=font, fill=shadow_color)
-                draw.text(coords, watermark_text, font=font, fill=text_color)
+    return context, job
 
-                combined = Image.alpha_composite(base_image, text_layer)
 
-                if target_format == "jpeg" and combined.mode in ("RGBA", "P"):
-                    combined = combined.convert("RGB")
+def image_watermark_view(request):
+    context, job = _single_image(request, *_image_watermark_form(request))
+    return _image_tool_response(request, "tools/image_watermark.html", context, job)
 
-                buffer = io.BytesIO()
-                save_kwargs = {"format": target_format.upper()}
-                if target_format in {"jpeg", "webp"}:
-                    save_kwargs.update({"quality": 90, "optimize": True})
-                    if target_format == "webp":
-                        save_kwargs["method"] = 6
-                combined.save(buffer, **save_kwargs)
-
-                watermarked_image = base64.b64encode(buffer.getvalue()).decode("ascii")
-                download_ext = "jpg" if target_format == "jpeg" else target_format
-                download_name = f"watermarked.{download_ext}"
-            except Exception:
-                error_message = "Could not process the uploaded image. Please try another file."
 
+def _image_resize_form(request):
+    allowed_formats = {"png", "jpeg", "webp"}
     context = {
-        "watermarked_image": watermarked_image,
-        "target_format": target_format,
-        "position": position,
-        "watermark_text": watermark_text,
-        "download_name": download_name,
-        "error_message": error_message,
+        "processed_image": None,
+        "target_format": "png",
+        "mode": "resize",
+        "width": None,
+        "height": None,
+        "download_name": "resized.png",
+        "error_message": None,
     }
-    return render(request, "tools/image_watermark.html", context)
-
-
-def image_resize_view(request):
-    allowed_formats = {"png", "jpeg", "webp"}
-    processed_image = None
-    target_format = "png"
-    mode = "resize"
-    width = None
-    height = None
-    download_name = "resized.png"
-    error_message = None
+    job = None
 
     if request.method == "POST":
         target_format = request.POST.get("target_format", "png").lower()
@@ -241,134 +666,416 @@ def image_resize_view(request):
         except (TypeError, ValueError):
             width = height = 0
 
+        context.update(
+            {
+                "target_format": target_format,
+                "mode": mode,
+                "width": width,
+                "height": height,
+            }
+        )
+
         if target_format not in allowed_formats:
-            error_message = "Unsupported format requested."
+            context["error_message"] = "Unsupported format requested."
         elif not image_file:
-            error_message = "Please upload an image file."
+            context["error_message"] = "Please upload an image file."
         elif width <= 0 or height <= 0:
-            error_message = "Width and height must be positive numbers."
+            context["error_message"] = "Width and height must be positive numbers."
         else:
-            try:
-                image = Image.open(image_file)
-                if mode == "crop":
-                    image = ImageOps.fit(
-                        image,
-                        (width, height),
-                        method=Image.Resampling.LANCZOS,
-                        centering=(0.5, 0.5),
-                    )
-                else:
-                    image = image.resize((width, height), Image.Resampling.LANCZOS)
-
-                if target_format == "jpeg" and image.mode in ("RGBA", "P"):
-                    image = image.convert("RGB")
-
-                buffer = io.BytesIO()
-                save_kwargs = {"format": target_format.upper()}
-                if target_format in {"jpeg", "webp"}:
-                    save_kwargs.update({"quality": 90, "optimize": True})
-                    if target_format == "webp":
-                        save_kwargs["method"] = 6
-                image.save(buffer, **save_kwargs)
-
-                processed_image = base64.b64encode(buffer.getvalue()).decode("ascii")
-                download_ext = "jpg" if target_format == "jpeg" else target_format
-                download_name = f"processed.{download_ext}"
-            except Exception:
-                error_message = "Could not process the uploaded image. Please try another file."
+            job = _image_job(
+                image_file,
+                "resize",
+                resize_image,
+                {
+                    "target_format": target_format,
+                    "mode": mode,
+                    "width": width,
+                    "height": height,
+                },
+                _download_name("processed", target_format),
+                "processed_image",
+            )
 
-    context = {
-        "processed_image": processed_image,
-        "target_format": target_format,
-        "mode": mode,
-        "width": width,
-        "height": height,
-        "download_name": download_name,
-        "error_message": error_message,
-    }
-    return render(request, "tools/image_resize.html", context)
+    return context, job
 
 
-def image_filters_view(request):
+def image_resize_view(request):
+    context, job = _single_image(request, *_image_resize_form(request))
+    return _image_tool_response(request, "tools/image_resize.html", context, job)
+
+
+def _srcset_name(uploaded_name):
+    # File names in the archive and the <picture> snippet start with the upload's stem.
+    stem = os.path.splitext(os.path.basename(uploaded_name))[0]
+    try:
+        return get_valid_filename(stem)
+    except SuspiciousFileOperation:
+        return "image"
+
+
+def image_srcset_view(request):
+    # Every width x format of a responsive image set from one upload, as a ZIP with a
+    # <picture> snippet and a manifest; API clients asking for JSON get the manifest and a
+    # link to the ZIP instead.
+    if request.method != "POST":
+        return HttpResponseNotAllowed(["POST"])
+
+    image_file = request.FILES.get("image_file")
+    formats = request.POST.getlist("formats") or list(SRCSET_FORMATS)
+    try:
+        widths = [int(width) for width in request.POST.get("widths", "").split(",") if width.strip()]
+        quality = int(request.POST.get("quality", "80"))
+    except ValueError:
+        return JsonResponse({"error": "Widths and quality must be whole numbers."}, status=400)
+
+    try:
+        widths, formats = validate_srcset(widths or list(SRCSET_WIDTHS), [fmt.lower() for fmt in formats])
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    if not 1 <= quality <= 100:
+        return JsonResponse({"error": "Quality must be between 1 and 100."}, status=400)
+    if not image_file:
+        return JsonResponse({"error": "Please upload an image file."}, status=400)
+
+    name = _srcset_name(image_file.name)
+    job = _image_job(
+        image_file,
+        "srcset",
+        srcset_archive,
+        {"target_format": "zip", "widths": widths, "formats": formats, "quality": quality, "name": name},
+        f"{name}-srcset.zip",
+        "result",
+    )
+    try:
+        data = _cached_transform(job)
+    except ImageTooLarge:
+        return JsonResponse({"error": "This image is too large to process."}, status=413)
+    except ExecutorBusy:
+        return JsonResponse({"error": "The server is busy processing other images."}, status=503)
+    except ExecutorTimeout:
+        return JsonResponse({"error": "Processing took too long."}, status=504)
+    except Exception:
+        return JsonResponse({"error": "Could not process the uploaded image."}, status=422)
+
+    with stage("response"):
+        if request.get_preferred_type(["application/zip", "application/json"]) != "application/json":
+            response = result_response(data, "zip", job["download_name"])
+            response["Content-Disposition"] = f'attachment; filename="{job["download_name"]}"'
+            return response
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            manifest = json.loads(archive.read("manifest.json"))
+        return JsonResponse({"result": result_src(request, data, "zip", job["download_name"]), "bytes": len(data), **manifest})
+
+
+FILTER_LABELS = [
+    ("original", "Original"),
+    ("blur", "Blur"),
+    ("contour", "Contour"),
+    ("detail", "Detail"),
+    ("edge_enhance", "Edge Enhance"),
+    ("emboss", "Emboss"),
+    ("find_edges", "Find Edges"),
+    ("sharpen", "Sharpen"),
+    ("smooth", "Smooth"),
+    ("grayscale", "Grayscale"),
+    ("invert", "Invert"),
+    ("solarize", "Solarize"),
+    ("posterize", "Posterize"),
+]
+
+
+# The filters page's adjustment fields: name -> (default, minimum, maximum).
+ADJUSTMENT_FIELDS = {
+    "levels_black": (0, 0, 254),
+    "levels_white": (255, 1, 255),
+    "brightness": (100, 0, 400),
+    "contrast": (100, 0, 400),
+    "saturation": (100, 0, 400),
+    "gamma": (1.0, 0.1, 10.0),
+    "blur_radius": (0.0, 0.0, 50.0),
+    "unsharp_percent": (0, 0, 500),
+}
+
+
+def _filter_adjustments(post, filter_name):
+    # The page's fields as one adjustment chain: tone first, then the named filter, then blur
+    # and sharpening. Fields left at their defaults add no step.
+    values = {}
+    for name, (default, minimum, maximum) in ADJUSTMENT_FIELDS.items():
+        try:
+            value = float(post.get(name) or default)
+        except ValueError:
+            raise ValueError(f"{name.replace('_', ' ').capitalize()} must be a number.")
+        if not minimum <= value <= maximum:
+            raise ValueError(f"{name.replace('_', ' ').capitalize()} must be between {minimum} and {maximum}.")
+        values[name] = round(value) if isinstance(default, int) else value
+
+    steps = []
+    if values["levels_black"] != 0 or values["levels_white"] != 255:
+        steps.append({"name": "levels", "black": values["levels_black"], "white": values["levels_white"]})
+    for name in ("brightness", "contrast"):
+        if values[name] != 100:
+            steps.append({"name": name, "amount": values[name] / 100})
+    if values["gamma"] != 1:
+        steps.append({"name": "gamma", "amount": values["gamma"]})
+    if values["saturation"] != 100:
+        steps.append({"name": "saturation", "amount": values["saturation"] / 100})
+    if filter_name != "original":
+        steps.append({"name": filter_name})
+    if values["blur_radius"]:
+        steps.append({"name": "gaussian_blur", "radius": values["blur_radius"]})
+    if values["unsharp_percent"]:
+        steps.append({"name": "unsharp_mask", "percent": values["unsharp_percent"]})
+    return values, validate_adjustments(steps)
+
+
+def _image_filters_form(request):
     allowed_formats = {"png", "jpeg", "webp"}
-    filter_map = {
-        "original": lambda img: img,
-        "blur": lambda img: img.filter(ImageFilter.BLUR),
-        "contour": lambda img: img.filter(ImageFilter.CONTOUR),
-        "detail": lambda img: img.filter(ImageFilter.DETAIL),
-        "edge_enhance": lambda img: img.filter(ImageFilter.EDGE_ENHANCE_MORE),
-        "emboss": lambda img: img.filter(ImageFilter.EMBOSS),
-        "find_edges": lambda img: img.filter(ImageFilter.FIND_EDGES),
-        "sharpen": lambda img: img.filter(ImageFilter.SHARPEN),
-        "smooth": lambda img: img.filter(ImageFilter.SMOOTH_MORE),
-        "grayscale": lambda img: ImageOps.grayscale(img),
-        "invert": lambda img: ImageOps.invert(img.convert("RGB")),
-        "solarize": lambda img: ImageOps.solarize(img.convert("RGB"), threshold=128),
-        "posterize": lambda img: ImageOps.posterize(img.convert("RGB"), bits=4),
+    context = {
+        "filtered_image": None,
+        "filter_name": "original",
+        "filter_options": FILTER_LABELS,
+        "adjustments": {name: default for name, (default, _, _) in ADJUSTMENT_FIELDS.items()},
+        "target_format": "png",
+        "download_name": "filtered.png",
+        "error_message": None,
     }
-    filter_labels = [
-        ("original", "Original"),
-        ("blur", "Blur"),
-        ("contour", "Contour"),
-        ("detail", "Detail"),
-        ("edge_enhance", "Edge Enhance"),
-        ("emboss", "Emboss"),
-        ("find_edges", "Find Edges"),
-        ("sharpen", "Sharpen"),
-        ("smooth", "Smooth"),
-        ("grayscale", "Grayscale"),
-        ("invert", "Invert"),
-        ("solarize", "Solarize"),
-        ("posterize", "Posterize"),
-    ]
-
-    filtered_image = None
-    filter_name = "original"
-    target_format = "png"
-    download_name = "filtered.png"
-    error_message = None
+    job = None
 
     if request.method == "POST":
         target_format = request.POST.get("target_format", "png").lower()
         filter_name = request.POST.get("filter_name", "original")
         image_file = request.FILES.get("image_file")
+        context.update({"target_format": target_format, "filter_name": filter_name})
 
         if target_format not in allowed_formats:
-            error_message = "Unsupported format requested."
+            context["error_message"] = "Unsupported format requested."
         elif not image_file:
-            error_message = "Please upload an image file."
-        elif filter_name not in filter_map:
-            error_message = "Unknown filter selected."
+            context["error_message"] = "Please upload an image file."
+        elif filter_name not in FILTERS:
+            context["error_message"] = "Unknown filter selected."
+        else:
+            try:
+                context["adjustments"], steps = _filter_adjustments(request.POST, filter_name)
+            except ValueError as e:
+                context["error_message"] = str(e)
+            else:
+                # The whole chain runs as one job, with its point steps and kernels fused.
+                job = _image_job(
+                    image_file,
+                    "filter",
+                    adjust_image,
+                    {"target_format": target_format, "steps": steps},
+                    _download_name(f"filtered_{filter_name}", target_format),
+                    "filtered_image",
+                )
+
+    return context, job
+
+
+def image_filters_view(request):
+    context, job = _single_image(request, *_image_filters_form(request))
+    return _image_tool_response(request, "tools/image_filters.html", context, job)
+
+
+def pipeline_view(request):
+    if request.method != "POST":
+        return HttpResponseNotAllowed(["POST"])
+
+    allowed_formats = {"png", "jpeg", "webp"}
+    target_format = request.POST.get("target_format", "png").lower()
+    image_file = request.FILES.get("image_file")
+
+    try:
+        operations = validate_operations(json.loads(request.POST.get("operations", "[]")))
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    if target_format not in allowed_formats:
+        return JsonResponse({"error": "Unsupported format requested."}, status=400)
+    if not image_file:
+        return JsonResponse({"error": "Please upload an image file."}, status=400)
+
+    job = _image_job(
+        image_file,
+        "pipeline",
+        run_pipeline,
+        {"target_format": target_format, "operations": operations},
+        _download_name("processed", target_format),
+        "result",
+    )
+    try:
+        data = _cached_transform(job)
+    except ImageTooLarge:
+        return JsonResponse({"error": "This image is too large to process."}, status=413)
+    except ExecutorBusy:
+        return JsonResponse({"error": "The server is busy processing other images."}, status=503)
+    except ExecutorTimeout:
+        return JsonResponse({"error": "Processing took too long."}, status=504)
+    except Exception:
+        return JsonResponse({"error": "Could not process the uploaded image."}, status=422)
+
+    with stage("response"):
+        if wants_image(request, target_format):
+            return result_response(data, target_format, job["download_name"])
+        return JsonResponse(
+            {
+                "result": result_src(request, data, target_format, job["download_name"]),
+                "format": target_format,
+                "bytes": len(data),
+                "operations": operations,
+            }
+        )
+
+
+@csrf_exempt
+def image_inspect_view(request):
+    # Only the start of each upload is kept, so the handler goes in before anything reads
+    # request.POST and CSRF is checked by the inner view (as file_hash_view does). A body that
+    # is the image itself, rather than a multipart form, is read only as far as its header.
+    if request.method != "POST":
+        return HttpResponseNotAllowed(["POST"])
+
+    handler = HeaderUploadHandler(request)
+    with stage("parse"):
+        if request.content_type == "multipart/form-data":
+            request.upload_handlers = [handler]
+            request.POST
+            uploads = None
         else:
             try:
-                image = Image.open(image_file)
-                processed = filter_map[filter_name](image)
-                if target_format == "jpeg" and processed.mode in ("RGBA", "P"):
-                    processed = processed.convert("RGB")
-
-                buffer = io.BytesIO()
-                save_kwargs = {"format": target_format.upper()}
-                if target_format in {"jpeg", "webp"}:
-                    save_kwargs.update({"quality": 90, "optimize": True})
-                    if target_format == "webp":
-                        save_kwargs["method"] = 6
-                processed.save(buffer, **save_kwargs)
-
-                filtered_image = base64.b64encode(buffer.getvalue()).decode("ascii")
-                download_ext = "jpg" if target_format == "jpeg" else target_format
-                download_name = f"filtered_{filter_name}.{download_ext}"
+                uploads = [read_header_upload(request, handler)]
+            except ValueError as e:
+                return JsonResponse({"error": str(e)}, status=400)
+    if handler.too_many:
+        return JsonResponse({"error": f"Inspect at most {settings.IMAGE_INSPECT['MAX_FILES']} files at once."}, status=400)
+    return _image_inspect_view(request, uploads)
+
+
+@csrf_protect
+def _image_inspect_view(request, uploads):
+    if uploads is None:
+        uploads = request.FILES.getlist("file")
+    if not uploads:
+        return JsonResponse({"error": "Please upload at least one file."}, status=400)
+
+    results = []
+    with stage("decode"):
+        for upload in uploads:
+            result = {"name": upload.name, "bytes": upload.size, "bytes_read": len(upload.head)}
+            try:
+                result.update(describe_image(upload.head, upload.complete))
+            except ValueError as e:
+                result["error"] = str(e)
+            results.append(result)
+    return JsonResponse({"files": results})
+
+
+BATCH_FORMS = {
+    "compress": _image_compress_form,
+    "convert": _image_convert_form,
+    "resize": _image_resize_form,
+    "filters": _image_filters_form,
+}
+
+
+def _batch_results(jobs):
+    # Keep at most one job per worker in flight so neither the inputs nor the outputs of the
+    # whole batch are held in memory; results are yielded in completion order.
+    executor = get_executor()
+    cache = get_transform_cache()
+    jobs = iter(jobs)
+    next_job = next(jobs, None)
+    pending = {}
+
+    while next_job is not None or pending:
+        while next_job is not None and len(pending) < executor.max_workers:
+            job = next_job
+            try:
+                key = cache.make_key(job["image_file"], job["operation"], job["params"])
+                data = cache.get(key)
+                if data is not None:
+                    yield job, data, None
+                else:
+                    # Only wait for memory when nothing is in flight; otherwise finish a job first.
+                    future = _submit_image_job(executor, job, _read_upload(job["image_file"]), blocking=not pending)
+                    pending[future] = (job, key, time.monotonic() + executor.timeout)
+            except ExecutorBusy:
+                if pending:
+                    break
+                yield job, None, "The server is busy processing other images."
+            except (ImageTooLarge, Image.DecompressionBombError):
+                yield job, None, "This image is too large to process."
+            except (ValueError, OSError):
+                # A truncated or corrupt file becomes an error entry instead of breaking the
+                # archive that is already streaming.
+                yield job, None, "Could not process the uploaded image."
+            next_job = next(jobs, None)
+
+        if not pending:
+            continue
+
+        next_deadline = min(deadline for _, _, deadline in pending.values())
+        done, _ = wait(pending, timeout=max(0, next_deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+
+        for future in done:
+            job, key, _ = pending.pop(future)
+            try:
+                data, _ = future.result()
             except Exception:
-                error_message = "Could not process the uploaded image. Please try another file."
+                yield job, None, "Could not process the uploaded image."
+            else:
+                cache.set(key, data)
+                yield job, data, None
 
-    context = {
-        "filtered_image": filtered_image,
-        "filter_name": filter_name,
-        "filter_options": filter_labels,
-        "target_format": target_format,
-        "download_name": download_name,
-        "error_message": error_message,
-    }
-    return render(request, "tools/image_filters.html", context)
+        now = time.monotonic()
+        for future, (job, _, deadline) in list(pending.items()):
+            if deadline <= now:
+                future.cancel()
+                del pending[future]
+                yield job, None, "Processing took too long."
+
+
+def _batch_entries(jobs):
+    manifest = []
+    used_names = set()
+
+    for job, data, error in _batch_results(jobs):
+        source_name = job["image_file"].name
+        if error is not None:
+            manifest.append({"source": source_name, "status": "error", "error": error})
+            continue
+
+        stem = os.path.splitext(os.path.basename(source_name))[0] or "image"
+        ext = os.path.splitext(job["download_name"])[1]
+        entry_name = f"{stem}{ext}"
+        counter = 1
+        while entry_name in used_names:
+            counter += 1
+            entry_name = f"{stem}-{counter}{ext}"
+        used_names.add(entry_name)
+
+        manifest.append({"source": source_name, "status": "ok", "entry": entry_name, "bytes": len(data)})
+        yield entry_name, data, zipfile.ZIP_STORED
+
+    yield "manifest.json", json.dumps({"files": manifest}, indent=2).encode("utf-8"), zipfile.ZIP_DEFLATED
+
+
+def image_batch_view(request, tool):
+    if tool not in BATCH_FORMS:
+        raise Http404("Unknown batch tool.")
+    if request.method != "POST":
+        return HttpResponseNotAllowed(["POST"])
+
+    context, job = BATCH_FORMS[tool](request)
+    if job is None:
+        return JsonResponse({"error": context["error_message"]}, status=400)
+
+    set_labels(format=job["target_format"])
+    jobs = [dict(job, image_file=image_file) for image_file in request.FILES.getlist("image_file")]
+    response = StreamingHttpResponse(stream_zip(_batch_entries(jobs)), content_type="application/zip")
+    response["Content-Disposition"] = f'attachment; filename="{tool}-batch.zip"'
+    return response
 
 
 
@@ -416,30 +1123,239 @@ def image_filters_view(request):
 '''
 
 
-def file_hash_view(request):
-    context = {}
+def _file_hash_form(request):
+    context = {"mode": "hash"}
+    uploaded_files = []
+    algorithm = None
 
     if request.method == "POST":
-        uploaded_file = request.FILES.get("file")
+        uploaded_files = request.FILES.getlist("file")
         algorithm = request.POST.get("algorithm", "sha256")
+        context["mode"] = request.POST.get("mode", "hash")
 
-        if not uploaded_file:
+        if any(getattr(handler, "too_large", False) for handler in request.upload_handlers):
+            # HashingUploadHandler stopped reading the body, so the form fields may be missing.
+            context["error_message"] = "File size is too large."
+
+        elif not uploaded_files:
             context["error_message"] = "Please select a file."
 
-        elif uploaded_file.size > settings.MAX_UPLOAD_FILE_SIZE:
+        elif any(uploaded_file.size > settings.MAX_UPLOAD_FILE_SIZE for uploaded_file in uploaded_files):
             context["error_message"] = "File size is too large."
 
-        else:
-            try:
-                hash_value = calculate_file_hash(uploaded_file, algorithm)
+        elif context["mode"] == "compare" and len(uploaded_files) != 2:
+            context["error_message"] = "Please select exactly two files to compare."
+
+        if "error_message" in context:
+            uploaded_files = []
+
+    return context, uploaded_files, algorithm
+
+
+def _file_hash_results(context, uploaded_files, algorithm):
+    try:
+        if algorithm not in ALL_ALGORITHMS:
+            raise ValueError(f"Unsupported algorithm: {algorithm}")
+
+        if context["mode"] == "compare":
+            context.update({
+                "comparison": compare_files(*uploaded_files),
+                "algorithm": algorithm,
+                "file_names": [uploaded_file.name for uploaded_file in uploaded_files],
+            })
+            return context
+
+        executor = get_hash_executor()
+        results = []
+        for uploaded_file, hexdigests in zip(uploaded_files, hash_files(uploaded_files, tuple(ALL_ALGORITHMS), executor)):
+            result = {
+                "file_name": uploaded_file.name,
+                "size": uploaded_file.size,
+                "hash_value": hexdigests[algorithm],
+                "all_hashes": sorted(hexdigests.items()),
+            }
+            if algorithm in TREE_ALGORITHMS:
+                manifest = calculate_file_manifest(uploaded_file, algorithm, executor)
+                manifest["file_name"] = uploaded_file.name
+                key = store_result(json.dumps(manifest, indent=2).encode("utf-8"), "json", f"{uploaded_file.name}.{algorithm}.json")
+                result["manifest_url"] = reverse("tools:result", args=[key])
+                result["chunk_count"] = len(manifest["chunks"])
+            results.append(result)
+
+        context.update({
+            "hash_value": results[0]["hash_value"],
+            "algorithm": algorithm,
+            "file_name": results[0]["file_name"],
+            "all_hashes": results[0]["all_hashes"],
+            "manifest_url": results[0].get("manifest_url"),
+            "chunk_count": results[0].get("chunk_count"),
+            "results": results,
+        })
+
+    except ValueError as e:
+        context["error_message"] = str(e)
+
+    return context
+
+
+@csrf_exempt
+def file_hash_view(request):
+    # The hashing handler must be installed before anything reads request.POST, so CSRF is
+    # checked by the inner view instead of the middleware.
+    request.upload_handlers = [HashingUploadHandler(request)]
+    # Uploads are hashed while the body is parsed, so most of the hashing shows up here.
+    with stage("parse"):
+        request.POST
+    return _file_hash_view(request)
 
-                context.update({
-                    "hash_value": hash_value,
-                    "algorithm": algorithm,
-                    "file_name": uploaded_file.name,
-                })
 
-            except ValueError as e:
-                context["error_message"] = str(e)
+@csrf_protect
+def _file_hash_view(request):
+    context, uploaded_files, algorithm = _file_hash_form(request)
 
-    return render(request, "tools/file_hash.html", context)
+    if uploaded_files:
+        with stage("hash"):
+            context = _file_hash_results(context, uploaded_files, algorithm)
+
+    return _render(request, "tools/file_hash.html", context)
+
+
+def result_view(request, key):
+    response = serve_result(request, key)
+    if response is None:
+        raise Http404("Result not found or expired.")
+    return response
+
+
+def result_status_view(request, token):
+    pending = load_pending_result(token)
+    if pending is None:
+        raise Http404("Result not found or expired.")
+
+    if pending["status"] == "done":
+        return JsonResponse(
+            {
+                "status": "done",
+                "result": reverse("tools:result", args=[pending["key"]]),
+                "download_name": pending["download_name"],
+            }
+        )
+    return JsonResponse(pending)
+
+
+def transform_cache_stats_view(request):
+    return JsonResponse(get_transform_cache().stats())
+
+
+def qr_cache_stats_view(request):
+    return JsonResponse(qr_cache_stats())
+
+
+@csrf_exempt
+def job_submit_view(request, kind):
+    # The upload is streamed into the job's directory before the view runs, so CSRF is
+    # checked by the inner view (as file_hash_view does).
+    if request.method != "POST":
+        return HttpResponseNotAllowed(["POST"])
+    if kind not in Job.Kind.values:
+        raise Http404("Unknown job kind.")
+
+    job_id = uuid.uuid4()
+    # Image jobs that are too large to decode at once can still be processed in strips.
+    max_size = settings.IMAGE_TILING["MAX_UPLOAD_SIZE"] if kind == Job.Kind.IMAGE else settings.MAX_UPLOAD_FILE_SIZE
+    handler = JobUploadHandler(request, job_directory(job_id), max_size)
+    request.upload_handlers = [handler]
+    with stage("parse"):
+        request.POST
+
+    if handler.too_large:
+        response = JsonResponse({"error": f"Uploads are limited to {max_size // (1024 * 1024)} MB."}, status=413)
+    else:
+        response = _job_submit(request, kind, job_id)
+    if response.status_code != 202:
+        shutil.rmtree(job_directory(job_id), ignore_errors=True)
+    return response
+
+
+def _job_params(request, kind):
+    if kind == Job.Kind.HASH:
+        algorithm = request.POST.get("algorithm", "sha256")
+        if algorithm not in ALL_ALGORITHMS:
+            raise ValueError(f"Unsupported algorithm: {algorithm}")
+        return {"algorithm": algorithm}
+
+    target_format = request.POST.get("target_format", "png").lower()
+    if target_format not in {"png", "jpeg", "webp"}:
+        raise ValueError("Unsupported format requested.")
+    operations = validate_operations(json.loads(request.POST.get("operations", "[]")))
+    params = {"target_format": target_format, "operations": operations}
+    if request.POST.get("tiled") == "1":
+        if target_format != "png":
+            raise ValueError("Tiled processing only writes PNG.")
+        params["tiled"] = True
+    return params
+
+
+@csrf_protect
+def _job_submit(request, kind, job_id):
+    upload = request.FILES.get("file")
+    if upload is None:
+        return JsonResponse({"error": "Please upload a file."}, status=400)
+    try:
+        params = _job_params(request, kind)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    job = create_job(job_id, kind, upload, params)
+    return JsonResponse(_job_payload(job), status=202)
+
+
+def _job_payload(job):
+    payload = {
+        "id": str(job.id),
+        "kind": job.kind,
+        "status": job.status,
+        "input_name": job.input_name,
+        "input_size": job.input_size,
+        "created_at": job.created_at.isoformat(),
+        "started_at": job.started_at and job.started_at.isoformat(),
+        "finished_at": job.finished_at and job.finished_at.isoformat(),
+        "queued_seconds": job.queued_seconds,
+        "run_seconds": job.run_seconds,
+        "timings": job.timings,
+        "result": job.result,
+        "error": job.error or None,
+        "status_url": reverse("tools:job_status", args=[job.id]),
+    }
+    if job.status == Job.Status.DONE and job.output_path:
+        payload["result_url"] = reverse("tools:job_result", args=[job.id])
+    return payload
+
+
+def job_status_view(request, job_id):
+    try:
+        job = Job.objects.get(pk=job_id)
+    except Job.DoesNotExist:
+        raise Http404("Job not found or expired.")
+    return JsonResponse(_job_payload(job))
+
+
+def job_result_view(request, job_id):
+    try:
+        job = Job.objects.get(pk=job_id)
+    except Job.DoesNotExist:
+        raise Http404("Job not found or expired.")
+
+    if job.status != Job.Status.DONE:
+        return JsonResponse({"error": "The job has not finished.", "status": job.status}, status=409)
+    if not job.output_path or not os.path.exists(job.output_path):
+        raise Http404("This job has no output file.")
+    return FileResponse(open(job.output_path, "rb"), content_type=job.content_type, as_attachment=True, filename=job.output_name)
+
+
+def image_memory_stats_view(request):
+    return JsonResponse(get_memory_budget().stats())
+
+
+def metrics_view(request):
+    return HttpResponse(render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8")